@@ -0,0 +1,224 @@
+"""
+Benchmark KongAPI and KongManagement against the fake Kong Admin API.
+
+Measure registration, listing and teardown throughput and per-call latency
+(p50/p99) for gateways of different sizes, so performance can be compared
+between releases without a real Kong.
+
+Usage:
+    python benchmark/run_benchmark.py --sizes 10 1000 10000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+
+_root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(_root_dir, "src"))
+sys.path.insert(0, _root_dir)
+
+from tests.fake_kong import FakeKongServer  # NOQA
+from pumpwood_kong.kong import KongManagement  # NOQA
+from pumpwood_kong.kong_api import KongAPI  # NOQA
+from pumpwood_kong.transport import KongTransport  # NOQA
+from pumpwood_kong.retry import RetryPolicy  # NOQA
+
+
+class TimedTransport(KongTransport):
+    """Transport that keeps the duration of each call."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.durations = []
+
+    def request(self, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, **kwargs)
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+    def pop_durations(self) -> list:
+        durations = self.durations
+        self.durations = []
+        return durations
+
+
+def _serve_fake_kong(url_queue, kwargs: dict):
+    server = FakeKongServer(**kwargs)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def fake_kong(in_process: bool = False, **kwargs):
+    """
+    Run fake Kong on a child process and yield its url.
+
+    Client and server on the same interpreter compete for the GIL, which
+    adds thread switch delays to each call. The server runs on a child
+    process unless in_process is set.
+    """
+    if in_process:
+        with FakeKongServer(**kwargs) as server:
+            yield server.url
+        return
+    url_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve_fake_kong, args=(url_queue, kwargs), daemon=True)
+    process.start()
+    try:
+        yield url_queue.get(timeout=30)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def percentile(values: list, q: float) -> float:
+    """Return q percentile (0-100) of values using nearest rank."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values))) - 1))
+    return values[rank]
+
+
+def _stats(name: str, n_items: int, elapsed: float, durations: list) -> dict:
+    return {
+        "operation": name,
+        "items": n_items,
+        "calls": len(durations),
+        "seconds": elapsed,
+        "items_per_second": n_items / elapsed if elapsed else None,
+        "p50_ms": (percentile(durations, 50) or 0) * 1000,
+        "p99_ms": (percentile(durations, 99) or 0) * 1000}
+
+
+def run_case(n_routes: int, routes_per_service: int = 10,
+             max_workers: int = 10, latency: float = 0,
+             error_rate: float = 0, list_repeat: int = 5,
+             in_process: bool = False) -> list:
+    """
+    Run registration, listing and teardown for a gateway size.
+
+    Args:
+        n_routes [int]: Number of routes of the gateway.
+    Kwargs:
+        routes_per_service [int]: Routes registered on each service.
+        max_workers [int]: Concurrent calls on batch operations.
+        latency [float]: Latency injected on fake Kong calls (seconds).
+        error_rate [float]: Fraction of fake Kong calls answered with 503.
+        list_repeat [int]: Number of list_all_routes calls.
+        in_process [bool]: Run fake Kong on the benchmark process.
+    Return [list(dict)]:
+        Statistics of each operation.
+    """
+    n_services = max(1, n_routes // routes_per_service)
+    results = []
+    with fake_kong(in_process=in_process, latency=latency,
+                   error_rate=error_rate) as fake_url:
+        retry_policy = None
+        if error_rate:
+            retry_policy = RetryPolicy(backoff_factor=0.001)
+        transport = TimedTransport(
+            pool_maxsize=max_workers, retry_policy=retry_policy)
+        kong_api = KongAPI(api_gateway_url=fake_url, transport=transport)
+
+        # KongManagement startup registration
+        start = time.perf_counter()
+        KongManagement(
+            api_gateway_url=fake_url, transport=transport,
+            service_name="benchmark-app", service_url="http://app:5000/",
+            healthcheck_endpoint="/health-check/benchmark-app/",
+            auth_static_service="http://app-static:5000/",
+            test_reloaddb_service="http://app-db:5000/")
+        results.append(_stats(
+            "kong_management_startup", 1, time.perf_counter() - start,
+            transport.pop_durations()))
+
+        # services and routes registration
+        start = time.perf_counter()
+        for i in range(n_services):
+            kong_api.put_service("service-%d" % i, {
+                "name": "service-%d" % i,
+                "url": "http://service-%d:5000/" % i})
+        routes = [
+            ("route-%d" % i, ["/rest/model-%d/" % i],
+             "service-%d" % (i % n_services))
+            for i in range(n_routes)]
+        kong_api.register_routes(routes, max_workers=max_workers)
+        results.append(_stats(
+            "registration", n_services + n_routes,
+            time.perf_counter() - start, transport.pop_durations()))
+
+        # listing
+        start = time.perf_counter()
+        for _ in range(list_repeat):
+            kong_api.list_all_routes()
+        results.append(_stats(
+            "list_all_routes", n_routes * list_repeat,
+            time.perf_counter() - start, transport.pop_durations()))
+
+        # teardown
+        start = time.perf_counter()
+        kong_api.delete_routes_and_service(max_workers=max_workers)
+        results.append(_stats(
+            "teardown", n_services + n_routes,
+            time.perf_counter() - start, transport.pop_durations()))
+    for result in results:
+        result["size"] = n_routes
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 1000, 10000],
+        help="Number of routes of each benchmark case.")
+    parser.add_argument("--routes-per-service", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=0,
+        help="Latency injected on fake Kong calls in seconds.")
+    parser.add_argument(
+        "--error-rate", type=float, default=0,
+        help="Fraction of fake Kong calls answered with 503.")
+    parser.add_argument("--list-repeat", type=int, default=5)
+    parser.add_argument(
+        "--in-process", action="store_true",
+        help="Run fake Kong on the benchmark process.")
+    parser.add_argument(
+        "--output", default=None, help="Path to save results as JSON.")
+    args = parser.parse_args()
+
+    all_results = []
+    header = "{:>7} {:<24} {:>8} {:>7} {:>9} {:>11} {:>9} {:>9}".format(
+        "size", "operation", "items", "calls", "seconds", "items/s",
+        "p50 ms", "p99 ms")
+    print(header)
+    print("-" * len(header))
+    for size in args.sizes:
+        results = run_case(
+            n_routes=size, routes_per_service=args.routes_per_service,
+            max_workers=args.workers, latency=args.latency,
+            error_rate=args.error_rate, list_repeat=args.list_repeat,
+            in_process=args.in_process)
+        for r in results:
+            print(
+                "{:>7} {:<24} {:>8} {:>7} {:>9.3f} {:>11.1f} {:>9.2f} "
+                "{:>9.2f}".format(
+                    r["size"], r["operation"], r["items"], r["calls"],
+                    r["seconds"], r["items_per_second"], r["p50_ms"],
+                    r["p99_ms"]))
+        all_results.extend(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(all_results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,10 @@ setuptools.setup(
     install_requires=[
         'requests'
     ],
+    extras_require={
+        'async': ['httpx'],
+        'dbless': ['PyYAML'],
+    },
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.6",
 )
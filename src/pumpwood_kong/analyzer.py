@@ -0,0 +1,348 @@
+"""
+Analyze Kong route table and compact routes of the same service.
+
+Kong rebuilds its router on each route change and its cost grows with the
+number of routes. The analyzer finds duplicate, shadowed and overlapping
+paths and proposes merging routes of a service that have the same matching
+and proxy settings in a single route with all their paths.
+"""
+from .executor import ConcurrentExecutor, Task
+
+
+# Fields that identify a route or that are changed by merging
+_merge_ignored_fields = set([
+    "id", "name", "paths", "created_at", "updated_at", "tags"])
+# Fields that define which requests a path matches besides the path
+_match_fields = ["hosts", "methods", "headers", "snis", "sources",
+                 "destinations"]
+
+
+def _route_label(route: dict) -> str:
+    return route.get("name") or route["id"]
+
+
+def _freeze(value):
+    """Return a hashable version of Kong field values."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(sorted(_freeze(x) for x in value))
+    return value
+
+
+class CompactionPlan:
+    """Routes merges proposed by RouteTableAnalyzer.plan_compaction."""
+
+    def __init__(self, merges: list, routes_before: int,
+                 paths_before: int):
+        """
+        __init__.
+
+        Args:
+            merges [list(dict)]: Merges with 'keep' (route kept with all
+                paths), 'remove' (routes removed), 'service' and 'paths'.
+            routes_before [int]: Number of routes before compaction.
+            paths_before [int]: Number of paths before compaction.
+        """
+        self.merges = merges
+        self.routes_before = routes_before
+        self.paths_before = paths_before
+
+    @property
+    def routes_after(self) -> int:
+        """Number of routes after compaction."""
+        return self.routes_before - sum(
+            len(x["remove"]) for x in self.merges)
+
+    @property
+    def paths_after(self) -> int:
+        """Number of paths after compaction, duplicates are removed."""
+        return self.paths_before - sum(
+            x["removed_paths"] for x in self.merges)
+
+    def summary(self) -> dict:
+        """Return before/after routes and paths counts."""
+        return {
+            "merges": len(self.merges),
+            "routes_before": self.routes_before,
+            "routes_after": self.routes_after,
+            "paths_before": self.paths_before,
+            "paths_after": self.paths_after}
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the plan."""
+        return {
+            "summary": self.summary(),
+            "merges": [
+                dict((k, v) for k, v in x.items() if k != "payload")
+                for x in self.merges]}
+
+    def apply(self, kong_api, max_workers: int = 10) -> list:
+        """
+        Apply the merges on Kong.
+
+        Kept routes are updated with all paths before the merged routes are
+        removed, so no path is unrouted during compaction.
+
+        Args:
+            kong_api [KongAPI]: Client of the Kong.
+        Kwargs:
+            max_workers [int]: Maximum number of concurrent calls.
+        Return [list(TaskResult)]:
+            Outcome of each write with ('route', name) keys for updates and
+            ('delete', name) for removals. Removals are skipped if the
+            update of the kept route fails.
+        """
+        tasks = []
+        for merge in self.merges:
+            keep_key = ("route", merge["keep"])
+            tasks.append(Task(
+                key=keep_key, func=kong_api.put_route,
+                args=(merge["keep"], merge["payload"])))
+            for route_id in merge["remove_ids"]:
+                tasks.append(Task(
+                    key=("delete", route_id), func=kong_api.delete_route,
+                    args=(route_id, ), depends_on=[keep_key]))
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        return list(executor.run(tasks).values())
+
+
+class RouteTableAnalyzer:
+    """
+    Analyze a Kong route table.
+
+    Only route paths are analyzed, regex paths (starting with '~') are
+    counted but not compared with the others.
+    """
+
+    def __init__(self, routes: list, services: list = None,
+                 plugins: list = None):
+        """
+        __init__.
+
+        Args:
+            routes [list(dict)]: Kong routes.
+        Kwargs:
+            services [list(dict)]: Kong services, used to report names.
+            plugins [list(dict)]: Kong plugins, routes with plugins are not
+                merged as their plugins would be lost.
+        """
+        self.routes = list(routes)
+        self.services = dict((x["id"], x) for x in services or [])
+        self.routes_with_plugins = set(
+            (x.get("route") or {}).get("id") for x in plugins or [])
+        self.routes_with_plugins.discard(None)
+
+    @classmethod
+    def from_kong(cls, kong_api,
+                  page_size: int = 1000) -> "RouteTableAnalyzer":
+        """
+        Build an analyzer with routes, services and plugins of a Kong.
+
+        Args:
+            kong_api [KongAPI]: Client of the Kong.
+        Kwargs:
+            page_size [int]: Page size used to fetch the collections.
+        Return [RouteTableAnalyzer]:
+            Analyzer of the live route table.
+        """
+        return cls(
+            routes=kong_api.iter_routes(size=page_size, prefetch=True),
+            services=kong_api.iter_services(size=page_size, prefetch=True),
+            plugins=kong_api.iter_plugins(size=page_size, prefetch=True))
+
+    def _service_name(self, route: dict) -> str:
+        service_id = (route.get("service") or {}).get("id")
+        service = self.services.get(service_id)
+        if service is None:
+            return service_id
+        return service.get("name") or service_id
+
+    def _match_key(self, route: dict) -> tuple:
+        return tuple(_freeze(route.get(x)) for x in _match_fields)
+
+    def _prefix_paths(self):
+        for route in self.routes:
+            for path in route.get("paths") or []:
+                if not path.startswith("~"):
+                    yield path, route
+
+    def duplicates(self) -> list:
+        """
+        Return paths registered on more than one route.
+
+        Only routes with the same hosts, methods, headers, snis, sources
+        and destinations are compared, as they match the same requests.
+
+        Return [list(dict)]:
+            {'path', 'routes'} with the names of the routes.
+        """
+        index = {}
+        for path, route in self._prefix_paths():
+            index.setdefault(
+                (path, self._match_key(route)), []).append(route)
+        return [
+            {"path": path, "routes": [_route_label(x) for x in routes]}
+            for (path, _), routes in sorted(
+                index.items(), key=lambda x: x[0][0])
+            if len(set(x["id"] for x in routes)) > 1]
+
+    def shadowed(self) -> list:
+        """
+        Return routes whose paths are all registered on other routes.
+
+        Kong uses only one of the routes for each duplicated path, a route
+        with all paths duplicated may never receive requests.
+
+        Return [list(str)]:
+            Names of the shadowed routes.
+        """
+        owners = {}
+        for path, route in self._prefix_paths():
+            owners.setdefault(
+                (path, self._match_key(route)), set()).add(route["id"])
+        results = []
+        for route in self.routes:
+            paths = [
+                x for x in route.get("paths") or []
+                if not x.startswith("~")]
+            if paths and all(
+                    len(owners[(x, self._match_key(route))]) > 1
+                    for x in paths):
+                results.append(_route_label(route))
+        return results
+
+    def overlaps(self) -> list:
+        """
+        Return paths that are prefix of paths of other services.
+
+        Requests under the longer path go to a different service than the
+        ones under the prefix, which is often unintended.
+
+        Return [list(dict)]:
+            {'prefix', 'prefix_route', 'prefix_service', 'path', 'route',
+            'service'} dicts.
+        """
+        by_path = {}
+        for path, route in self._prefix_paths():
+            by_path.setdefault(path, []).append(route)
+
+        results = []
+        for path, routes in sorted(by_path.items()):
+            for size in range(1, len(path)):
+                prefix_routes = by_path.get(path[:size])
+                if prefix_routes is None:
+                    continue
+                for prefix_route in prefix_routes:
+                    prefix_service = self._service_name(prefix_route)
+                    for route in routes:
+                        service = self._service_name(route)
+                        if service == prefix_service:
+                            continue
+                        results.append({
+                            "prefix": path[:size],
+                            "prefix_route": _route_label(prefix_route),
+                            "prefix_service": prefix_service,
+                            "path": path,
+                            "route": _route_label(route),
+                            "service": service})
+        return results
+
+    def router_size(self) -> dict:
+        """
+        Estimate router size.
+
+        Return [dict]:
+            Number of routes, paths, regex paths and match combinations
+            (paths x hosts x methods of each route), that drives router
+            rebuild time.
+        """
+        paths = 0
+        regex_paths = 0
+        combinations = 0
+        for route in self.routes:
+            route_paths = route.get("paths") or []
+            paths += len(route_paths)
+            regex_paths += sum(1 for x in route_paths if x.startswith("~"))
+            combinations += max(1, len(route_paths)) * \
+                max(1, len(route.get("hosts") or [])) * \
+                max(1, len(route.get("methods") or []))
+        return {
+            "routes": len(self.routes), "paths": paths,
+            "regex_paths": regex_paths,
+            "match_combinations": combinations}
+
+    def plan_compaction(self) -> CompactionPlan:
+        """
+        Propose merging routes of a service with the same settings.
+
+        Routes of the same service are merged if all fields except id,
+        name, paths, tags and timestamps are equal and they have no
+        plugins. Routes without paths match any path of the service and
+        routes with only regex paths are not merged. The route with more
+        paths (then lower name) is kept with
+        the sorted union of the paths. Routes managed by KongManagement are
+        registered again on next deploy, so compaction is meant for routes
+        that are not re-registered or must be followed by a change on the
+        registration code.
+
+        Return [CompactionPlan]:
+            Proposed merges with before/after counts.
+        """
+        groups = {}
+        for route in self.routes:
+            if route["id"] in self.routes_with_plugins:
+                continue
+            prefix_paths = [
+                x for x in route.get("paths") or []
+                if not x.startswith("~")]
+            if not prefix_paths:
+                continue
+            key = tuple(sorted(
+                (k, _freeze(v)) for k, v in route.items()
+                if k not in _merge_ignored_fields))
+            groups.setdefault(key, []).append(route)
+
+        merges = []
+        for routes in groups.values():
+            if len(routes) < 2:
+                continue
+            routes = sorted(routes, key=lambda x: (
+                -len(x.get("paths") or []), _route_label(x)))
+            keep = routes[0]
+            all_paths = []
+            for route in routes:
+                all_paths.extend(route.get("paths") or [])
+            paths = sorted(set(all_paths))
+            payload = dict(
+                (k, v) for k, v in keep.items()
+                if k not in ["id", "created_at", "updated_at"])
+            payload["paths"] = paths
+            merges.append({
+                "service": self._service_name(keep),
+                "keep": _route_label(keep),
+                "remove": [_route_label(x) for x in routes[1:]],
+                "remove_ids": [x["id"] for x in routes[1:]],
+                "paths": paths,
+                "removed_paths": len(all_paths) - len(paths),
+                "payload": payload})
+        merges.sort(key=lambda x: (str(x["service"]), x["keep"]))
+        return CompactionPlan(
+            merges=merges, routes_before=len(self.routes),
+            paths_before=sum(len(x.get("paths") or []) for x in self.routes))
+
+    def report(self) -> dict:
+        """
+        Return full analysis of the route table.
+
+        Return [dict]:
+            router_size, duplicates, shadowed, overlaps and compaction
+            summary.
+        """
+        return {
+            "router_size": self.router_size(),
+            "duplicates": self.duplicates(),
+            "shadowed": self.shadowed(),
+            "overlaps": self.overlaps(),
+            "compaction": self.plan_compaction().summary()}
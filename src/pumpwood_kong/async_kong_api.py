@@ -0,0 +1,479 @@
+"""Asyncio client for Kong API Gateway services and routes."""
+import asyncio
+from .kong_api import (
+    template_service, routes_url_template, _raise_for_status, tags_query,
+    _pumpwood_exception, _uuid_re)
+from .executor import Task, TaskResult, run_tasks_async
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncKongAPI:
+    """
+    Help setting routes on Kong Api from asyncio code.
+
+    It has the same methods of KongAPI as coroutines, calls are made using
+    a connection pooled httpx.AsyncClient. It must be closed with aclose or
+    used as an async context manager.
+    """
+
+    def __init__(self, api_gateway_url: str, connect_timeout: int = 300000,
+                 write_timeout: int = 300000, read_timeout: int = 300000,
+                 client=None, max_connections: int = 10,
+                 request_timeout: float = 60):
+        """
+        __init__.
+
+        Args:
+            api_gateway_url [str]: Kong Admin API url.
+        Kwargs:
+            connect_timeout [int]: Kong connect timeout.
+            write_timeout [int]: Kong write timeout.
+            read_timeout [int]: Kong read timeout.
+            client [httpx.AsyncClient]: Client used on Admin API calls, if
+                not set a new one is created.
+            max_connections [int]: Maximum number of pooled connections if
+                client is not set.
+            request_timeout [float]: Timeout of Admin API calls if client is
+                not set.
+        """
+        if httpx is None:
+            raise ImportError(
+                "httpx is necessary to use AsyncKongAPI, install it with "
+                "'pip install pumpwood-kong[async]'")
+
+        if api_gateway_url[-1] == '/':
+            api_gateway_url = api_gateway_url[:-1]
+
+        self.api_gateway_url = api_gateway_url
+        self.connect_timeout = connect_timeout
+        self.write_timeout = write_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections),
+                timeout=request_timeout)
+        self._client = client
+
+        self._url_services = "{api_gateway_url}/services".format(
+            api_gateway_url=self.api_gateway_url)
+        self._url_service = self._url_services + "/{service_id}"
+        self._url_services_routes = self._url_service + "/routes"
+
+        self._url_routes = "{api_gateway_url}/routes".format(
+            api_gateway_url=self.api_gateway_url)
+        self._url_route = self._url_routes + "/{route_id}"
+
+    async def aclose(self):
+        """Close pooled connections."""
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "AsyncKongAPI":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def _iter_pages(self, url: str, size: int = 100,
+                          prefetch: bool = False, params: dict = None):
+        """
+        Iterate over the objects of a paginated Kong collection.
+
+        Args:
+            url [str]: Url of the Kong collection.
+        Kwargs:
+            size [int]: Number of objects fetched on each page.
+            prefetch [bool]: Fetch next page while the objects of current
+                page are consumed.
+            params [dict]: Extra query parameters.
+        Return [async_generator(dict)]:
+            Async generator of the objects of the collection.
+        """
+        query = dict(params or {})
+        query["size"] = size
+
+        async def fetch_page(offset: str = None) -> dict:
+            page_query = dict(query)
+            if offset is not None:
+                page_query["offset"] = offset
+            response = await self._client.get(url, params=page_query)
+            response.raise_for_status()
+            return response.json()
+
+        next_page = asyncio.ensure_future(fetch_page())
+        try:
+            while next_page is not None:
+                page = await next_page
+                offset = page.get("offset")
+                next_page = None
+                if offset is not None:
+                    next_page = fetch_page(offset)
+                    if prefetch:
+                        next_page = asyncio.ensure_future(next_page)
+                for item in page["data"]:
+                    yield item
+        finally:
+            if next_page is not None:
+                if asyncio.isfuture(next_page):
+                    next_page.cancel()
+                else:
+                    next_page.close()
+
+    def iter_services(self, size: int = 100, prefetch: bool = False,
+                      tags=None):
+        """
+        Iterate over Kong services following pagination.
+
+        Kwargs:
+            size [int]: Number of services fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only services with these tags, see
+                KongAPI.iter_services.
+        Return [async_generator(dict)]:
+            Async generator of services avaiable at Kong.
+        """
+        return self._iter_pages(
+            self._url_services, size=size, prefetch=prefetch,
+            params=tags_query(tags))
+
+    def iter_routes(self, service_id: str = None, size: int = 100,
+                    prefetch: bool = False, tags=None):
+        """
+        Iterate over Kong routes following pagination.
+
+        Kwargs:
+            service_id [str]: Kong service id or name, if set only routes
+                of this service are returned.
+            size [int]: Number of routes fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only routes with these tags, see
+                KongAPI.iter_routes.
+        Return [async_generator(dict)]:
+            Async generator of routes avaiable at Kong.
+        """
+        if service_id is None:
+            url = self._url_routes
+        else:
+            url = self._url_services_routes.format(service_id=service_id)
+        return self._iter_pages(
+            url, size=size, prefetch=prefetch, params=tags_query(tags))
+
+    async def list_services(self, tags=None) -> list:
+        """
+        List Kong services.
+
+        Kwargs:
+            tags [str or list]: Return only services with these tags.
+        Return [list(dict)]:
+            List of services avaiable at Kong
+        """
+        return [x async for x in self.iter_services(tags=tags)]
+
+    async def list_service_routes(self, service_id: str, tags=None) -> list:
+        """
+        List service routes.
+
+        Args:
+            service_id [str]: Kong service id.
+        Kwargs:
+            tags [str or list]: Return only routes with these tags.
+        Return [list(dict)]:
+            List of routes of the service.
+        """
+        return [
+            x async for x in self.iter_routes(
+                service_id=service_id, tags=tags)]
+
+    async def delete_service(self, service_id: str) -> bool:
+        """
+        Delete a service.
+
+        Args:
+            service_id [str]: Kong service id.
+        Return [bool]:
+            Return True
+        """
+        response = await self._client.delete(
+            self._url_service.format(service_id=service_id))
+        response.raise_for_status()
+        return True
+
+    async def delete_route(self, route_id: str) -> bool:
+        """
+        Delete a route.
+
+        Args:
+            route_id [str]: Kong id for the route.
+        Return [bool]:
+            Return True
+        """
+        response = await self._client.delete(
+            self._url_route.format(route_id=route_id))
+        response.raise_for_status()
+        return True
+
+    async def delete_routes_and_service(self, list_service_id: list = None,
+                                        max_in_flight: int = 10,
+                                        tags=None) -> bool:
+        """
+        Delete all kong services and associated routes.
+
+        Services with names starting with 'test' or 'reload-db' are not
+        removed. Routes of a service are removed before the service. See
+        teardown for per-object outcomes.
+
+        Kwargs:
+            list_service_id [list]: List of service ids or names to remove
+                from Kong, repeated services are removed once.
+            max_in_flight [int]: Maximum number of concurrent calls.
+            tags [str or list]: Remove only services with these tags, see
+                teardown.
+        Return [bool]:
+            Return True.
+        """
+        results = await self.teardown(
+            list_service_id=list_service_id, max_in_flight=max_in_flight,
+            tags=tags)
+        for result in results:
+            if result.status == TaskResult.FAILED:
+                raise result.error
+        return True
+
+    async def _resolve_service_ids(self, list_service_id: list,
+                                   max_in_flight: int = 10) -> list:
+        """Resolve service names to ids removing repeated services."""
+        names = [x for x in list_service_id if not _uuid_re.match(x)]
+        ids_by_name = {}
+        if names:
+            fetched = await run_tasks_async([
+                Task(key=name, func=self.get_service, args=(name, ))
+                for name in set(names)], max_in_flight=max_in_flight)
+            for name, task_result in fetched.items():
+                if task_result.result is not None:
+                    ids_by_name[name] = task_result.result["id"]
+
+        service_ids = []
+        for service_id in list_service_id:
+            service_id = ids_by_name.get(service_id, service_id)
+            if service_id not in service_ids:
+                service_ids.append(service_id)
+        return service_ids
+
+    async def teardown(self, list_service_id: list = None,
+                       max_in_flight: int = 10, page_size: int = 1000,
+                       tags=None) -> list:
+        """
+        Delete services and their routes reporting each object outcome.
+
+        All routes are fetched in a single paginated /routes scan and
+        grouped by service, see KongAPI.teardown.
+
+        Kwargs:
+            list_service_id [list]: Ids or names of the services to remove,
+                if not set all services except testing ones are removed.
+                Names are resolved to ids and repeated services removed.
+            max_in_flight [int]: Maximum number of concurrent calls.
+            page_size [int]: Page size of the services and routes scans.
+            tags [str or list]: If list_service_id is not set, remove only
+                services with these tags, the routes scan is filtered by the
+                same tags (on Kong), see KongAPI.teardown.
+        Return [list(TaskResult)]:
+            Outcome of each delete, keys are ('route', id) and
+            ('service', id). A service is skipped if any of its routes
+            failed to be deleted.
+        """
+        route_tags = None
+        if list_service_id is None:
+            route_tags = tags
+            list_service_id = [
+                x["id"] async for x in self.iter_services(
+                    size=page_size, prefetch=True, tags=tags)
+                if not (
+                    (x["name"] or "").startswith("test") or
+                    (x["name"] or "").startswith("reload-db"))]
+        else:
+            list_service_id = await self._resolve_service_ids(
+                list_service_id, max_in_flight=max_in_flight)
+
+        service_routes = dict((x, []) for x in list_service_id)
+        if service_routes:
+            async for route in self.iter_routes(
+                    size=page_size, prefetch=True, tags=route_tags):
+                service_id = (route.get("service") or {}).get("id")
+                routes = service_routes.get(service_id)
+                if routes is not None:
+                    routes.append(route["id"])
+
+        tasks = []
+        for service_id, route_ids in service_routes.items():
+            route_keys = []
+            for route_id in route_ids:
+                route_keys.append(("route", route_id))
+                tasks.append(Task(
+                    key=("route", route_id), func=self.delete_route,
+                    kwargs={"route_id": route_id}))
+            tasks.append(Task(
+                key=("service", service_id), func=self.delete_service,
+                kwargs={"service_id": service_id}, depends_on=route_keys))
+        results = await run_tasks_async(
+            tasks, max_in_flight=max_in_flight, raise_errors=False)
+        return list(results.values())
+
+    async def put_service(self, service_name: str, payload: dict) -> dict:
+        """
+        Create or update a service using its full Kong payload.
+
+        Args:
+            service_name [str]: Name of the service.
+            payload [dict]: Kong service payload.
+        Return [dict]:
+            Kong service.
+        """
+        response = await self._client.put(
+            template_service.format(
+                api_gateway_url=self.api_gateway_url,
+                service_name=service_name),
+            json=payload)
+        _raise_for_status(response)
+        return response.json()
+
+    async def get_service(self, service_id: str) -> dict:
+        """
+        Get a service by id or name.
+
+        Args:
+            service_id [str]: Kong service id or name.
+        Return [dict]:
+            Kong service or None if it does not exist.
+        """
+        response = await self._client.get(
+            template_service.format(
+                api_gateway_url=self.api_gateway_url,
+                service_name=service_id))
+        if response.status_code == 404:
+            return None
+        _raise_for_status(response)
+        return response.json()
+
+    async def put_route(self, route_name: str, payload: dict) -> dict:
+        """
+        Create or update a route using its full Kong payload.
+
+        Args:
+            route_name [str]: Name of the route.
+            payload [dict]: Kong route payload.
+        Return [dict]:
+            Kong route.
+        """
+        response = await self._client.put(
+            routes_url_template.format(
+                api_gateway_url=self.api_gateway_url,
+                route_name=route_name),
+            json=payload)
+        _raise_for_status(response)
+        return response.json()
+
+    async def register_service(self, service_name: str, service_url: str,
+                               healthcheck_route: str = None,
+                               service_kong_id: str = None,
+                               tags: list = None) -> dict:
+        """
+        Register a service at Kong.
+
+        Args:
+            service_name [str]: Name of the service to be created.
+            service_url [str]: Url to redirect calls to this service.
+        Kwargs:
+            healthcheck_route [str]: A healthcheck end-point for the
+                service if avaiable.
+            service_kong_id [str]: ID of the service at kong.
+            tags [list(str)]: Tags of the service and health check route.
+        """
+        tags_payload = {} if tags is None else {"tags": list(tags)}
+        kong_service = await self.put_service(service_name, dict({
+            'name': service_name,
+            'url': service_url,
+            'connect_timeout': self.connect_timeout,
+            'write_timeout': self.write_timeout,
+            'read_timeout': self.read_timeout}, **tags_payload))
+        if healthcheck_route is not None:
+            await self.put_route(service_name + "--health-check", dict({
+                "paths": [healthcheck_route],
+                "strip_path": False,
+                "service": {"id": kong_service["id"]}}, **tags_payload))
+        return kong_service
+
+    async def register_route(self, route_url: str, route_name: str,
+                             service_id: str = None, service_name: str = None,
+                             strip_path: bool = False,
+                             tags: list = None) -> dict:
+        """
+        Register Route on Kong.
+
+        Args:
+            route_url [str]: End-point route to be registred service by Kong.
+            route_name [str]: Name of the route.
+        Kwargs:
+            service_id: str: Kong Service ID.
+            service_name: str = Kong Service Name.
+            strip_path [bool]: Kong strip_path of the route.
+            tags [list(str)]: Tags of the route.
+        """
+        if (service_id is None) == (service_name is None):
+            msg = (
+                "One and only one of 'service_id' and 'service_name' must "
+                "be set")
+            raise _pumpwood_exception(message=msg, payload={})
+
+        if service_id is not None:
+            service = {"id": service_id}
+        else:
+            service = {"name": service_name}
+        payload = {
+            "paths": [route_url],
+            "strip_path": strip_path,
+            "service": service}
+        if tags is not None:
+            payload["tags"] = list(tags)
+        return await self.put_route(route_name, payload)
+
+    async def list_all_routes(self, prefetch: bool = False) -> dict:
+        """
+        List all routes that have been registed to Kong.
+
+        Services and routes are fetched concurrently.
+
+        Kwargs:
+            prefetch [bool]: Fetch next pages while current ones are
+                consumed.
+        Return [dict]:
+            Dictionary with service name as key and the sorted paths of its
+            routes as value.
+        """
+        async def collect(iterator) -> list:
+            return [x async for x in iterator]
+
+        services, routes = await asyncio.gather(
+            collect(self.iter_services(prefetch=prefetch)),
+            collect(self.iter_routes(prefetch=prefetch)))
+
+        dict_services = dict((s["id"], s["name"]) for s in services)
+        dict_routes = dict((name, []) for name in dict_services.values())
+        for route in routes:
+            # Kong routes may not have a service, they are not listed
+            service_id = (route.get("service") or {}).get("id")
+            if service_id not in dict_services:
+                continue
+            dict_routes[dict_services[service_id]].extend(
+                route["paths"] or [])
+
+        for item in dict_routes.values():
+            item.sort()
+        return dict_routes
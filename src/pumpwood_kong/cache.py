@@ -0,0 +1,153 @@
+"""In-process cache of Kong services and routes topology."""
+import threading
+import time
+
+
+class KongTopologyCache:
+    """
+    Read-through cache of Kong services and routes.
+
+    Services and routes are fetched together when the cache is empty or
+    older than ttl and indexed by service name, service id, route name
+    and path. KongAPI invalidates the cache after each write it makes.
+    """
+
+    def __init__(self, kong_api, ttl: float = 30, page_size: int = 1000):
+        """
+        __init__.
+
+        Args:
+            kong_api [KongAPI]: Client used to fetch Kong topology.
+        Kwargs:
+            ttl [float]: Seconds before cached topology is refreshed, if
+                None it is kept until invalidated.
+            page_size [int]: Page size used to fetch the collections.
+        """
+        self.kong_api = kong_api
+        self.ttl = ttl
+        self.page_size = page_size
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._services = []
+        self._routes = []
+        self._services_by_id = {}
+        self._services_by_name = {}
+        self._routes_by_name = {}
+        self._routes_by_service_id = {}
+        self._routes_by_path = {}
+
+    def invalidate(self):
+        """Mark cached topology as stale, it is fetched on next read."""
+        with self._lock:
+            self._loaded_at = None
+
+    def is_fresh(self) -> bool:
+        """Return True if cached topology can be used."""
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return (time.monotonic() - self._loaded_at) < self.ttl
+
+    def refresh(self):
+        """Fetch services and routes from Kong and rebuild the indexes."""
+        with self._lock:
+            services = list(self.kong_api.iter_services(
+                size=self.page_size, prefetch=True))
+            routes = list(self.kong_api.iter_routes(
+                size=self.page_size, prefetch=True))
+
+            services_by_id = {}
+            services_by_name = {}
+            for service in services:
+                services_by_id[service["id"]] = service
+                services_by_name[service["name"]] = service
+
+            routes_by_name = {}
+            routes_by_service_id = {}
+            routes_by_path = {}
+            for route in routes:
+                if route.get("name") is not None:
+                    routes_by_name[route["name"]] = route
+                service_id = (route.get("service") or {}).get("id")
+                routes_by_service_id.setdefault(service_id, []).append(route)
+                for path in route.get("paths") or []:
+                    routes_by_path.setdefault(path, []).append(route)
+
+            self._services = services
+            self._routes = routes
+            self._services_by_id = services_by_id
+            self._services_by_name = services_by_name
+            self._routes_by_name = routes_by_name
+            self._routes_by_service_id = routes_by_service_id
+            self._routes_by_path = routes_by_path
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if not self.is_fresh():
+            with self._lock:
+                if not self.is_fresh():
+                    self.refresh()
+
+    def services(self) -> list:
+        """Return all services."""
+        self._ensure_fresh()
+        return list(self._services)
+
+    def routes(self) -> list:
+        """Return all routes."""
+        self._ensure_fresh()
+        return list(self._routes)
+
+    def get_service(self, id_or_name: str) -> dict:
+        """
+        Return a service by id or name.
+
+        Args:
+            id_or_name [str]: Kong service id or name.
+        Return [dict]:
+            Kong service or None if not found.
+        """
+        self._ensure_fresh()
+        service = self._services_by_id.get(id_or_name)
+        if service is None:
+            service = self._services_by_name.get(id_or_name)
+        return service
+
+    def get_route(self, name: str) -> dict:
+        """
+        Return a route by name.
+
+        Args:
+            name [str]: Kong route name.
+        Return [dict]:
+            Kong route or None if not found.
+        """
+        self._ensure_fresh()
+        return self._routes_by_name.get(name)
+
+    def service_routes(self, id_or_name: str) -> list:
+        """
+        Return routes of a service.
+
+        Args:
+            id_or_name [str]: Kong service id or name.
+        Return [list(dict)]:
+            Routes of the service, empty if service is not found.
+        """
+        service = self.get_service(id_or_name)
+        if service is None:
+            return []
+        return list(self._routes_by_service_id.get(service["id"], []))
+
+    def routes_by_path(self, path: str) -> list:
+        """
+        Return routes that have exactly this path.
+
+        Args:
+            path [str]: Route path.
+        Return [list(dict)]:
+            Routes with the path.
+        """
+        self._ensure_fresh()
+        return list(self._routes_by_path.get(path, []))
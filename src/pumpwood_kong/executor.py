@@ -0,0 +1,249 @@
+"""Run Admin API calls concurrently respecting their dependencies."""
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+    """Call to be executed after the tasks it depends on."""
+
+    def __init__(self, key, func, args: tuple = (), kwargs: dict = None,
+                 depends_on: list = None):
+        """
+        __init__.
+
+        Args:
+            key: Unique key of the task.
+            func [callable]: Function to be called, it may be a coroutine
+                function when using run_tasks_async.
+        Kwargs:
+            args [tuple]: Positional arguments of func.
+            kwargs [dict]: Keyword arguments of func.
+            depends_on [list]: Keys of tasks that must finish successfully
+                before this one starts. Keys not present on the task list
+                are ignored.
+        """
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.depends_on = list(depends_on or [])
+
+    def __repr__(self):
+        return "Task({key})".format(key=self.key)
+
+
+class TaskResult:
+    """Outcome of a task."""
+
+    DONE = "done"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, key, status: str, result=None,
+                 error: Exception = None):
+        """
+        __init__.
+
+        Args:
+            key: Key of the task.
+            status [str]: 'done', 'failed' or 'skipped' if a dependency has
+                failed.
+        Kwargs:
+            result: Value returned by the task.
+            error [Exception]: Exception raised by the task.
+        """
+        self.key = key
+        self.status = status
+        self.result = result
+        self.error = error
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the result."""
+        return {
+            "key": self.key, "status": self.status,
+            "error": None if self.error is None else str(self.error)}
+
+    def __repr__(self):
+        return "TaskResult({key}, {status})".format(
+            key=self.key, status=self.status)
+
+
+def _check_tasks(tasks: list) -> dict:
+    dict_tasks = {}
+    for task in tasks:
+        if task.key in dict_tasks:
+            raise ValueError(
+                "Task key [{key}] is duplicated".format(key=task.key))
+        dict_tasks[task.key] = task
+    return dict_tasks
+
+
+class _Scheduler:
+    """Track tasks whose dependencies have finished."""
+
+    def __init__(self, tasks: list):
+        self.tasks = _check_tasks(tasks)
+        self.results = {}
+        self.waiting = dict(
+            (task.key, set(x for x in task.depends_on if x in self.tasks))
+            for task in tasks)
+        self.dependents = dict((key, []) for key in self.tasks.keys())
+        for key, depends_on in self.waiting.items():
+            for dependency in depends_on:
+                self.dependents[dependency].append(key)
+
+    def ready(self) -> list:
+        """Return tasks without pending dependencies and remove them."""
+        ready_keys = [
+            key for key, depends_on in self.waiting.items()
+            if not depends_on]
+        for key in ready_keys:
+            del self.waiting[key]
+        return [self.tasks[key] for key in ready_keys]
+
+    def finish(self, result: TaskResult):
+        """Set result of a task, dependents of failed tasks are skipped."""
+        self.results[result.key] = result
+        for dependent in self.dependents[result.key]:
+            if dependent not in self.waiting:
+                continue
+            if result.status == TaskResult.DONE:
+                self.waiting[dependent].discard(result.key)
+            else:
+                del self.waiting[dependent]
+                self.finish(TaskResult(dependent, TaskResult.SKIPPED))
+
+    def check_cycles(self, running: int):
+        if running == 0 and self.waiting:
+            raise ValueError(
+                "Tasks {keys} have circular dependencies".format(
+                    keys=list(self.waiting.keys())))
+
+
+def _raise_first_error(results: dict):
+    for result in results.values():
+        if result.status == TaskResult.FAILED:
+            raise result.error
+
+
+class ConcurrentExecutor:
+    """
+    Run tasks on a thread pool with bounded parallelism.
+
+    A task starts only when all tasks it depends on have finished, tasks
+    depending on a failed one are skipped.
+    """
+
+    def __init__(self, max_workers: int = 10, raise_errors: bool = True):
+        """
+        __init__.
+
+        Kwargs:
+            max_workers [int]: Maximum number of tasks running at the same
+                time.
+            raise_errors [bool]: Raise the error of the first failed task
+                after all tasks finish.
+        """
+        self.max_workers = max_workers
+        self.raise_errors = raise_errors
+
+    def run(self, tasks: list) -> dict:
+        """
+        Run the tasks.
+
+        Args:
+            tasks [list(Task)]: Tasks to run.
+        Return [dict]:
+            TaskResult indexed by task key, in the order of tasks.
+        Exceptions:
+            Raise error of the first failed task if raise_errors is set.
+        """
+        scheduler = _Scheduler(tasks)
+        if self.max_workers <= 1:
+            running = True
+            while running:
+                ready = scheduler.ready()
+                running = bool(ready)
+                for task in ready:
+                    scheduler.finish(self._call(task))
+            scheduler.check_cycles(0)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {}
+                while True:
+                    for task in scheduler.ready():
+                        futures[pool.submit(self._call, task)] = task
+                    scheduler.check_cycles(len(futures))
+                    if not futures:
+                        break
+                    done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del futures[future]
+                        scheduler.finish(future.result())
+
+        results = dict(
+            (task.key, scheduler.results[task.key]) for task in tasks)
+        if self.raise_errors:
+            _raise_first_error(results)
+        return results
+
+    @staticmethod
+    def _call(task: Task) -> TaskResult:
+        try:
+            result = task.func(*task.args, **task.kwargs)
+        except Exception as e:
+            return TaskResult(task.key, TaskResult.FAILED, error=e)
+        return TaskResult(task.key, TaskResult.DONE, result=result)
+
+
+async def run_tasks_async(tasks: list, max_in_flight: int = 10,
+                          raise_errors: bool = True) -> dict:
+    """
+    Run tasks on the event loop with bounded parallelism.
+
+    Coroutine functions are awaited, other functions are run on the default
+    executor of the loop.
+
+    Args:
+        tasks [list(Task)]: Tasks to run.
+    Kwargs:
+        max_in_flight [int]: Maximum number of tasks running at the same
+            time.
+        raise_errors [bool]: Raise the error of the first failed task after
+            all tasks finish.
+    Return [dict]:
+        TaskResult indexed by task key, in the order of tasks.
+    """
+    scheduler = _Scheduler(tasks)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    loop = asyncio.get_running_loop()
+
+    async def call(task: Task) -> TaskResult:
+        async with semaphore:
+            try:
+                if inspect.iscoroutinefunction(task.func):
+                    result = await task.func(*task.args, **task.kwargs)
+                else:
+                    result = await loop.run_in_executor(
+                        None, lambda: task.func(*task.args, **task.kwargs))
+            except Exception as e:
+                return TaskResult(task.key, TaskResult.FAILED, error=e)
+            return TaskResult(task.key, TaskResult.DONE, result=result)
+
+    running = set()
+    while True:
+        for task in scheduler.ready():
+            running.add(asyncio.ensure_future(call(task)))
+        scheduler.check_cycles(len(running))
+        if not running:
+            break
+        done, running = await asyncio.wait(
+            running, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            scheduler.finish(future.result())
+
+    results = dict((task.key, scheduler.results[task.key]) for task in tasks)
+    if raise_errors:
+        _raise_first_error(results)
+    return results
@@ -0,0 +1,323 @@
+"""Instrumentation hooks and metrics of Kong Admin API calls."""
+import bisect
+import threading
+from urllib.parse import urlsplit
+
+
+_collections = set([
+    "services", "routes", "upstreams", "targets", "plugins", "consumers"])
+
+
+def url_template(url: str) -> str:
+    """
+    Return path of an Admin API url with object ids replaced.
+
+    Ids and names following a Kong collection are replaced by
+    '{<collection>_id}', so calls can be aggregated. Ex.:
+    'http://kong:8001/services/my-service/routes/' ->
+    '/services/{services_id}/routes'.
+
+    Args:
+        url [str]: Full url of the call.
+    Return [str]:
+        Path template.
+    """
+    parts = [x for x in urlsplit(url).path.split("/") if x]
+    template = []
+    previous = None
+    for part in parts:
+        if previous in _collections:
+            template.append("{" + previous + "_id}")
+        else:
+            template.append(part)
+        previous = part
+    return "/" + "/".join(template)
+
+
+class RequestEvent:
+    """Information of an Admin API call passed to the hooks."""
+
+    __slots__ = [
+        "method", "url", "url_template", "attempt", "start_time", "status",
+        "request_bytes", "response_bytes", "duration", "error", "context"]
+
+    def __init__(self, method: str, url: str, attempt: int = 0,
+                 start_time: float = None):
+        """
+        __init__.
+
+        Args:
+            method [str]: HTTP method.
+            url [str]: Full url of the call.
+        Kwargs:
+            attempt [int]: Retry number of the call, 0 on first attempt.
+            start_time [float]: time.perf_counter when the call started.
+        """
+        self.method = method
+        self.url = url
+        self.url_template = url_template(url)
+        self.attempt = attempt
+        self.start_time = start_time
+        self.status = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.duration = None
+        self.error = None
+        # Hooks may keep their own state of the call here
+        self.context = {}
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the event."""
+        return {
+            "method": self.method, "url": self.url,
+            "url_template": self.url_template, "attempt": self.attempt,
+            "status": self.status, "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "duration": self.duration,
+            "error": None if self.error is None else type(self.error).__name__}
+
+
+class Instrumentation:
+    """
+    Registry of hooks called on start and end of each Admin API call.
+
+    Hooks are objects with 'on_request_start(event)' and/or
+    'on_request_end(event)' methods. Errors raised by hooks are not
+    propagated to the calls.
+    """
+
+    def __init__(self, hooks: list = None):
+        """
+        __init__.
+
+        Kwargs:
+            hooks [list]: Initial hooks.
+        """
+        self._lock = threading.Lock()
+        self._start_hooks = []
+        self._end_hooks = []
+        for hook in hooks or []:
+            self.add_hook(hook)
+
+    @property
+    def enabled(self) -> bool:
+        """True if there is any hook registered."""
+        return bool(self._start_hooks or self._end_hooks)
+
+    def add_hook(self, hook):
+        """
+        Register a hook object.
+
+        Args:
+            hook: Object with on_request_start and/or on_request_end.
+        Return:
+            The hook.
+        """
+        with self._lock:
+            if hasattr(hook, "on_request_start"):
+                self._start_hooks = \
+                    self._start_hooks + [hook.on_request_start]
+            if hasattr(hook, "on_request_end"):
+                self._end_hooks = self._end_hooks + [hook.on_request_end]
+        return hook
+
+    def on_start(self, callback):
+        """Register a function called with RequestEvent on call start."""
+        with self._lock:
+            self._start_hooks = self._start_hooks + [callback]
+        return callback
+
+    def on_end(self, callback):
+        """Register a function called with RequestEvent on call end."""
+        with self._lock:
+            self._end_hooks = self._end_hooks + [callback]
+        return callback
+
+    def remove_hook(self, hook):
+        """Remove a hook object or callback."""
+        with self._lock:
+            self._start_hooks = [
+                x for x in self._start_hooks
+                if x != hook and x != getattr(hook, "on_request_start", None)]
+            self._end_hooks = [
+                x for x in self._end_hooks
+                if x != hook and x != getattr(hook, "on_request_end", None)]
+
+    def request_start(self, event: RequestEvent):
+        """Call start hooks."""
+        for hook in self._start_hooks:
+            try:
+                hook(event)
+            except Exception:
+                pass
+
+    def request_end(self, event: RequestEvent):
+        """Call end hooks."""
+        for hook in self._end_hooks:
+            try:
+                hook(event)
+            except Exception:
+                pass
+
+
+class MetricsCollector:
+    """
+    Aggregate counters and duration histograms of Admin API calls.
+
+    Metrics are labeled by method, url template and status ('error' when
+    the call raised). It can be exported on Prometheus text format.
+    """
+
+    default_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets: tuple = None, prefix: str = "kong_admin"):
+        """
+        __init__.
+
+        Kwargs:
+            buckets [tuple]: Upper bounds of duration histogram in seconds.
+            prefix [str]: Prefix of Prometheus metric names.
+        """
+        self.buckets = tuple(sorted(buckets or self.default_buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def on_request_end(self, event: RequestEvent):
+        """Add a finished call to the metrics."""
+        status = "error" if event.status is None else str(event.status)
+        key = (event.method, event.url_template, status)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {
+                    "count": 0, "duration_sum": 0.0,
+                    "request_bytes": 0, "response_bytes": 0,
+                    "buckets": [0] * len(self.buckets)}
+                self._series[key] = series
+            series["count"] += 1
+            series["duration_sum"] += event.duration or 0
+            series["request_bytes"] += event.request_bytes
+            series["response_bytes"] += event.response_bytes
+            index = bisect.bisect_left(self.buckets, event.duration or 0)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+
+    def reset(self):
+        """Remove all metrics."""
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self) -> list:
+        """
+        Return current metrics.
+
+        Return [list(dict)]:
+            One dict by method, url_template and status with count,
+            duration_sum, request_bytes, response_bytes and cumulative
+            histogram buckets as {upper_bound: count}.
+        """
+        with self._lock:
+            results = []
+            for (method, template, status), series in self._series.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                results.append({
+                    "method": method, "url_template": template,
+                    "status": status, "count": series["count"],
+                    "duration_sum": series["duration_sum"],
+                    "request_bytes": series["request_bytes"],
+                    "response_bytes": series["response_bytes"],
+                    "buckets": buckets})
+            return results
+
+    def to_prometheus(self) -> str:
+        """Return metrics on Prometheus text exposition format."""
+        name = self.prefix + "_request"
+        lines = [
+            "# TYPE {name}_duration_seconds histogram".format(name=name),
+        ]
+        snapshot = self.snapshot()
+        for series in snapshot:
+            labels = 'method="{method}",path="{url_template}",' \
+                'status="{status}"'.format(**series)
+            for bound, count in series["buckets"].items():
+                lines.append(
+                    '{name}_duration_seconds_bucket{{{labels},le="{le}"}} '
+                    '{count}'.format(
+                        name=name, labels=labels, le=bound, count=count))
+            lines.append(
+                '{name}_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                '{count}'.format(
+                    name=name, labels=labels, count=series["count"]))
+            lines.append(
+                '{name}_duration_seconds_sum{{{labels}}} {value}'.format(
+                    name=name, labels=labels, value=series["duration_sum"]))
+            lines.append(
+                '{name}_duration_seconds_count{{{labels}}} {value}'.format(
+                    name=name, labels=labels, value=series["count"]))
+        for metric in ["request_bytes", "response_bytes"]:
+            lines.append("# TYPE {name}_{metric}_total counter".format(
+                name=self.prefix, metric=metric))
+            for series in snapshot:
+                labels = 'method="{method}",path="{url_template}",' \
+                    'status="{status}"'.format(**series)
+                lines.append(
+                    "{name}_{metric}_total{{{labels}}} {value}".format(
+                        name=self.prefix, metric=metric, labels=labels,
+                        value=series[metric]))
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryHook:
+    """
+    Export Admin API calls as OpenTelemetry client spans.
+
+    It needs opentelemetry-api installed, spans are created with the
+    tracer provider configured on the application.
+    """
+
+    def __init__(self, tracer=None):
+        """
+        __init__.
+
+        Kwargs:
+            tracer [opentelemetry.trace.Tracer]: Tracer used to create the
+                spans, if not set one is taken from global tracer provider.
+        """
+        from opentelemetry import trace
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("pumpwood_kong")
+
+    def on_request_start(self, event: RequestEvent):
+        """Start a span for the call."""
+        span = self.tracer.start_span(
+            "kong_admin {method} {template}".format(
+                method=event.method, template=event.url_template),
+            kind=self._trace.SpanKind.CLIENT,
+            attributes={
+                "http.method": event.method,
+                "http.url": event.url,
+                "http.route": event.url_template,
+                "pumpwood_kong.attempt": event.attempt})
+        event.context["otel_span"] = span
+
+    def on_request_end(self, event: RequestEvent):
+        """End the span of the call."""
+        span = event.context.pop("otel_span", None)
+        if span is None:
+            return
+        if event.status is not None:
+            span.set_attribute("http.status_code", event.status)
+        span.set_attribute("http.request_content_length", event.request_bytes)
+        span.set_attribute(
+            "http.response_content_length", event.response_bytes)
+        if event.error is not None:
+            span.record_exception(event.error)
+        if event.error is not None or (event.status or 0) >= 500:
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        span.end()
@@ -2,8 +2,161 @@
 Functions to help registering kong API Gateway services and routes.
 """
 import os
+import json
+import atexit
+import time
+import hashlib
 import requests
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from .transport import KongTransport, build_transport
+from .kong_api import KongAPI, _pumpwood_exception
+from .sync import KongSync
+from .executor import ConcurrentExecutor, Task, TaskResult
+from .lease import LeaseBackend
+from . import plugins as kong_plugins
+
+
+fingerprint_tag_prefix = "pumpwood-fingerprint-"
+models_fingerprint_tag_prefix = "pumpwood-models-fingerprint-"
+
+
+def config_fingerprint(services: list, routes: list,
+                       upstreams: list = None,
+                       delete_routes: list = None) -> str:
+    """
+    Return a fingerprint of services, routes and upstreams payloads.
+
+    Payloads are serialized with sorted keys, so the fingerprint does not
+    depend on dict ordering.
+
+    Args:
+        services (list[dict]): Service payloads.
+        routes (list[dict]): Route payloads.
+    Kwargs:
+        upstreams (list[dict]): Upstream payloads.
+        delete_routes (list[str]): Names of routes to be removed.
+    Return (str):
+        Hex digest of the configuration.
+    """
+    config = {"services": services, "routes": routes}
+    if upstreams:
+        config["upstreams"] = upstreams
+    if delete_routes:
+        config["delete_routes"] = sorted(delete_routes)
+    content = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+class RegistrationPlan:
+    """
+    Services and routes to be registered by KongManagement.
+
+    Base upstreams, services and routes are registered together (and
+    fingerprinted), model routes are published after them together with
+    the removal of delete_routes, then plugins. Plans can be serialized and
+    merged, objects are indexed by name (plugins by id).
+    """
+
+    def __init__(self, services: list = None, routes: list = None,
+                 model_routes: list = None, delete_routes: list = None,
+                 upstreams: list = None, plugins: list = None):
+        """
+        __init__.
+
+        Kwargs:
+            services (list[dict]): Service payloads.
+            routes (list[dict]): Route payloads registered with services.
+            model_routes (list[dict]): Route payloads of the models.
+            delete_routes (list[str]): Names of routes to be removed.
+            upstreams (list[dict]): Upstream payloads.
+            plugins (list[dict]): Plugin payloads with ids, see
+                pumpwood_kong.plugins.
+        """
+        self.upstreams = dict((x["name"], x) for x in upstreams or [])
+        self.services = dict((x["name"], x) for x in services or [])
+        self.routes = dict((x["name"], x) for x in routes or [])
+        self.model_routes = dict((x["name"], x) for x in model_routes or [])
+        self.delete_routes = list(delete_routes or [])
+        self.plugins = dict((x["id"], x) for x in plugins or [])
+
+    def add_model_routes(self, routes: list, delete_routes: list = None):
+        """
+        Add model routes and routes to be removed after them.
+
+        Args:
+            routes (list[dict]): Route payloads.
+        Kwargs:
+            delete_routes (list[str]): Names of routes to be removed.
+        """
+        for route in routes:
+            self.model_routes[route["name"]] = route
+        for name in delete_routes or []:
+            if name not in self.delete_routes:
+                self.delete_routes.append(name)
+        # a route being registered must not be removed
+        self.delete_routes = [
+            x for x in self.delete_routes if x not in self.model_routes]
+
+    def merge(self, other: "RegistrationPlan") -> "RegistrationPlan":
+        """
+        Return a plan with objects of both plans.
+
+        Objects with the same name are taken from other.
+
+        Args:
+            other (RegistrationPlan): Plan to be merged.
+        Return (RegistrationPlan):
+            New plan.
+        """
+        merged = RegistrationPlan.from_dict(self.to_dict())
+        merged.upstreams.update(other.upstreams)
+        merged.services.update(other.services)
+        merged.routes.update(other.routes)
+        merged.plugins.update(other.plugins)
+        merged.add_model_routes(
+            list(other.model_routes.values()),
+            delete_routes=other.delete_routes)
+        return merged
+
+    @property
+    def is_empty(self) -> bool:
+        """True if there is nothing to be registered or removed."""
+        return not (
+            self.upstreams or self.services or self.routes or
+            self.model_routes or self.plugins or self.delete_routes)
+
+    def summary(self) -> dict:
+        """Return number of objects of each kind."""
+        return {
+            "upstreams": len(self.upstreams),
+            "services": len(self.services), "routes": len(self.routes),
+            "model_routes": len(self.model_routes),
+            "plugins": len(self.plugins),
+            "delete_routes": len(self.delete_routes)}
+
+    def to_dict(self) -> dict:
+        """Return a JSON serializable representation of the plan."""
+        return {
+            "upstreams": list(self.upstreams.values()),
+            "services": list(self.services.values()),
+            "routes": list(self.routes.values()),
+            "model_routes": list(self.model_routes.values()),
+            "plugins": list(self.plugins.values()),
+            "delete_routes": list(self.delete_routes)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RegistrationPlan":
+        """Build a plan from to_dict output."""
+        return cls(
+            upstreams=json.loads(json.dumps(data.get("upstreams") or [])),
+            services=json.loads(json.dumps(data.get("services") or [])),
+            routes=json.loads(json.dumps(data.get("routes") or [])),
+            model_routes=json.loads(json.dumps(
+                data.get("model_routes") or [])),
+            plugins=json.loads(json.dumps(data.get("plugins") or [])),
+            delete_routes=data.get("delete_routes"))
 
 
 class KongManagement:
@@ -17,7 +170,26 @@ class KongManagement:
                  test_reloaddb_service: str = None,
                  connect_timeout: int = None,
                  write_timeout: int = None,
-                 read_timeout: int = None):
+                 read_timeout: int = None,
+                 transport: KongTransport = None,
+                 session: requests.Session = None,
+                 request_timeout=None,
+                 sync: bool = False,
+                 max_workers: int = 4,
+                 skip_unchanged: bool = False,
+                 lease: LeaseBackend = None,
+                 tags: List[str] = None,
+                 staged_activation: bool = False,
+                 health_url: str = None,
+                 health_upstream: str = None,
+                 health_timeout: float = 120,
+                 health_poll_interval: float = 1,
+                 defer: bool = False,
+                 upstream_target: str = None,
+                 target_weight: int = 100,
+                 upstream_name: str = None,
+                 upstream_payload: dict = None,
+                 deregister_on_exit: bool = False):
         """
         __init__.
 
@@ -31,6 +203,57 @@ class KongManagement:
             auth_static_service (str): Path to the services that serve static
                 files for auth.
             test_reloaddb_service (str): Path to test database to reload db.
+            transport (KongTransport): Pooled transport used on Admin API
+                calls, if not set the process shared transport is used.
+            session (requests.Session): Session to be wrapped on a new
+                transport if transport is not set.
+            request_timeout (float or tuple): Timeout of the Admin API calls,
+                if not set transport default is used.
+            sync (bool): Compare the services and routes with the ones
+                registered on Kong and write only the ones that have changed.
+                If False all objects are written.
+            max_workers (int): Maximum number of concurrent writes to Kong,
+                routes are written after the services they reference.
+            skip_unchanged (bool): Keep a fingerprint of the services and
+                routes (and another of the model routes) as tags of the
+                service and skip all writes if the ones on Kong match, so
+                replicas starting with the same configuration make a single
+                GET. Objects changed by hand on Kong are not repaired while
+                the tags match.
+            lease (LeaseBackend): Lease used so only one replica registers
+                the service, the others wait until its fingerprint is on
+                Kong. Without skip_unchanged replicas register one at a
+                time.
+            tags (list[str]): Tags set on all services and routes, ex.:
+                owner service, environment. Tags that change on each deploy
+                (ex.: deploy id) also change the fingerprint, so each deploy
+                writes to Kong once.
+            staged_activation (bool): Register only the services and the
+                health-check route on the constructor and wait the service to
+                be healthy before register_models publishes the model routes,
+                so Kong does not send traffic to a pod still warming up.
+            health_url (str): Url polled until it answers 2xx, if not set
+                healthcheck_endpoint is joined to service_url.
+            health_upstream (str): If set, Kong upstream health checks are
+                used instead, waiting until a target of the upstream is
+                HEALTHY.
+            health_timeout (float): Maximum seconds waiting the service to be
+                healthy.
+            health_poll_interval (float): Seconds between health checks.
+            defer (bool): Do not call Kong on the constructor and on
+                register_models, they only build the registration plan
+                (self.plan) that is written by apply.
+            upstream_target (str): Address ('host:port', ex.: pod ip) of
+                this replica. If set, the service points to a Kong upstream
+                and each replica registers itself as a target, so Kong
+                balances the calls between replicas.
+            target_weight (int): Balancer weight of this replica target.
+            upstream_name (str): Name of the upstream, if not set
+                '<service_name>--upstream' is used.
+            upstream_payload (dict): Extra upstream fields, ex.: algorithm
+                and active healthchecks.
+            deregister_on_exit (bool): Remove this replica target when the
+                process exits (atexit).
         """
         if api_gateway_url[-1] == '/':
             api_gateway_url = api_gateway_url[:-1]
@@ -39,134 +262,517 @@ class KongManagement:
         self.service_url = service_url
         self.api_gateway_url = api_gateway_url
         self.healthcheck_endpoint = healthcheck_endpoint
+        self.request_timeout = request_timeout
+        self.sync = sync
+        self.max_workers = max_workers
+        self.skip_unchanged = skip_unchanged
+        self.tags = None if tags is None else list(tags)
+        self.fingerprint = None
+        self.staged_activation = staged_activation
+        self.health_url = health_url
+        self.health_upstream = health_upstream
+        self.health_timeout = health_timeout
+        self.health_poll_interval = health_poll_interval
+        self._healthy = False
+        self.defer = defer
+        self.lease = lease
+        self.plan = RegistrationPlan()
+        self.upstream_target = upstream_target
+        self.target_weight = target_weight
+        self.upstream_name = upstream_name
+        if upstream_name is None and service_name is not None:
+            self.upstream_name = service_name + "--upstream"
+        self.upstream_payload = upstream_payload
+        self.kong_target = None
+        if upstream_target is not None and deregister_on_exit:
+            atexit.register(self.deregister_target)
+        self._transport = build_transport(
+            transport=transport, session=session)
+        # Health checks share the connection pool and hooks, but are not
+        # retried nor counted on the circuit breaker, wait_healthy polls
+        self._health_transport = KongTransport(
+            session=self._transport.session,
+            instrumentation=self._transport.instrumentation)
+        self.kong_api = KongAPI(
+            api_gateway_url=api_gateway_url, transport=self._transport,
+            request_timeout=request_timeout)
+        self.kong_service = None
+        self.last_sync_plan = None
 
         if service_name is not None:
-            template_service = "{api_gateway_url}/services/{service_name}/"
-            temp_service_url = template_service.format(
-                api_gateway_url=self.api_gateway_url,
+            services, routes = self._build_desired_state(
+                auth_static_service=auth_static_service,
+                test_reloaddb_service=test_reloaddb_service,
+                connect_timeout=connect_timeout,
+                write_timeout=write_timeout,
+                read_timeout=read_timeout)
+            upstreams = []
+            if upstream_target is not None:
+                upstreams.append(dict(
+                    upstream_payload or {}, name=self.upstream_name))
+                if self.tags is not None:
+                    upstreams[0]["tags"] = list(self.tags)
+            self.plan = RegistrationPlan(
+                services=services, routes=routes, upstreams=upstreams)
+            if not defer:
+                self.apply()
+
+    def apply(self, plan: RegistrationPlan = None,
+              background: bool = False):
+        """
+        Write the registration plan to Kong.
+
+        Services and base routes are registered first (skipped if the
+        fingerprint on Kong matches, using the lease if set), then the model
+        routes, after the service is healthy if staged_activation is set,
+        and the removal of delete_routes (on the same /config call on
+        DB-less Kong), then plugins that differ from Kong. Applied objects
+        are removed from the plan.
+
+        Kwargs:
+            plan (RegistrationPlan): Plan to be applied, self.plan if not
+                set. It may be a merge of plans of many workers.
+            background (bool): Apply on a background thread.
+        Return (dict or Future):
+            Kong main service, or a Future with it if background is set.
+        """
+        if background:
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self.apply, plan=plan)
+            executor.shutdown(wait=False)
+            return future
+        if plan is None:
+            plan = self.plan
+
+        if plan.upstreams or plan.services or plan.routes:
+            upstreams = list(plan.upstreams.values())
+            services = list(plan.services.values())
+            routes = list(plan.routes.values())
+            self.fingerprint = config_fingerprint(
+                services, routes, upstreams=upstreams)
+            live_service = None
+            if self.skip_unchanged:
+                live_service = self.kong_api.get_service(self.service_name)
+            if self._has_fingerprint(live_service):
+                self.kong_service = live_service
+            elif self.lease is None:
+                self.kong_service = self._register_service(
+                    services=services, routes=routes, upstreams=upstreams)
+            else:
+                self.kong_service = self.lease.run_exclusive(
+                    name=self.service_name,
+                    func=lambda: self._register_service(
+                        services=services, routes=routes,
+                        upstreams=upstreams),
+                    check=self._registered_service)
+            plan.upstreams = {}
+            plan.services = {}
+            plan.routes = {}
+
+        if self.upstream_target is not None and self.kong_target is None:
+            self.register_target()
+
+        if plan.model_routes or plan.delete_routes:
+            model_routes = list(plan.model_routes.values())
+            models_tag = None
+            if self.skip_unchanged:
+                models_tag = models_fingerprint_tag_prefix + \
+                    config_fingerprint(
+                        [], model_routes, delete_routes=plan.delete_routes)
+            if not self._has_models_tag(models_tag):
+                if model_routes and self.staged_activation:
+                    self.wait_healthy()
+                self._write_routes(
+                    model_routes, delete_routes=plan.delete_routes)
+                if models_tag is not None:
+                    self.kong_service = self._stamp_tag(
+                        self.kong_service, models_fingerprint_tag_prefix,
+                        models_tag)
+            plan.model_routes = {}
+            plan.delete_routes = []
+
+        if plan.plugins:
+            results = self.kong_api.sync_plugins(
+                list(plan.plugins.values()), max_workers=self.max_workers)
+            errors = [x for x in results if x.status != TaskResult.DONE]
+            if errors:
+                raise errors[0].error
+            plan.plugins = {}
+        return self.kong_service
+
+    def _write_routes(self, routes: list, delete_routes: list = None):
+        """
+        Register routes in batch and remove delete_routes after them.
+
+        On DB-less Kong the removal goes on the same declarative
+        configuration, as Admin API deletes are not allowed, also with
+        sync. First error is raised.
+        """
+        if self.sync and not self.kong_api.is_dbless():
+            if routes:
+                self._register(routes=routes)
+            for route_name in delete_routes or []:
+                self.kong_api.delete_route(route_name)
+            return
+        # Sync engine writes with Admin API, so on DB-less Kong routes are
+        # also registered in batch on the declarative configuration
+        results = self.kong_api.register_routes(
+            routes, max_workers=self.max_workers,
+            delete_routes=delete_routes)
+        errors = [x for x in results if x.status != TaskResult.DONE]
+        if errors:
+            raise errors[0].error
+
+    def _is_healthy(self, timeout: float = None) -> bool:
+        """
+        Check service health once, errors count as not healthy.
+
+        Kwargs:
+            timeout (float): Maximum seconds waiting the health check,
+                health_poll_interval + 5 if not set.
+        Return (bool):
+            True if service is healthy.
+        """
+        if self.health_upstream is not None:
+            try:
+                targets = self.kong_api.upstream_health(self.health_upstream)
+            except (requests.exceptions.RequestException, ConnectionError):
+                return False
+            return any(x.get("health") == "HEALTHY" for x in targets)
+
+        url = self.health_url
+        if url is None:
+            url = urljoin(self.service_url, self.healthcheck_endpoint)
+        if timeout is None:
+            timeout = self.health_poll_interval + 5
+        try:
+            response = self._health_transport.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            return False
+        return response.ok
+
+    def wait_healthy(self, timeout: float = None) -> bool:
+        """
+        Poll the service health until it is healthy.
+
+        Health is checked with Kong upstream health if health_upstream is
+        set or calling health_url (service_url + healthcheck_endpoint by
+        default) directly. Health calls are not retried and each one waits
+        at most the time left before timeout. A healthy result is kept on
+        the object.
+
+        Kwargs:
+            timeout (float): Maximum seconds to wait, health_timeout if not
+                set.
+        Return (bool):
+            True.
+        Raises:
+            PumpWoodException: If service is not healthy before timeout.
+        """
+        if self._healthy:
+            return True
+        if self.health_upstream is None and self.health_url is None and (
+                self.service_url is None or
+                self.healthcheck_endpoint is None):
+            msg = (
+                "health_url, health_upstream or service_url and "
+                "healthcheck_endpoint must be set to check health")
+            raise _pumpwood_exception(message=msg, payload={})
+
+        timeout = self.health_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        call_timeout = self.health_poll_interval + 5
+        while not self._is_healthy(timeout=min(
+                call_timeout, max(deadline - time.monotonic(), 0.1))):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                msg = (
+                    "Service [{service_name}] is not healthy after "
+                    "{timeout} seconds, model routes were not registered")
+                raise _pumpwood_exception(
+                    message=msg, payload={
+                        "service_name": self.service_name,
+                        "timeout": timeout})
+            time.sleep(min(self.health_poll_interval, remaining))
+        self._healthy = True
+        return True
+
+    def register_target(self) -> dict:
+        """
+        Register this replica as a target of the service upstream.
+
+        Target is written on each apply, it is not part of the
+        fingerprint as each replica has its own.
+
+        Return (dict):
+            Kong target.
+        """
+        self.kong_target = self.kong_api.add_target(
+            self.upstream_name, self.upstream_target,
+            weight=self.target_weight, tags=self.tags)
+        return self.kong_target
+
+    def deregister_target(self) -> bool:
+        """
+        Remove this replica target from the service upstream.
+
+        It should be called on shutdown, before the process stops serving,
+        so Kong stops sending calls to it.
+
+        Return (bool):
+            True if a target was removed.
+        """
+        if self.kong_target is None:
+            return False
+        self.kong_api.delete_target(
+            self.upstream_name, self.upstream_target)
+        self.kong_target = None
+        return True
+
+    def _register_service(self, services: list, routes: list,
+                          upstreams: list = None) -> dict:
+        """
+        Register upstreams, services and routes and return the service.
+
+        If a lease is set, it is checked before each write so a replica
+        that lost it stops writing (LeaseLostError).
+        """
+        for upstream in upstreams or []:
+            self._ensure_lease()
+            self.kong_api.put_upstream(upstream["name"], upstream)
+        results = self._register(services=services, routes=routes)
+        service = results[("service", self.service_name)]
+        if self.skip_unchanged:
+            self._ensure_lease()
+            service = self._stamp_fingerprint(service)
+        return service
+
+    def _ensure_lease(self):
+        """Raise LeaseLostError if the registration lease was lost."""
+        if self.lease is not None:
+            self.lease.ensure_held(self.service_name)
+
+    def _leased(self, func):
+        """Wrap a write so the lease is checked before it."""
+        if self.lease is None:
+            return func
+
+        def call(*args, **kwargs):
+            self._ensure_lease()
+            return func(*args, **kwargs)
+        return call
+
+    def _registered_service(self) -> dict:
+        """Return service from Kong if its fingerprint matches or None."""
+        if not self.skip_unchanged:
+            return None
+        service = self.kong_api.get_service(self.service_name)
+        if self._has_fingerprint(service):
+            return service
+        return None
+
+    @property
+    def fingerprint_tag(self) -> str:
+        """Tag of the service with the configuration fingerprint."""
+        if self.fingerprint is None:
+            return None
+        return fingerprint_tag_prefix + self.fingerprint
+
+    def _has_fingerprint(self, service: dict) -> bool:
+        """Check if service is tagged with current fingerprint."""
+        if service is None:
+            return False
+        return self.fingerprint_tag in (service.get("tags") or [])
+
+    def _has_models_tag(self, models_tag: str) -> bool:
+        """
+        Check if model routes fingerprint is on the service.
+
+        Service fetched by apply is used, so an unchanged registration does
+        not make other calls.
+        """
+        if models_tag is None:
+            return False
+        if self.kong_service is None:
+            self.kong_service = self.kong_api.get_service(self.service_name)
+        if self.kong_service is None:
+            return False
+        return models_tag in (self.kong_service.get("tags") or [])
+
+    def _stamp_fingerprint(self, service: dict) -> dict:
+        """
+        Tag the service with the configuration fingerprint.
+
+        It is done after all services and routes are written, so a failed
+        registration is not skipped by the next replica. Service payload
+        does not have the tag, so the PUT of a changed configuration also
+        removes the previous fingerprint (and the models one, so model
+        routes are also written again).
+        """
+        return self._stamp_tag(
+            service, fingerprint_tag_prefix, self.fingerprint_tag)
+
+    def _stamp_tag(self, service: dict, prefix: str, tag: str) -> dict:
+        """Replace the service tag starting with prefix by tag."""
+        if service is None:
+            service = self.kong_api.get_service(self.service_name)
+        tags = [
+            x for x in (service.get("tags") or [])
+            if not x.startswith(prefix)]
+        return self.kong_api.patch_service(
+            self.service_name, {"tags": tags + [tag]})
+
+    def _build_desired_state(self, auth_static_service: str = None,
+                             test_reloaddb_service: str = None,
+                             connect_timeout: int = None,
+                             write_timeout: int = None,
+                             read_timeout: int = None) -> tuple:
+        """
+        Build Kong payloads of the services and routes of the service.
+
+        Routes reference the services by name, so they can be built before
+        services are created.
+
+        Return (tuple(list, list)):
+            Service and route payloads.
+        """
+        service_url = self.service_url
+        if self.upstream_target is not None:
+            # Kong resolves the upstream name used as host to its targets
+            url = urlsplit(service_url)
+            service_url = urlunsplit((
+                url.scheme, self.upstream_name, url.path, url.query,
+                url.fragment))
+        service_payload = {
+            'name': self.service_name,
+            'url': service_url}
+
+        # ajust timeouts
+        if connect_timeout is not None:
+            service_payload["connect_timeout"] = connect_timeout
+        if write_timeout is not None:
+            service_payload["write_timeout"] = write_timeout
+        if read_timeout is not None:
+            service_payload["read_timeout"] = read_timeout
+
+        services = [service_payload]
+        routes = []
+        if self.healthcheck_endpoint is not None:
+            routes.append(self._route_payload(
+                self.service_name + "--health-check",
+                [self.healthcheck_endpoint], self.service_name))
+
+        if auth_static_service is not None:
+            # Create service para Auth Static
+            static_service_name = self.service_name + "--auth-static"
+            services.append({
+                'name': static_service_name,
+                'url': auth_static_service})
+
+            # Add a rota para trazer os arquivos estaticos para auth
+            auth_static_url = "/admin/{service_name}/static/".format(
+                service_name=self.service_name)
+            routes.append(self._route_payload(
+                self.service_name + "--auth-static", [auth_static_url],
+                static_service_name))
+
+            # Add a rota para trazer os arquivos gui para auth
+            auth_gui_url = "/admin/{service_name}/gui/".format(
+                service_name=self.service_name)
+            routes.append(self._route_payload(
+                self.service_name + "--auth-gui", [auth_gui_url],
+                self.service_name))
+
+        # test-db-pumpwood-auth
+        if test_reloaddb_service is not None:
+            # create service for db reload
+            reloaddb_service_name = self.service_name + "--reloaddb"
+            services.append({
+                'name': reloaddb_service_name,
+                'url': test_reloaddb_service})
+
+            # registers rotes for reload db
+            template_reload_url = "/reload-db/{service_name}/"
+            reload_url = template_reload_url.format(
+                service_name=self.service_name)
+            routes.append(self._route_payload(
+                self.service_name + "--reloaddb", [reload_url],
+                reloaddb_service_name))
+
+            # registers rotes for connection dispose
+            template_dispose_url = \
+                "/pool-conections-dispose/{service_name}/"
+            dispose_url = template_dispose_url.format(
                 service_name=self.service_name)
-            payload = {
-                'name': self.service_name,
-                'url': self.service_url}
-
-            # ajust timeouts
-            if connect_timeout is not None:
-                payload["connect_timeout"] = connect_timeout
-            if write_timeout is not None:
-                payload["write_timeout"] = write_timeout
-            if read_timeout is not None:
-                payload["read_timeout"] = read_timeout
-
-            response = requests.put(
-                temp_service_url, json=payload)
-            response.raise_for_status()
-            self.kong_service = response.json()
-
-            routes_url_template = "{api_gateway_url}/routes/{route_name}"
-            if self.healthcheck_endpoint is not None:
-                response = requests.put(
-                    routes_url_template.format(
-                        api_gateway_url=self.api_gateway_url,
-                        route_name=self.service_name + "--health-check"
-                    ),
-                    json={
-                        "paths": [self.healthcheck_endpoint],
-                        "strip_path": False,
-                        "service": {"id": self.kong_service["id"]}
-                    })
-                response.raise_for_status()
-
-            if auth_static_service is not None:
-                # Create service para Auth Static
-                temp_service_url = template_service.format(
-                    api_gateway_url=self.api_gateway_url,
-                    service_name=self.service_name + "--auth-static")
-                response = requests.put(
-                    temp_service_url, json={
-                        'name': self.service_name + "--auth-static",
-                        'url': auth_static_service})
-                response.raise_for_status()
-                static_service = response.json()
-
-                # Add a rota para trazer os arquivos estaticos para auth
-                auth_static_url = "/admin/{service_name}/static/".format(
-                    service_name=self.service_name)
-                response = requests.put(
-                    routes_url_template.format(
-                        api_gateway_url=self.api_gateway_url,
-                        route_name=self.service_name + "--auth-static"
-                    ),
-                    json={
-                        "paths": [auth_static_url],
-                        "strip_path": False,
-                        "service": {"id": static_service["id"]}
-                    })
-                response.raise_for_status()
-
-                # Add a rota para trazer os arquivos gui para auth
-                auth_gui_url = "/admin/{service_name}/gui/".format(
-                    service_name=self.service_name)
-                response = requests.put(
-                    routes_url_template.format(
-                        api_gateway_url=self.api_gateway_url,
-                        route_name=self.service_name + "--auth-gui"
-                    ),
-                    json={
-                        "paths": [auth_gui_url],
-                        "strip_path": False,
-                        "service": {"id": self.kong_service["id"]}
-                    })
-                response.raise_for_status()
-
-            # test-db-pumpwood-auth
-            if test_reloaddb_service is not None:
-                # create service for db reload
-                temp_service_url = template_service.format(
-                    api_gateway_url=self.api_gateway_url,
-                    service_name=self.service_name + "--reloaddb")
-                response = requests.put(
-                    temp_service_url, json={
-                        'name': self.service_name + "--reloaddb",
-                        'url': test_reloaddb_service})
-                response.raise_for_status()
-                reloaddb_service = response.json()
-                #################################################
-
-                # registers rotes for reload db
-                template_reload_url = "/reload-db/{service_name}/"
-                reload_url = template_reload_url.format(
-                    service_name=self.service_name)
-
-                response = requests.put(
-                    routes_url_template.format(
-                        api_gateway_url=self.api_gateway_url,
-                        route_name=self.service_name + "--reloaddb"
-                    ),
-                    json={
-                        "paths": [reload_url],
-                        "strip_path": False,
-                        "service": {"id": reloaddb_service["id"]}
-                    })
-                response.raise_for_status()
-
-                # registers rotes for connection dispose
-                template_dispose_url = \
-                    "/pool-conections-dispose/{service_name}/"
-                dispose_url = template_dispose_url.format(
-                    service_name=self.service_name)
-                response = requests.put(
-                    routes_url_template.format(
-                        api_gateway_url=self.api_gateway_url,
-                        route_name=self.service_name + "--connection-dispose"
-                    ),
-                    json={
-                        "paths": [dispose_url],
-                        "strip_path": False,
-                        "service": {"id": self.kong_service["id"]}
-                    })
-                response.raise_for_status()
-
-    def register_models(self, models_names=List[str]):
+            routes.append(self._route_payload(
+                self.service_name + "--connection-dispose", [dispose_url],
+                self.service_name))
+        if self.tags is not None:
+            for service in services:
+                service["tags"] = list(self.tags)
+        return services, routes
+
+    def _route_payload(self, route_name: str, paths: List[str],
+                       service_name: str) -> dict:
+        """Build payload of a route without strip_path."""
+        payload = {
+            "name": route_name,
+            "paths": paths,
+            "strip_path": False,
+            "service": {"name": service_name}}
+        if self.tags is not None:
+            payload["tags"] = list(self.tags)
+        return payload
+
+    def _register(self, services: list = None, routes: list = None) -> dict:
+        """
+        Register services and routes on Kong.
+
+        If sync is set only objects that differ from Kong are written.
+
+        Kwargs:
+            services (list[dict]): Service payloads.
+            routes (list[dict]): Route payloads.
+        Return (dict):
+            Kong objects indexed by (entity, name) tuples, entity is
+            'service' or 'route'.
+        """
+        services = services or []
+        routes = routes or []
+        results = {}
+        if self.sync:
+            self._ensure_lease()
+            kong_sync = KongSync(
+                kong_api=self.kong_api, max_workers=self.max_workers)
+            self.last_sync_plan = kong_sync.sync(
+                services=services, routes=routes)
+            for action in self.last_sync_plan.actions:
+                results[(action.entity, action.name)] = \
+                    action.result or action.live
+            return results
+
+        tasks = [
+            Task(key=("service", service["name"]),
+                 func=self._leased(self.kong_api.put_service),
+                 args=(service["name"], service))
+            for service in services]
+        service_names = set(x["name"] for x in services)
+        for route in routes:
+            service_name = route["service"]["name"]
+            depends_on = []
+            if service_name in service_names:
+                depends_on.append(("service", service_name))
+            tasks.append(Task(
+                key=("route", route["name"]),
+                func=self._leased(self.kong_api.put_route),
+                args=(route["name"], route), depends_on=depends_on))
+        executor = ConcurrentExecutor(max_workers=self.max_workers)
+        for key, task_result in executor.run(tasks).items():
+            results[key] = task_result.result
+        return results
+
+    def register_models(self, models_names=List[str],
+                        route_per_model: bool = False):
         """
         Register end-points.
 
@@ -175,6 +781,16 @@ class KongManagement:
                 kong. It must be full path end there will be no strip_path. Ex:
                     - /rest/descriptionmodel/
                     - /rest/registration/
+        Kwargs:
+            route_per_model (bool): Register one route for each model
+                (<service_name>--model--<model>) instead of a single
+                <service_name>--endpoints route with all paths, so adding or
+                removing a model does not rewrite the others. Routes are
+                registered in batch and the single route is removed.
+
+        With staged_activation, routes are registered only after the
+        service is healthy, see wait_healthy. With defer, routes are only
+        added to the plan.
         """
         # Get EndPoint Suffix if set
         suffix = os.getenv('ENDPOINT_SUFFIX', '')
@@ -182,51 +798,150 @@ class KongManagement:
         if self.service_name is None:
             raise Exception("Service name (service_name) is not set.")
 
-        if len(models_names) != 0:
-            routes_url_template = "{api_gateway_url}/routes/{route_name}"
-            response = requests.put(
-                routes_url_template.format(
-                    api_gateway_url=self.api_gateway_url,
-                    route_name=self.service_name + "--endpoints"
-                ),
-                json={
-                    "paths": ["/rest/" + suffix.lower() + x.lower() + "/"
-                              for x in models_names],
-                    "strip_path": False,
-                    "service": {"id": self.kong_service["id"]}
-                })
-            response.raise_for_status()
-
-    def list_all_routes(self):
-        """List all routes that have been registed to Kong."""
-        routes_url_template = "{api_gateway_url}/routes/"
-        services_url_template = "{api_gateway_url}/services/"
-
-        # get services and routes avaiable on kong
-        response_services = requests.get(
-            services_url_template.format(api_gateway_url=self.api_gateway_url))
-        response_routes = requests.get(
-            routes_url_template.format(api_gateway_url=self.api_gateway_url))
-        response_services.raise_for_status()
-        response_routes.raise_for_status()
-
-        data_services = response_services.json()
-        dict_services = dict(
-            [(s["id"], s["name"]) for s in data_services["data"]])
-        data_routes = response_routes.json()
-
-        dict_routes = {}
-        for route in data_routes["data"]:
-            service_name = dict_services[route["service"]["id"]]
-            routes_in_service = dict_routes.get(service_name, [])
-            for p in route["paths"]:
-                routes_in_service.append(p)
-            dict_routes[service_name] = routes_in_service
-
-        for key, item in dict_routes.items():
-            item.sort()
-
-        for s in data_services["data"]:
-            if s["name"] not in dict_routes.keys():
-                dict_routes[s["name"]] = []
-        return dict_routes
+        if len(models_names) == 0:
+            return
+
+        if not route_per_model:
+            routes = [self._route_payload(
+                self.service_name + "--endpoints",
+                ["/rest/" + suffix.lower() + x.lower() + "/"
+                 for x in models_names],
+                self.service_name)]
+            delete_routes = []
+        else:
+            routes = [
+                self._route_payload(
+                    self._model_route_name(x),
+                    ["/rest/" + suffix.lower() + x.lower() + "/"],
+                    self.service_name)
+                for x in models_names]
+            delete_routes = [self.service_name + "--endpoints"]
+
+        if self.defer:
+            self.plan.add_model_routes(routes, delete_routes=delete_routes)
+            return
+        self.apply(plan=RegistrationPlan(
+            model_routes=routes, delete_routes=delete_routes))
+
+    def _model_route_name(self, model_name: str) -> str:
+        """Return name of the route of a model (route_per_model)."""
+        return self.service_name + "--model--" + model_name.lower()
+
+    def add_plugins(self, plugins: list):
+        """
+        Add plugins, writing only the ones that differ from Kong.
+
+        With defer plugins are only added to the plan, they are written
+        after model routes on apply.
+
+        Args:
+            plugins (list[dict]): Plugin payloads, see pumpwood_kong.plugins.
+        """
+        payloads = []
+        for payload in plugins:
+            if self.tags is not None and "tags" not in payload:
+                payload = dict(payload, tags=list(self.tags))
+            if payload.get("id") is None:
+                payload = dict(payload, id=kong_plugins.plugin_id(
+                    payload["name"], service=payload.get("service"),
+                    route=payload.get("route")))
+            payloads.append(payload)
+        plan = RegistrationPlan(plugins=payloads)
+        if self.defer:
+            self.plan = self.plan.merge(plan)
+            return
+        self.apply(plan=plan)
+
+    def _plugin_scopes(self, models_names: List[str] = None) -> list:
+        """Return service or model routes kwargs of plugin helpers."""
+        if self.service_name is None:
+            raise Exception("Service name (service_name) is not set.")
+        if models_names is None:
+            return [{"service": self.service_name}]
+        return [
+            {"route": self._model_route_name(x)} for x in models_names]
+
+    def enable_proxy_cache(self, models_names: List[str], ttl: int = 300,
+                           vary_query_params: List[str] = None,
+                           vary_headers: List[str] = None, **kwargs):
+        """
+        Cache GET responses of models routes on Kong (proxy-cache).
+
+        Models must be registered with route_per_model=True, plugins are
+        attached to <service_name>--model--<model> routes.
+
+        Args:
+            models_names (list[str]): Models which routes are cached.
+        Kwargs:
+            ttl (int): Seconds responses are kept on cache.
+            vary_query_params (list[str]): Query parameters on cache key.
+            vary_headers (list[str]): Headers on cache key, ex.:
+                Authorization so users do not share cached responses.
+            Other kwargs are passed to pumpwood_kong.plugins.proxy_cache.
+        """
+        self.add_plugins([
+            kong_plugins.proxy_cache(
+                ttl=ttl, vary_query_params=vary_query_params,
+                vary_headers=vary_headers, **dict(kwargs, **scope))
+            for scope in self._plugin_scopes(models_names)])
+
+    def enable_rate_limiting(self, models_names: List[str] = None,
+                             **kwargs):
+        """
+        Limit call rate of the service or of models routes.
+
+        Kwargs:
+            models_names (list[str]): Models which routes are limited
+                (route_per_model), if not set limit is set on the service.
+            Other kwargs are passed to pumpwood_kong.plugins.rate_limiting
+                (second, minute, hour, day, limit_by, policy).
+        """
+        self.add_plugins([
+            kong_plugins.rate_limiting(**dict(kwargs, **scope))
+            for scope in self._plugin_scopes(models_names)])
+
+    def enable_request_size_limiting(self, models_names: List[str] = None,
+                                     allowed_payload_size: int = 128,
+                                     size_unit: str = "megabytes"):
+        """
+        Limit request body size of the service or of models routes.
+
+        Kwargs:
+            models_names (list[str]): Models which routes are limited
+                (route_per_model), if not set limit is set on the service.
+            allowed_payload_size (int): Maximum request body size.
+            size_unit (str): Unit of allowed_payload_size.
+        """
+        self.add_plugins([
+            kong_plugins.request_size_limiting(
+                allowed_payload_size=allowed_payload_size,
+                size_unit=size_unit, **scope)
+            for scope in self._plugin_scopes(models_names)])
+
+    def list_all_routes(self, prefetch: bool = False):
+        """
+        List all routes that have been registed to Kong.
+
+        Kwargs:
+            prefetch (bool): Fetch next pages while current ones are
+                consumed.
+        """
+        return self.kong_api.list_all_routes(prefetch=prefetch)
+
+    def iter_all_routes(self, name_prefix: str = None, tags=None,
+                        per_service: bool = None):
+        """
+        Iterate over services and the sorted paths of their routes.
+
+        See KongAPI.iter_all_routes.
+
+        Kwargs:
+            name_prefix (str): Return only services starting with it.
+            tags (str or list): Return only services with these tags.
+            per_service (bool): Fetch the routes of each service separately,
+                if False all routes are scanned before the first tuple.
+        Return (generator(tuple)):
+            (service_name, sorted_paths) tuples.
+        """
+        return self.kong_api.iter_all_routes(
+            name_prefix=name_prefix, tags=tags, per_service=per_service)
@@ -1,17 +1,105 @@
 """Functions to help registering kong API Gateway services and routes."""
+import re
+import json
 import requests
-from pumpwood_communication import exceptions
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .transport import KongTransport, build_transport
+from .executor import ConcurrentExecutor, Task, TaskResult
+from .cache import KongTopologyCache
+from .resolver import PathResolver
+from . import snapshot
+from .plugins import plugin_id, is_plugin_changed
 
 
 template_service = "{api_gateway_url}/services/{service_name}/"
 routes_url_template = "{api_gateway_url}/routes/{route_name}/"
+_uuid_re = re.compile(
+    r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+    r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def _pumpwood_exception(message: str, payload: dict) -> Exception:
+    """
+    Build a PumpWoodException.
+
+    pumpwood_communication is imported on the first error, so importing
+    this package does not pay its import time.
+    """
+    from pumpwood_communication import exceptions
+    return exceptions.PumpWoodException(message=message, payload=payload)
+
+
+def _raise_for_status(response: requests.Response):
+    """
+    Raise PumpWoodException with Kong response text if call has failed.
+
+    Args:
+        response [requests.Response]: Response of a Kong Admin API call.
+    Exceptions:
+        PumpWoodException: If response status is an error.
+    """
+    try:
+        response.raise_for_status()
+    except Exception as e:
+        response_text = response.text
+        msg = (
+            "[{erro_type}] {error_msg}\n"
+            "[Request Text] {request_text}")
+        raise _pumpwood_exception(
+            message=msg,
+            payload={
+                "erro_type": type(e).__name__,
+                "error_msg": str(e),
+                "request_text": response_text})
+
+
+def tags_query(tags) -> dict:
+    """
+    Build Kong tags query parameters.
+
+    Args:
+        tags [str or list]: Tags filter, a list is joined with ',' (objects
+            must have all tags). A string is sent as it is, so 'a/b' returns
+            objects with any of the tags.
+    Return [dict]:
+        Query parameters or None if tags is None.
+    """
+    if tags is None:
+        return None
+    if not isinstance(tags, str):
+        tags = ",".join(tags)
+    return {"tags": tags}
+
+
+def match_tags(obj: dict, tags) -> bool:
+    """
+    Check if a Kong object matches a tags filter as Kong would.
+
+    Args:
+        obj [dict]: Kong object.
+        tags [str or list]: Tags filter, see tags_query.
+    Return [bool]:
+        True if object matches the filter or tags is None.
+    """
+    if tags is None:
+        return True
+    obj_tags = set(obj.get("tags") or [])
+    if isinstance(tags, str):
+        if "/" in tags:
+            return any(x in obj_tags for x in tags.split("/"))
+        tags = tags.split(",")
+    return all(x in obj_tags for x in tags)
 
 
 class KongAPI:
     """Help setting routes on Kong Api."""
 
     def __init__(self, api_gateway_url: str, connect_timeout: int = 300000,
-                 write_timeout: int = 300000, read_timeout: int = 300000):
+                 write_timeout: int = 300000, read_timeout: int = 300000,
+                 transport: KongTransport = None,
+                 session: requests.Session = None,
+                 request_timeout=None, cache_ttl: float = None):
         """
         __init__.
 
@@ -21,6 +109,15 @@ class KongAPI:
             connect_timeout [int]: Kong connect timeout.
             write_timeout [int]: Kong write timeout.
             read_timeout [int]: Kong read timeout.
+            transport [KongTransport]: Pooled transport used on Admin API
+                calls, if not set the process shared transport is used.
+            session [requests.Session]: Session to be wrapped on a new
+                transport if transport is not set.
+            request_timeout [float or tuple]: Timeout of the Admin API calls,
+                if not set transport default is used.
+            cache_ttl [float]: If set services and routes are cached for
+                cache_ttl seconds on a KongTopologyCache, list methods read
+                from it and writes made by this object invalidate it.
         """
         if api_gateway_url[-1] == '/':
             api_gateway_url = api_gateway_url[:-1]
@@ -29,6 +126,14 @@ class KongAPI:
         self.connect_timeout = connect_timeout
         self.write_timeout = write_timeout
         self.read_timeout = read_timeout
+        self.request_timeout = request_timeout
+        self._transport = build_transport(
+            transport=transport, session=session)
+        self.resolver = None
+        self._dbless = None
+        self.cache = None
+        if cache_ttl is not None:
+            self.cache = KongTopologyCache(kong_api=self, ttl=cache_ttl)
 
         self._url_services = "{api_gateway_url}/services".format(
             api_gateway_url=self.api_gateway_url)
@@ -40,37 +145,187 @@ class KongAPI:
             api_gateway_url=self.api_gateway_url)
         self._url_route = self._url_routes + "/{route_id}"
 
-    def list_services(self) -> list:
+        self._url_plugins = "{api_gateway_url}/plugins".format(
+            api_gateway_url=self.api_gateway_url)
+        self._url_plugin = self._url_plugins + "/{plugin_id}"
+
+        self._url_upstreams = "{api_gateway_url}/upstreams".format(
+            api_gateway_url=self.api_gateway_url)
+        self._url_upstream = self._url_upstreams + "/{upstream_id}"
+        self._url_upstream_targets = self._url_upstream + "/targets"
+        self._url_upstream_target = self._url_upstream_targets + "/{target}"
+
+    def _invalidate_cache(self):
+        """Invalidate cached topology after a write."""
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _track_route(self, route: dict) -> dict:
+        """Add a written route to the attached resolver."""
+        if self.resolver is not None:
+            self.resolver.add_route(route)
+        return route
+
+    def _track_service(self, service: dict) -> dict:
+        """Add a written service to the attached resolver."""
+        if self.resolver is not None:
+            self.resolver.add_service(service)
+        return service
+
+    def build_resolver(self) -> PathResolver:
+        """
+        Build a PathResolver with Kong routes and attach it to the object.
+
+        Routes and services written or deleted by this object after the
+        resolver is built are updated on it.
+
+        Return [PathResolver]:
+            Resolver of request paths to routes and services.
+        """
+        self.resolver = PathResolver.from_kong(kong_api=self)
+        return self.resolver
+
+    def _iter_pages(self, url: str, size: int = 100,
+                    prefetch: bool = False, params: dict = None):
+        """
+        Iterate over the objects of a paginated Kong collection.
+
+        Follow Kong `offset` until last page, objects are yielded as pages
+        arrive so only one page (two if prefetch) is kept in memory.
+
+        Args:
+            url [str]: Url of the Kong collection.
+        Kwargs:
+            size [int]: Number of objects fetched on each page, Kong accepts
+                values between 1 and 1000.
+            prefetch [bool]: Fetch next page on a background thread while
+                the objects of current page are consumed.
+            params [dict]: Extra query parameters.
+        Return [generator(dict)]:
+            Generator of the objects of the collection.
+        Exceptions:
+            Raise response status.
+        """
+        query = dict(params or {})
+        query["size"] = size
+
+        def fetch_page(offset: str = None) -> dict:
+            page_query = dict(query)
+            if offset is not None:
+                page_query["offset"] = offset
+            response = self._transport.get(
+                url, params=page_query, timeout=self.request_timeout)
+            response.raise_for_status()
+            return response.json()
+
+        if not prefetch:
+            offset = None
+            while True:
+                page = fetch_page(offset)
+                yield from page["data"]
+                offset = page.get("offset")
+                if offset is None:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch_page)
+            while future is not None:
+                page = future.result()
+                offset = page.get("offset")
+                future = None
+                if offset is not None:
+                    future = executor.submit(fetch_page, offset)
+                yield from page["data"]
+
+    def iter_services(self, size: int = 100, prefetch: bool = False,
+                      tags=None):
+        """
+        Iterate over Kong services following pagination.
+
+        Args:
+            No Args.
+        Kwargs:
+            size [int]: Number of services fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only services with these tags, a
+                list must match all tags and 'a/b' any of them. It is
+                filtered by Kong.
+        Return [generator(dict)]:
+            Generator of services avaiable at Kong.
+        Exceptions:
+            Raise response status.
+        """
+        return self._iter_pages(
+            self._url_services, size=size, prefetch=prefetch,
+            params=tags_query(tags))
+
+    def iter_routes(self, service_id: str = None, size: int = 100,
+                    prefetch: bool = False, tags=None):
+        """
+        Iterate over Kong routes following pagination.
+
+        Args:
+            No Args.
+        Kwargs:
+            service_id [str]: Kong service id or name, if set only routes
+                of this service are returned.
+            size [int]: Number of routes fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only routes with these tags, a list
+                must match all tags and 'a/b' any of them. It is filtered by
+                Kong.
+        Return [generator(dict)]:
+            Generator of routes avaiable at Kong.
+        Exceptions:
+            Raise response status.
+        """
+        if service_id is None:
+            url = self._url_routes
+        else:
+            url = self._url_services_routes.format(service_id=service_id)
+        return self._iter_pages(
+            url, size=size, prefetch=prefetch,
+            params=tags_query(tags))
+
+    def list_services(self, tags=None) -> list:
         """
         List Kong services.
 
         Args:
             No Args.
+        Kwargs:
+            tags [str or list]: Return only services with these tags, see
+                iter_services.
         Return [list(dict)]:
             List of services avaiable at Kong
         Exceptions:
             Raise response status.
         """
-        response = requests.get(self._url_services)
-        response.raise_for_status()
-        return response.json()["data"]
+        if self.cache is not None:
+            return [
+                x for x in self.cache.services() if match_tags(x, tags)]
+        return list(self.iter_services(tags=tags))
 
-    def list_service_routes(self, service_id: str) -> list:
+    def list_service_routes(self, service_id: str, tags=None) -> list:
         """
         List service routes.
 
         Args:
             service_id [str]: Kong service id.
+        Kwargs:
+            tags [str or list]: Return only routes with these tags, see
+                iter_routes.
         Return [list(dict)]:
             Return a list of dictionaries with information of routes of the
             service.
         Exceptions:
             Raise response status.
         """
-        response = requests.get(
-            self._url_services_routes.format(service_id=service_id))
-        response.raise_for_status()
-        return response.json()["data"]
+        if self.cache is not None:
+            return [
+                x for x in self.cache.service_routes(service_id)
+                if match_tags(x, tags)]
+        return list(self.iter_routes(service_id=service_id, tags=tags))
 
     def delete_service(self, service_id: str) -> list:
         """
@@ -83,9 +338,13 @@ class KongAPI:
         Exceptions:
             Raise response status.
         """
-        response = requests.delete(
-            self._url_service.format(service_id=service_id))
+        response = self._transport.delete(
+            self._url_service.format(service_id=service_id),
+            timeout=self.request_timeout)
+        self._invalidate_cache()
         response.raise_for_status()
+        if self.resolver is not None:
+            self.resolver.remove_service(service_id)
         return True
 
     def delete_route(self, route_id: str) -> bool:
@@ -99,43 +358,138 @@ class KongAPI:
         Exceptions:
             Raise response status.
         """
-        response = requests.delete(
-            self._url_route.format(route_id=route_id))
+        response = self._transport.delete(
+            self._url_route.format(route_id=route_id),
+            timeout=self.request_timeout)
+        self._invalidate_cache()
         response.raise_for_status()
+        if self.resolver is not None:
+            self.resolver.remove_route(route_id)
         return True
 
-    def delete_routes_and_service(self, list_service_id: list = None) -> bool:
+    def delete_routes_and_service(self, list_service_id: list = None,
+                                  max_workers: int = 10,
+                                  tags=None) -> bool:
         """
         Delete all kong services and associated routes.
 
         Services with names starting with 'test' are not removed as they may
-        be used for testing.
+        be used for testing. Deletes run concurrently, routes of a service
+        are removed before the service. See teardown for per-object
+        outcomes.
 
         Args:
             service_ids [list]: List of service ids to remove from Kong.
+        Kwargs:
+            max_workers [int]: Maximum number of concurrent calls to Kong.
+            tags [str or list]: Remove only services with these tags, see
+                teardown.
         Return [bool]:
             Return True.
         """
-        if list_service_id is None:
-            list_services = self.list_services()
+        results = self.teardown(
+            list_service_id=list_service_id, max_workers=max_workers,
+            tags=tags)
+        for result in results:
+            if result.status == TaskResult.FAILED:
+                raise result.error
+        return True
+
+    def _resolve_service_ids(self, list_service_id: list,
+                             max_workers: int = 10) -> list:
+        """
+        Resolve service names to ids removing repeated services.
+
+        Names of services that do not exist are kept, their delete is a
+        no-op on Kong.
+        """
+        names = [x for x in list_service_id if not _uuid_re.match(x)]
+        ids_by_name = {}
+        if names:
+            executor = ConcurrentExecutor(max_workers=max_workers)
+            fetched = executor.run([
+                Task(key=name, func=self.get_service, args=(name, ))
+                for name in set(names)])
+            for name, task_result in fetched.items():
+                if task_result.result is not None:
+                    ids_by_name[name] = task_result.result["id"]
+
+        service_ids = []
+        for service_id in list_service_id:
+            service_id = ids_by_name.get(service_id, service_id)
+            if service_id not in service_ids:
+                service_ids.append(service_id)
+        return service_ids
+
+    def teardown(self, list_service_id: list = None, max_workers: int = 10,
+                 page_size: int = 1000, tags=None) -> list:
+        """
+        Delete services and their routes reporting each object outcome.
+
+        All routes are fetched in a single paginated /routes scan and
+        grouped by service, instead of one listing by service. Services
+        with names starting with 'test' or 'reload-db' are not removed if
+        list_service_id is not set. Routes of a service are deleted before
+        it with at most max_workers concurrent calls.
 
+        Kwargs:
+            list_service_id [list]: Ids or names of the services to remove,
+                if not set all services except testing ones are removed.
+                Names are resolved to ids and repeated services removed.
+            max_workers [int]: Maximum number of concurrent calls to Kong.
+            page_size [int]: Page size of the services and routes scans.
+            tags [str or list]: If list_service_id is not set, remove only
+                services with these tags, the routes scan is filtered by the
+                same tags (on Kong). Routes of these services without the
+                tags are not removed and their service delete fails,
+                KongManagement sets its tags on all services and routes.
+        Return [list(TaskResult)]:
+            Outcome of each delete, keys are ('route', id) and
+            ('service', id). A service is skipped if any of its routes
+            failed to be deleted.
+        """
+        route_tags = None
+        if list_service_id is None:
+            route_tags = tags
             # Do not delete services associated with testing, this is used
             # for regen databases
             list_service_id = [
-                x["id"] for x in list_services
+                x["id"] for x in self.iter_services(
+                    size=page_size, prefetch=True, tags=tags)
                 if not (
-                    x["name"].startswith("test") or
-                    x["name"].startswith("reload-db"))]
-        for service_id in list_service_id:
-            list_routes = self.list_service_routes(service_id=service_id)
-            for route in list_routes:
-                self.delete_route(route_id=route["id"])
-            self.delete_service(service_id=service_id)
-        return True
+                    (x["name"] or "").startswith("test") or
+                    (x["name"] or "").startswith("reload-db"))]
+        else:
+            list_service_id = self._resolve_service_ids(
+                list_service_id, max_workers=max_workers)
+
+        service_routes = dict((x, []) for x in list_service_id)
+        if service_routes:
+            for route in self.iter_routes(
+                    size=page_size, prefetch=True, tags=route_tags):
+                service_id = (route.get("service") or {}).get("id")
+                routes = service_routes.get(service_id)
+                if routes is not None:
+                    routes.append(route["id"])
+
+        tasks = []
+        for service_id, route_ids in service_routes.items():
+            route_keys = []
+            for route_id in route_ids:
+                route_keys.append(("route", route_id))
+                tasks.append(Task(
+                    key=("route", route_id), func=self.delete_route,
+                    kwargs={"route_id": route_id}))
+            tasks.append(Task(
+                key=("service", service_id), func=self.delete_service,
+                kwargs={"service_id": service_id}, depends_on=route_keys))
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        return list(executor.run(tasks).values())
 
     def register_service(self, service_name: str, service_url: str,
                          healthcheck_route: str = None,
-                         service_kong_id: str = None):
+                         service_kong_id: str = None, tags: list = None):
         """
         Register a service at Kong.
 
@@ -146,6 +500,7 @@ class KongAPI:
             healthcheck_route [str]: A healthcheck end-point for the
                 service if avaiable.
             service_kong_id [str]: ID of the service at kong.
+            tags [list(str)]: Tags of the service and health check route.
         """
         temp_service_url = template_service.format(
             api_gateway_url=self.api_gateway_url,
@@ -156,50 +511,53 @@ class KongAPI:
             'connect_timeout': self.connect_timeout,
             'write_timeout': self.write_timeout,
             'read_timeout': self.read_timeout}
-        response = requests.put(
-            temp_service_url, json=payload)
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            response_text = response.text
-            msg = (
-                "[{erro_type}] {error_msg}\n"
-                "[Request Text] {request_text}")
-            raise exceptions.PumpWoodException(
-                message=msg,
-                payload={
-                    "erro_type": type(e).__name__,
-                    "error_msg": str(e),
-                    "request_text": response_text})
+        if tags is not None:
+            payload["tags"] = list(tags)
+        response = self._transport.put(
+            temp_service_url, json=payload, timeout=self.request_timeout)
+        self._invalidate_cache()
+        _raise_for_status(response)
 
-        kong_service = response.json()
+        kong_service = self._track_service(response.json())
         if healthcheck_route is not None:
-            response = requests.put(
+            route_payload = {
+                "paths": [healthcheck_route],
+                "strip_path": False,
+                "service": {"id": kong_service["id"]}}
+            if tags is not None:
+                route_payload["tags"] = list(tags)
+            response = self._transport.put(
                 routes_url_template.format(
                     api_gateway_url=self.api_gateway_url,
                     route_name=service_name + "--health-check"
                 ),
-                json={
-                    "paths": [healthcheck_route],
-                    "strip_path": False,
-                    "service": {"id": kong_service["id"]}
-                })
+                json=route_payload, timeout=self.request_timeout)
+            self._invalidate_cache()
+            if response.ok:
+                self._track_route(response.json())
         return kong_service
 
     def register_route(self, route_url: str, route_name: str,
                        service_id: str = None, service_name: str = None,
-                       strip_path: bool = False):
+                       strip_path: bool = False, tags: list = None):
         """
         Register Route on Kong.
 
         Args:
             service_id [str]: Kong service id.
-            route_url [str]: End-point route to be registred service by Kong.
+            route_url [str or list(str)]: End-point route to be registred
+                service by Kong, a list may be passed to register many
+                paths on the route.
             route_name [str]: Name of the route.
         Kwargs:
             service_id: str: Kong Service ID.
             service_name: str = Kong Service Name.
+            tags: list(str) = Tags of the route.
         """
+        route_paths = route_url
+        if isinstance(route_url, str):
+            route_paths = [route_url]
+
         # Raise erros if parameters does not make sense
         is_none_service_id = service_id is None
         is_none_service_name = service_name is None
@@ -207,7 +565,7 @@ class KongAPI:
             msg = (
                 "'service_id' and 'service_name' are None. "
                 "It is necessary that one is not None")
-            raise exceptions.PumpWoodException(
+            raise _pumpwood_exception(
                 message=msg,
                 payload={})
 
@@ -215,94 +573,898 @@ class KongAPI:
             msg = (
                 "'service_id' and 'service_name' are not None. "
                 "It is necessary that one is None")
-            raise exceptions.PumpWoodException(
+            raise _pumpwood_exception(
                 message=msg,
                 payload={})
 
         if not is_none_service_id:
-            response = requests.put(
-                routes_url_template.format(
-                    api_gateway_url=self.api_gateway_url,
-                    route_name=route_name
-                ),
-                json={
-                    "paths": [route_url],
-                    "strip_path": strip_path,
-                    "id": {"id": service_id}
-                })
-
-            try:
-                response.raise_for_status()
-            except Exception as e:
-                response_text = response.text
-                msg = (
-                    "[{erro_type}] {error_msg}\n"
-                    "[Request Text] {request_text}")
-                raise exceptions.PumpWoodException(
-                    message=msg,
-                    payload={
-                        "erro_type": type(e).__name__,
-                        "error_msg": str(e),
-                        "request_text": response_text})
-            return response.json()
+            service = {"id": service_id}
+        else:
+            service = {"name": service_name}
+        payload = {
+            "paths": route_paths,
+            "strip_path": strip_path,
+            "service": service}
+        if tags is not None:
+            payload["tags"] = list(tags)
+
+        response = self._transport.put(
+            routes_url_template.format(
+                api_gateway_url=self.api_gateway_url,
+                route_name=route_name
+            ),
+            json=payload, timeout=self.request_timeout)
+        self._invalidate_cache()
 
+        _raise_for_status(response)
+        return self._track_route(response.json())
+
+    def put_service(self, service_name: str, payload: dict) -> dict:
+        """
+        Create or update a service using its full Kong payload.
+
+        Args:
+            service_name [str]: Name of the service.
+            payload [dict]: Kong service payload, it is sent as it is.
+        Return [dict]:
+            Kong service.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.put(
+            template_service.format(
+                api_gateway_url=self.api_gateway_url,
+                service_name=service_name),
+            json=payload, timeout=self.request_timeout)
+        self._invalidate_cache()
+        _raise_for_status(response)
+        return self._track_service(response.json())
+
+    def get_service(self, service_id: str) -> dict:
+        """
+        Get a service by id or name.
+
+        Args:
+            service_id [str]: Kong service id or name.
+        Return [dict]:
+            Kong service or None if it does not exist.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.get(
+            template_service.format(
+                api_gateway_url=self.api_gateway_url,
+                service_name=service_id),
+            timeout=self.request_timeout)
+        if response.status_code == 404:
+            return None
+        _raise_for_status(response)
+        return response.json()
+
+    def patch_service(self, service_id: str, payload: dict) -> dict:
+        """
+        Update fields of a service.
+
+        Args:
+            service_id [str]: Kong service id or name.
+            payload [dict]: Fields to be updated.
+        Return [dict]:
+            Kong service.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.patch(
+            template_service.format(
+                api_gateway_url=self.api_gateway_url,
+                service_name=service_id),
+            json=payload, timeout=self.request_timeout)
+        self._invalidate_cache()
+        _raise_for_status(response)
+        return self._track_service(response.json())
+
+    def put_route(self, route_name: str, payload: dict) -> dict:
+        """
+        Create or update a route using its full Kong payload.
+
+        Args:
+            route_name [str]: Name of the route.
+            payload [dict]: Kong route payload, it is sent as it is. Service
+                may be referenced by id or name.
+        Return [dict]:
+            Kong route.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.put(
+            routes_url_template.format(
+                api_gateway_url=self.api_gateway_url,
+                route_name=route_name),
+            json=payload, timeout=self.request_timeout)
+        self._invalidate_cache()
+        self._learn_dbless(response)
+        _raise_for_status(response)
+        return self._track_route(response.json())
+
+    def iter_upstreams(self, size: int = 100, prefetch: bool = False,
+                       tags=None):
+        """
+        Iterate over Kong upstreams following pagination.
+
+        Kwargs:
+            size [int]: Number of upstreams fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only upstreams with these tags, see
+                iter_services.
+        Return [generator(dict)]:
+            Generator of upstreams avaiable at Kong.
+        """
+        return self._iter_pages(
+            self._url_upstreams, size=size, prefetch=prefetch,
+            params=tags_query(tags))
+
+    def list_upstreams(self, tags=None) -> list:
+        """
+        List Kong upstreams.
+
+        Kwargs:
+            tags [str or list]: Return only upstreams with these tags.
+        Return [list(dict)]:
+            List of upstreams avaiable at Kong.
+        """
+        return list(self.iter_upstreams(tags=tags))
+
+    def get_upstream(self, upstream_id: str) -> dict:
+        """
+        Get an upstream by id or name.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+        Return [dict]:
+            Kong upstream or None if it does not exist.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.get(
+            self._url_upstream.format(upstream_id=upstream_id),
+            timeout=self.request_timeout)
+        if response.status_code == 404:
+            return None
+        _raise_for_status(response)
+        return response.json()
+
+    def put_upstream(self, upstream_name: str, payload: dict) -> dict:
+        """
+        Create or update an upstream using its full Kong payload.
+
+        Args:
+            upstream_name [str]: Name of the upstream, services reach it
+                using it as host.
+            payload [dict]: Kong upstream payload (algorithm, healthchecks,
+                ...), it is sent as it is.
+        Return [dict]:
+            Kong upstream.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.put(
+            self._url_upstream.format(upstream_id=upstream_name),
+            json=payload, timeout=self.request_timeout)
+        _raise_for_status(response)
+        return response.json()
+
+    def delete_upstream(self, upstream_id: str) -> bool:
+        """
+        Delete an upstream and its targets.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+        Return [bool]:
+            Return True
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.delete(
+            self._url_upstream.format(upstream_id=upstream_id),
+            timeout=self.request_timeout)
+        _raise_for_status(response)
+        return True
+
+    def iter_targets(self, upstream_id: str, size: int = 100,
+                     prefetch: bool = False):
+        """
+        Iterate over the targets of an upstream.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+        Kwargs:
+            size [int]: Number of targets fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+        Return [generator(dict)]:
+            Generator of the upstream targets.
+        """
+        return self._iter_pages(
+            self._url_upstream_targets.format(upstream_id=upstream_id),
+            size=size, prefetch=prefetch)
+
+    def list_targets(self, upstream_id: str) -> list:
+        """
+        List the targets of an upstream.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+        Return [list(dict)]:
+            Targets of the upstream.
+        """
+        return list(self.iter_targets(upstream_id))
+
+    def add_target(self, upstream_id: str, target: str, weight: int = 100,
+                   tags: list = None) -> dict:
+        """
+        Add or update a target of an upstream.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+            target [str]: Target address as 'host:port'.
+        Kwargs:
+            weight [int]: Balancer weight of the target, 0 disables it.
+            tags [list(str)]: Tags of the target.
+        Return [dict]:
+            Kong target.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        payload = {"target": target, "weight": weight}
+        if tags is not None:
+            payload["tags"] = list(tags)
+        response = self._transport.put(
+            self._url_upstream_target.format(
+                upstream_id=upstream_id, target=target),
+            json=payload, timeout=self.request_timeout)
+        _raise_for_status(response)
+        return response.json()
+
+    def delete_target(self, upstream_id: str, target: str) -> bool:
+        """
+        Remove a target from an upstream.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+            target [str]: Target address ('host:port') or id.
+        Return [bool]:
+            Return True
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.delete(
+            self._url_upstream_target.format(
+                upstream_id=upstream_id, target=target),
+            timeout=self.request_timeout)
+        _raise_for_status(response)
+        return True
+
+    def add_targets(self, upstream_id: str, targets: list,
+                    max_workers: int = 10) -> list:
+        """
+        Add many targets to an upstream concurrently.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+            targets [list]: Target addresses ('host:port'), (target, weight)
+                tuples or target payloads (dict).
+        Kwargs:
+            max_workers [int]: Maximum number of concurrent calls.
+        Return [list(TaskResult)]:
+            Outcome of each target in the same order, with target as key.
+            Errors are not raised, they are set on each result.
+        """
+        tasks = []
+        for item in targets:
+            if isinstance(item, str):
+                item = {"target": item}
+            elif not isinstance(item, dict):
+                item = {"target": item[0], "weight": item[1]}
+            kwargs = dict(item)
+            kwargs["upstream_id"] = upstream_id
+            tasks.append(Task(
+                key=item["target"], func=self.add_target, kwargs=kwargs))
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        return list(executor.run(tasks).values())
+
+    def remove_targets(self, upstream_id: str, targets: list,
+                       max_workers: int = 10) -> list:
+        """
+        Remove many targets from an upstream concurrently.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+            targets [list(str)]: Target addresses ('host:port') or ids.
+        Kwargs:
+            max_workers [int]: Maximum number of concurrent calls.
+        Return [list(TaskResult)]:
+            Outcome of each target in the same order, with target as key.
+            Errors are not raised, they are set on each result.
+        """
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        return list(executor.run([
+            Task(key=target, func=self.delete_target,
+                 args=(upstream_id, target))
+            for target in targets]).values())
+
+    def iter_plugins(self, service_id: str = None, route_id: str = None,
+                     size: int = 100, prefetch: bool = False, tags=None):
+        """
+        Iterate over Kong plugins following pagination.
+
+        Kwargs:
+            service_id [str]: Kong service id or name, if set only plugins
+                of this service are returned.
+            route_id [str]: Kong route id or name, if set only plugins of
+                this route are returned.
+            size [int]: Number of plugins fetched on each page.
+            prefetch [bool]: Fetch next page while current one is consumed.
+            tags [str or list]: Return only plugins with these tags.
+        Return [generator(dict)]:
+            Generator of plugins.
+        """
+        if route_id is not None:
+            url = self._url_route.format(route_id=route_id) + "/plugins"
+        elif service_id is not None:
+            url = self._url_service.format(service_id=service_id) + \
+                "/plugins"
         else:
-            response = requests.put(
-                routes_url_template.format(
-                    api_gateway_url=self.api_gateway_url,
-                    route_name=route_name
-                ),
-                json={
-                    "paths": [route_url],
-                    "strip_path": strip_path,
-                    "service": {"name": service_name}
-                })
-
-            try:
-                response.raise_for_status()
-            except Exception as e:
-                response_text = response.text
-                msg = (
-                    "[{erro_type}] {error_msg}\n"
-                    "[Request Text] {request_text}")
-                raise exceptions.PumpWoodException(
-                    message=msg,
-                    payload={
-                        "erro_type": type(e).__name__,
-                        "error_msg": str(e),
-                        "request_text": response_text})
-            return response.json()
+            url = self._url_plugins
+        return self._iter_pages(
+            url, size=size, prefetch=prefetch, params=tags_query(tags))
 
-    def list_all_routes(self):
-        """List all routes that have been registed to Kong."""
-        routes_url_template = "{api_gateway_url}/routes/"
-        services_url_template = "{api_gateway_url}/services/"
-
-        # get services and routes avaiable on kong
-        response_services = requests.get(
-            services_url_template.format(api_gateway_url=self.api_gateway_url))
-        response_routes = requests.get(
-            routes_url_template.format(api_gateway_url=self.api_gateway_url))
-        response_services.raise_for_status()
-        response_routes.raise_for_status()
-
-        data_services = response_services.json()
-        dict_services = dict(
-            [(s["id"], s["name"]) for s in data_services["data"]])
-        data_routes = response_routes.json()
-
-        dict_routes = {}
-        for route in data_routes["data"]:
-            service_name = dict_services[route["service"]["id"]]
-            routes_in_service = dict_routes.get(service_name, [])
-            for p in route["paths"]:
-                routes_in_service.append(p)
-            dict_routes[service_name] = routes_in_service
-
-        for key, item in dict_routes.items():
-            item.sort()
+    def list_plugins(self, service_id: str = None, route_id: str = None,
+                     tags=None) -> list:
+        """
+        List Kong plugins, see iter_plugins.
+
+        Return [list(dict)]:
+            List of plugins.
+        """
+        return list(self.iter_plugins(
+            service_id=service_id, route_id=route_id, tags=tags))
+
+    def put_plugin(self, payload: dict) -> dict:
+        """
+        Create or update a plugin.
+
+        Plugin is written with PUT using its id, if not set a deterministic
+        id is built from plugin name and service/route names, see
+        pumpwood_kong.plugins. Plugins with service or route references by
+        name are written on the service/route plugins end-point.
+
+        Args:
+            payload [dict]: Kong plugin payload, see pumpwood_kong.plugins
+                helpers.
+        Return [dict]:
+            Kong plugin.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        payload = dict(payload)
+        route = payload.get("route")
+        service = payload.get("service")
+        if payload.get("id") is None:
+            payload["id"] = plugin_id(
+                payload["name"], service=service, route=route)
+
+        url = self._url_plugin.format(plugin_id=payload["id"])
+        if route is not None and "name" in route:
+            url = self._url_route.format(route_id=route["name"]) + \
+                "/plugins/" + payload["id"]
+            del payload["route"]
+        elif service is not None and "name" in service:
+            url = self._url_service.format(service_id=service["name"]) + \
+                "/plugins/" + payload["id"]
+            del payload["service"]
+        response = self._transport.put(
+            url, json=payload, timeout=self.request_timeout)
+        _raise_for_status(response)
+        return response.json()
+
+    def delete_plugin(self, plugin_id: str) -> bool:
+        """
+        Delete a plugin.
+
+        Args:
+            plugin_id [str]: Kong plugin id.
+        Return [bool]:
+            Return True
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.delete(
+            self._url_plugin.format(plugin_id=plugin_id),
+            timeout=self.request_timeout)
+        _raise_for_status(response)
+        return True
+
+    def sync_plugins(self, plugins: list, max_workers: int = 10) -> list:
+        """
+        Write plugins that differ from Kong.
+
+        Live plugins are fetched in one paginated scan, plugins are written
+        concurrently only if missing or changed (see
+        pumpwood_kong.plugins.is_plugin_changed).
+
+        Args:
+            plugins [list(dict)]: Plugin payloads.
+        Kwargs:
+            max_workers [int]: Maximum number of concurrent writes.
+        Return [list(TaskResult)]:
+            Outcome of each plugin in the same order with plugin id as key,
+            unchanged plugins have the live plugin as result. Errors are
+            not raised, they are set on each result.
+        """
+        payloads = []
+        for payload in plugins:
+            if payload.get("id") is None:
+                payload = dict(payload, id=plugin_id(
+                    payload["name"], service=payload.get("service"),
+                    route=payload.get("route")))
+            payloads.append(payload)
+        live = dict(
+            (x["id"], x) for x in self.iter_plugins(size=1000, prefetch=True))
+
+        results = []
+        tasks = []
+        for payload in payloads:
+            live_plugin = live.get(payload["id"])
+            if is_plugin_changed(payload, live_plugin):
+                tasks.append(Task(
+                    key=payload["id"], func=self.put_plugin,
+                    args=(payload, )))
+                results.append(None)
+            else:
+                results.append(TaskResult(
+                    payload["id"], TaskResult.DONE, result=live_plugin))
+
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        written = iter(executor.run(tasks).values())
+        return [x if x is not None else next(written) for x in results]
+
+    def upstream_health(self, upstream_id: str) -> list:
+        """
+        Return health of the targets of an upstream.
+
+        Args:
+            upstream_id [str]: Kong upstream id or name.
+        Return [list(dict)]:
+            Targets with 'health' key (HEALTHY, UNHEALTHY, DNS_ERROR or
+            HEALTHCHECKS_OFF).
+        Exceptions:
+            Raise response status.
+        """
+        return list(self._iter_pages(
+            "{api_gateway_url}/upstreams/{upstream_id}/health/".format(
+                api_gateway_url=self.api_gateway_url,
+                upstream_id=upstream_id)))
+
+    def _consumer_url(self, consumer_id: str = None) -> str:
+        if consumer_id is None:
+            return self.api_gateway_url + "/consumers/"
+        return "{api_gateway_url}/consumers/{consumer_id}/".format(
+            api_gateway_url=self.api_gateway_url, consumer_id=consumer_id)
+
+    def create_consumer(self, payload: dict) -> dict:
+        """
+        Create a consumer if it does not exist.
+
+        Creation is atomic on Kong, so it can be used as a lock.
+
+        Args:
+            payload [dict]: Kong consumer payload.
+        Return [dict]:
+            Created consumer or None if a consumer with the same username
+            or custom_id already exists.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.post(
+            self._consumer_url(), json=payload,
+            timeout=self.request_timeout)
+        if response.status_code == 409:
+            return None
+        _raise_for_status(response)
+        return response.json()
+
+    def get_consumer(self, consumer_id: str) -> dict:
+        """
+        Get a consumer by id or username.
+
+        Args:
+            consumer_id [str]: Kong consumer id or username.
+        Return [dict]:
+            Kong consumer or None if it does not exist.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.get(
+            self._consumer_url(consumer_id), timeout=self.request_timeout)
+        if response.status_code == 404:
+            return None
+        _raise_for_status(response)
+        return response.json()
 
-        for s in data_services["data"]:
-            if s["name"] not in dict_routes.keys():
-                dict_routes[s["name"]] = []
+    def patch_consumer(self, consumer_id: str, payload: dict) -> dict:
+        """
+        Update fields of a consumer.
+
+        Args:
+            consumer_id [str]: Kong consumer id or username.
+            payload [dict]: Fields to be updated.
+        Return [dict]:
+            Kong consumer or None if it does not exist.
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.patch(
+            self._consumer_url(consumer_id), json=payload,
+            timeout=self.request_timeout)
+        if response.status_code == 404:
+            return None
+        _raise_for_status(response)
+        return response.json()
+
+    def delete_consumer(self, consumer_id: str) -> bool:
+        """
+        Delete a consumer.
+
+        Args:
+            consumer_id [str]: Kong consumer id or username.
+        Return [bool]:
+            True (Kong answers 204 even if the consumer does not exist).
+        Exceptions:
+            Raise PumpWoodException if request fails.
+        """
+        response = self._transport.delete(
+            self._consumer_url(consumer_id), timeout=self.request_timeout)
+        _raise_for_status(response)
+        return True
+
+    def get_status(self) -> dict:
+        """
+        Return Kong node status (/status end-point).
+
+        Return [dict]:
+            Status with database reachability, connections and, on DB-less
+            and hybrid data plane nodes, configuration_hash.
+        Exceptions:
+            Raise response status.
+        """
+        response = self._transport.get(
+            self.api_gateway_url + "/status", timeout=self.request_timeout)
+        _raise_for_status(response)
+        return response.json()
+
+    def is_dbless(self) -> bool:
+        """
+        Check if Kong is running without database (DB-less mode).
+
+        Result is kept on the object after first call.
+
+        Return [bool]:
+            True if Kong database is 'off'.
+        """
+        if self._dbless is None:
+            response = self._transport.get(
+                self.api_gateway_url + "/", timeout=self.request_timeout)
+            _raise_for_status(response)
+            configuration = response.json().get("configuration", {})
+            self._dbless = configuration.get("database") == "off"
+        return self._dbless
+
+    def _learn_dbless(self, response: requests.Response):
+        """
+        Keep DB-less mode learned from a write response.
+
+        DB-less Kong refuses Admin API writes with 405, a successful write
+        means Kong has a database. It avoids a call to is_dbless before the
+        writes.
+        """
+        if self._dbless is not None:
+            return
+        if response.status_code == 405:
+            self._dbless = True
+        elif response.ok:
+            self._dbless = False
+
+    @staticmethod
+    def _route_item_payload(item, strip_path: bool,
+                            tags: list = None) -> dict:
+        """Build route payload from a (name, paths, service) tuple."""
+        if isinstance(item, dict):
+            if tags is not None and "tags" not in item:
+                item = dict(item, tags=list(tags))
+            return item
+        route_name, paths, service = item
+        if isinstance(paths, str):
+            paths = [paths]
+        if isinstance(service, str):
+            service = {"name": service}
+        payload = {
+            "name": route_name,
+            "paths": list(paths),
+            "strip_path": strip_path,
+            "service": service}
+        if tags is not None:
+            payload["tags"] = list(tags)
+        return payload
+
+    def _get_declarative_config(self) -> dict:
+        """
+        Return current DB-less declarative configuration.
+
+        Kong returns it as YAML, PyYAML is needed to read it (pumpwood-kong
+        'dbless' extra). JSON configurations are read without it.
+        """
+        response = self._transport.get(
+            self.api_gateway_url + "/config", timeout=self.request_timeout)
+        _raise_for_status(response)
+        config_text = response.json()["config"]
+        try:
+            return json.loads(config_text)
+        except ValueError:
+            pass
+        try:
+            import yaml
+        except ImportError:
+            msg = (
+                "PyYAML is necessary to read Kong declarative "
+                "configuration, install it with "
+                "'pip install pumpwood-kong[dbless]'")
+            raise _pumpwood_exception(message=msg, payload={})
+        return yaml.safe_load(config_text)
+
+    def _register_routes_declarative(self, payloads: list,
+                                     delete_routes: list = None) -> list:
+        """
+        Merge routes on DB-less declarative configuration in one POST.
+
+        Routes with the same names are replaced and routes on delete_routes
+        are removed, the whole configuration is posted to /config. Service
+        references are converted to the string form used on declarative
+        configuration.
+        """
+        config = self._get_declarative_config()
+        delete_routes = list(delete_routes or [])
+        names = set(x["name"] for x in payloads) | set(delete_routes)
+        for service in config.get("services") or []:
+            service["routes"] = [
+                x for x in service.get("routes") or []
+                if x.get("name") not in names]
+        config_routes = [
+            x for x in config.get("routes") or []
+            if x.get("name") not in names]
+        for payload in payloads:
+            route = dict(payload)
+            service = route.get("service") or {}
+            route["service"] = service.get("id", service.get("name"))
+            config_routes.append(route)
+        config["routes"] = config_routes
+
+        response = self._transport.post(
+            self.api_gateway_url + "/config", json=config,
+            timeout=self.request_timeout)
+        self._invalidate_cache()
+        keys = [x["name"] for x in payloads] + [
+            ("delete", x) for x in delete_routes]
+        results = [x for x in payloads] + [None] * len(delete_routes)
+        try:
+            _raise_for_status(response)
+        except Exception as e:
+            return [
+                TaskResult(key, TaskResult.FAILED, error=e) for key in keys]
+        return [
+            TaskResult(key, TaskResult.DONE, result=result)
+            for key, result in zip(keys, results)]
+
+    def register_routes(self, routes: list, strip_path: bool = False,
+                        max_workers: int = 10,
+                        declarative: bool = None, tags: list = None,
+                        delete_routes: list = None) -> list:
+        """
+        Register many routes on Kong.
+
+        On DB-less Kong all routes are merged on the declarative
+        configuration and sent on a single call to /config, otherwise
+        routes are written with concurrent PUTs. Kong mode is not checked
+        before the writes, if Kong refuses the PUTs as DB-less (405) the
+        routes are written on /config and the mode is kept on the object.
+
+        Args:
+            routes [list]: List of (route_name, paths, service) tuples,
+                paths may be a string or a list and service a service name or
+                a {"id": ...}/{"name": ...} reference. Full Kong route
+                payloads (dict) with name are also accepted.
+        Kwargs:
+            strip_path [bool]: strip_path of the routes built from tuples.
+            tags [list(str)]: Tags of the routes, payloads (dict) that
+                already have tags are not changed.
+            max_workers [int]: Maximum number of concurrent PUTs.
+            declarative [bool]: Force (True) or disable (False) use of
+                /config, if None it is used when Kong is known or found to
+                be DB-less.
+            delete_routes [list(str)]: Names of routes to be removed. On
+                declarative mode they are removed from the configuration
+                posted with the routes, otherwise they are deleted after all
+                routes are written and skipped if any write fails.
+        Return [list(TaskResult)]:
+            Outcome of each route in the same order, with route name as key,
+            followed by the removals with ('delete', name) keys. Errors are
+            not raised, they are set on each result.
+        """
+        payloads = [
+            self._route_item_payload(x, strip_path, tags) for x in routes]
+        delete_routes = list(delete_routes or [])
+        detect_dbless = declarative is None and self._dbless is None
+        if declarative is None:
+            declarative = bool(self._dbless)
+        if declarative:
+            return self._register_routes_declarative(
+                payloads, delete_routes=delete_routes)
+
+        tasks = [
+            Task(key=x["name"], func=self.put_route, args=(x["name"], x))
+            for x in payloads]
+        write_keys = [x.key for x in tasks]
+        tasks.extend(
+            Task(key=("delete", x), func=self.delete_route, args=(x, ),
+                 depends_on=write_keys)
+            for x in delete_routes)
+        executor = ConcurrentExecutor(
+            max_workers=max_workers, raise_errors=False)
+        results = list(executor.run(tasks).values())
+        if detect_dbless and self._dbless:
+            # Writes were refused by a DB-less Kong, deletes were skipped
+            return self._register_routes_declarative(
+                payloads, delete_routes=delete_routes)
+        return results
+
+    def list_all_routes(self, prefetch: bool = False) -> dict:
+        """
+        List all routes that have been registed to Kong.
+
+        Kwargs:
+            prefetch [bool]: Fetch next pages while current ones are
+                consumed.
+        Return [dict]:
+            Dictionary with service name as key and the sorted paths of its
+            routes as value.
+        """
+        if self.cache is None:
+            return dict(self.iter_all_routes(
+                per_service=False, prefetch=prefetch))
+
+        services = self.cache.services()
+        routes = self.cache.routes()
+        dict_services = dict((s["id"], s["name"]) for s in services)
+        dict_routes = dict((name, []) for name in dict_services.values())
+        for route in routes:
+            # Kong routes may not have a service, they are not listed
+            service_id = (route.get("service") or {}).get("id")
+            if service_id not in dict_services:
+                continue
+            dict_routes[dict_services[service_id]].extend(
+                route["paths"] or [])
+
+        for item in dict_routes.values():
+            item.sort()
         return dict_routes
+
+    def iter_all_routes(self, name_prefix: str = None, tags=None,
+                        per_service: bool = None, size: int = 1000,
+                        prefetch: bool = True, max_workers: int = 10):
+        """
+        Iterate over services and the sorted paths of their routes.
+
+        By default routes are fetched from each service /routes end-point
+        as service pages arrive, with at most max_workers concurrent calls,
+        and tuples are yielded in service order as soon as they are ready.
+        Memory is bounded by the largest services in flight and filtered
+        queries do not scan the routes of other services. Without
+        per_service all routes are fetched on a single /routes scan, it
+        makes fewer calls but yields only after the scan ends.
+
+        Kwargs:
+            name_prefix [str]: Return only services with names starting with
+                it, Kong has no name filter so it is checked by the client.
+            tags [str or list]: Return only services with these tags, a list
+                must match all tags. It is filtered by Kong.
+            per_service [bool]: Fetch the routes of each service separately,
+                if None it is True.
+            size [int]: Page size of the Kong calls.
+            prefetch [bool]: Fetch next pages while current ones are
+                consumed.
+            max_workers [int]: Maximum number of concurrent calls fetching
+                service routes.
+        Return [generator(tuple)]:
+            (service_name, sorted_paths) tuples.
+        """
+        services = self.iter_services(
+            size=size, prefetch=prefetch, tags=tags)
+        if name_prefix is not None:
+            services = (
+                x for x in services
+                if (x["name"] or "").startswith(name_prefix))
+
+        if per_service is None or per_service:
+            yield from self._iter_service_paths(
+                services, size=size, max_workers=max_workers)
+            return
+
+        service_names = {}
+        service_paths = {}
+        for service in services:
+            service_names[service["id"]] = service["name"]
+            service_paths[service["id"]] = []
+        for route in self.iter_routes(size=size, prefetch=prefetch):
+            paths = service_paths.get((route.get("service") or {}).get("id"))
+            if paths is not None and route["paths"]:
+                paths.extend(route["paths"])
+        for service_id, service_name in service_names.items():
+            paths = service_paths.pop(service_id)
+            paths.sort()
+            yield service_name, paths
+
+    def _iter_service_paths(self, services, size: int, max_workers: int):
+        """Fetch the paths of each service concurrently, in service order."""
+        def fetch_paths(service: dict) -> tuple:
+            paths = []
+            for route in self.iter_routes(service_id=service["id"], size=size):
+                paths.extend(route["paths"] or [])
+            paths.sort()
+            return service["name"], paths
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for service in services:
+                pending.append(executor.submit(fetch_paths, service))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def export_snapshot(self, path: str, page_size: int = 1000,
+                        compress: bool = None) -> dict:
+        """
+        Export services and routes to a JSON Lines snapshot file.
+
+        Args:
+            path [str]: Path of the snapshot file.
+        Kwargs:
+            page_size [int]: Page size used to read the collections.
+            compress [bool]: Gzip the file, if None it is compressed when
+                path ends with '.gz'.
+        Return [dict]:
+            Number of exported objects by entity.
+        """
+        return snapshot.export_snapshot(
+            self, path=path, page_size=page_size, compress=compress)
+
+    def import_snapshot(self, path: str, batch_size: int = 500,
+                        max_workers: int = 10, compress: bool = None) -> dict:
+        """
+        Import a snapshot file with batched concurrent PUTs.
+
+        Args:
+            path [str]: Path of the snapshot file.
+        Kwargs:
+            batch_size [int]: Number of objects written on each batch.
+            max_workers [int]: Maximum number of concurrent writes.
+            compress [bool]: File is gzipped, if None it is considered
+                compressed when path ends with '.gz'.
+        Return [dict]:
+            Number of imported objects by entity.
+        Exceptions:
+            Raise PumpWoodException of the first failed write.
+        """
+        return snapshot.import_snapshot(
+            self, path=path, batch_size=batch_size, max_workers=max_workers,
+            compress=compress)
@@ -0,0 +1,345 @@
+"""
+Registration leases so only one replica writes to Kong at a time.
+
+A lease is held by an owner for a name (usually the service name). Replicas
+that do not get the lease wait and verify if the holder has finished the
+registration instead of writing the same objects again.
+"""
+import os
+import re
+import abc
+import time
+import uuid
+import socket
+import logging
+import tempfile
+import threading
+from .kong_api import KongAPI
+
+
+logger = logging.getLogger(__name__)
+
+
+_invalid_tag_chars_re = re.compile(r"[^a-zA-Z0-9._~-]")
+
+
+def default_owner() -> str:
+    """Return an owner id unique to this process."""
+    return _invalid_tag_chars_re.sub("-", "{host}-{pid}-{rand}".format(
+        host=socket.gethostname(), pid=os.getpid(),
+        rand=uuid.uuid4().hex[:8]))
+
+
+class LeaseLostError(Exception):
+    """Lease expired or was taken by other owner while it was held."""
+
+
+class _LeaseRenewer:
+    """Renew a held lease on a background thread until stopped."""
+
+    def __init__(self, lease: "LeaseBackend", name: str):
+        self.lease = lease
+        self.name = name
+        self.lost = False
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="lease-renewer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        interval = self.lease.ttl / 3.0
+        while not self._stop_event.wait(interval):
+            try:
+                renewed = self.lease.renew(self.name)
+            except Exception as e:
+                logger.warning(
+                    "Error renewing lease [%s]: %s", self.name, e)
+                continue
+            if not renewed:
+                self.lost = True
+                logger.warning(
+                    "Lease [%s] was lost while held, other replica may be "
+                    "writing at the same time", self.name)
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+
+class LeaseBackend(abc.ABC):
+    """
+    Base class of lease backends.
+
+    Subclasses implement acquire and release, and renew if leases expire,
+    run_exclusive coordinates replicas using them.
+    """
+
+    def __init__(self, owner: str = None, ttl: float = 60,
+                 wait_timeout: float = 120, poll_interval: float = 1):
+        """
+        __init__.
+
+        Kwargs:
+            owner [str]: Id of the lease owner, if not set one is created
+                using host name, process id and a random suffix.
+            ttl [float]: Seconds a lease is valid if the owner does not
+                release it (ex.: pod was killed while registering).
+            wait_timeout [float]: Maximum seconds a replica waits for the
+                holder, after it the replica writes without the lease.
+            poll_interval [float]: Seconds between checks while waiting.
+        """
+        self.owner = _invalid_tag_chars_re.sub("-", owner or default_owner())
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._renewers = {}
+
+    @abc.abstractmethod
+    def acquire(self, name: str) -> bool:
+        """
+        Try to acquire the lease without blocking.
+
+        Args:
+            name [str]: Name of the lease.
+        Return [bool]:
+            True if the lease was acquired.
+        """
+
+    @abc.abstractmethod
+    def release(self, name: str):
+        """
+        Release a lease held by this owner, it is a no-op if not held.
+
+        Args:
+            name [str]: Name of the lease.
+        """
+
+    def renew(self, name: str) -> bool:
+        """
+        Extend expiration of a held lease by ttl.
+
+        Backends whose leases do not expire keep this default.
+
+        Args:
+            name [str]: Name of the lease.
+        Return [bool]:
+            False if the lease is not held anymore.
+        """
+        return True
+
+    def ensure_held(self, name: str):
+        """
+        Raise if the lease was lost while run_exclusive holds it.
+
+        Functions run by run_exclusive should call it between their writes,
+        so a replica that lost the lease stops writing. It is a no-op if
+        run_exclusive is not holding the lease (ex.: it is running func
+        after wait_timeout).
+
+        Args:
+            name [str]: Name of the lease.
+        Exceptions:
+            LeaseLostError: If the lease is not held anymore.
+        """
+        renewer = self._renewers.get(name)
+        if renewer is not None and renewer.lost:
+            raise LeaseLostError(
+                "Lease [{name}] was lost while held by [{owner}], other "
+                "replica may be writing".format(name=name, owner=self.owner))
+
+    def run_exclusive(self, name: str, func, check):
+        """
+        Run func on a single replica, others wait for its result.
+
+        The lease holder calls check and, if it returns None, func. The
+        lease is renewed every ttl / 3 seconds while they run, so slow
+        registrations keep it. If it is lost, ensure_held raises
+        LeaseLostError inside func and run_exclusive raises it after func.
+        Other replicas poll check until it returns a result, the lease is
+        freed or wait_timeout is reached, in the last case func is called
+        without the lease so registration is never blocked by a stuck
+        holder.
+
+        Args:
+            name [str]: Name of the lease.
+            func [callable]: Function that makes the writes.
+            check [callable]: Function that returns the result if writes
+                were already made or None.
+        Return:
+            Result of check or func.
+        Exceptions:
+            LeaseLostError: If the lease was lost while func was running.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            if self.acquire(name):
+                renewer = _LeaseRenewer(self, name)
+                self._renewers[name] = renewer
+                try:
+                    result = check()
+                    if result is None:
+                        self.ensure_held(name)
+                        result = func()
+                        self.ensure_held(name)
+                    return result
+                finally:
+                    renewer.stop()
+                    self._renewers.pop(name, None)
+                    self.release(name)
+
+            time.sleep(self.poll_interval)
+            result = check()
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return func()
+
+
+class KongLease(LeaseBackend):
+    """
+    Lease stored on Kong as a consumer.
+
+    The lease is a consumer named 'pumpwood-lease--<name>' tagged with owner
+    and expiration time. Consumer creation is atomic (409 if it exists), an
+    expired lease is deleted by id, so a lease created meanwhile by other
+    replica is not removed. The holder renews the expiration while
+    registering. Expiration uses the replicas clocks, ttl must be larger
+    than the expected clock skew.
+    """
+
+    username_prefix = "pumpwood-lease--"
+    owner_tag_prefix = "pumpwood-lease-owner-"
+    expires_tag_prefix = "pumpwood-lease-expires-"
+
+    def __init__(self, kong_api: KongAPI, **kwargs):
+        """
+        __init__.
+
+        Args:
+            kong_api [KongAPI]: Client of the Kong storing the lease.
+        Kwargs:
+            Same as LeaseBackend.
+        """
+        super().__init__(**kwargs)
+        self.kong_api = kong_api
+        self._held = {}
+
+    def _payload(self, name: str) -> dict:
+        expires = int(time.time() + self.ttl) + 1
+        return {
+            "username": self.username_prefix + name,
+            "tags": [
+                self.owner_tag_prefix + self.owner,
+                self.expires_tag_prefix + str(expires)]}
+
+    def _tag_value(self, consumer: dict, prefix: str) -> str:
+        for tag in consumer.get("tags") or []:
+            if tag.startswith(prefix):
+                return tag[len(prefix):]
+        return None
+
+    def _is_expired(self, consumer: dict) -> bool:
+        expires = self._tag_value(consumer, self.expires_tag_prefix)
+        try:
+            return int(expires) <= time.time()
+        except (TypeError, ValueError):
+            # Not a valid lease, treat as expired
+            return True
+
+    def acquire(self, name: str) -> bool:
+        """Try to create the lease consumer, see LeaseBackend.acquire."""
+        payload = self._payload(name)
+        for _ in range(2):
+            created = self.kong_api.create_consumer(payload)
+            if created is not None:
+                self._held[name] = created["id"]
+                return True
+
+            current = self.kong_api.get_consumer(payload["username"])
+            if current is None:
+                continue
+            owner = self._tag_value(current, self.owner_tag_prefix)
+            if owner == self.owner:
+                # Renew a lease already held by this owner
+                self.kong_api.patch_consumer(
+                    current["id"], {"tags": payload["tags"]})
+                self._held[name] = current["id"]
+                return True
+            if not self._is_expired(current):
+                return False
+            self.kong_api.delete_consumer(current["id"])
+        return False
+
+    def renew(self, name: str) -> bool:
+        """Move lease expiration forward, see LeaseBackend.renew."""
+        consumer_id = self._held.get(name)
+        if consumer_id is None:
+            return False
+        renewed = self.kong_api.patch_consumer(
+            consumer_id, {"tags": self._payload(name)["tags"]})
+        return renewed is not None
+
+    def release(self, name: str):
+        """Delete the lease consumer if held, see LeaseBackend.release."""
+        consumer_id = self._held.pop(name, None)
+        if consumer_id is None:
+            return
+        self.kong_api.delete_consumer(consumer_id)
+
+
+class FileLease(LeaseBackend):
+    """
+    Lease using an exclusive lock on a local file.
+
+    It coordinates processes of the same machine, it is meant for
+    development and tests. The lock is released by the operating system if
+    the process dies, so ttl is not used. Needs fcntl (POSIX systems).
+    """
+
+    def __init__(self, directory: str = None, **kwargs):
+        """
+        __init__.
+
+        Kwargs:
+            directory [str]: Directory of the lock files, if not set the
+                system temporary directory is used.
+            Other kwargs are the same as LeaseBackend.
+        """
+        super().__init__(**kwargs)
+        self.directory = directory or tempfile.gettempdir()
+        self._held = {}
+
+    def path(self, name: str) -> str:
+        """Return lock file path of a lease."""
+        return os.path.join(
+            self.directory,
+            "pumpwood-lease--" + _invalid_tag_chars_re.sub("-", name) +
+            ".lock")
+
+    def acquire(self, name: str) -> bool:
+        """Try to lock the lease file, see LeaseBackend.acquire."""
+        import fcntl
+
+        if name in self._held:
+            return True
+        fd = os.open(self.path(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (BlockingIOError, PermissionError):
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, self.owner.encode())
+        self._held[name] = fd
+        return True
+
+    def release(self, name: str):
+        """Unlock the lease file if held, see LeaseBackend.release."""
+        import fcntl
+
+        fd = self._held.pop(name, None)
+        if fd is None:
+            return
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
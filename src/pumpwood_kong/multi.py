@@ -0,0 +1,544 @@
+"""
+Apply the same Kong operations to many gateways concurrently.
+
+Deployments with one Kong cluster per region register the same services
+and routes on all of them. Calls are made on all gateways at the same
+time, each gateway has its own deadline and a quorum sets how many of them
+must succeed. consistency_report compares the topology of the gateways.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .executor import TaskResult
+from .kong_api import KongAPI, _pumpwood_exception
+from .kong import KongManagement
+
+
+# Fields that differ between gateways even if the configuration is the same
+_ignored_fields = set(["id", "created_at", "updated_at"])
+
+
+def fan_out(calls: dict, timeouts: dict = None,
+            max_workers: int = None) -> dict:
+    """
+    Run one call by gateway concurrently.
+
+    Calls still running after the timeout of their gateway are reported as
+    failed with TimeoutError and are not waited. Their threads can not be
+    interrupted and keep running on background, so writes may still be
+    made on those gateways after fan_out returns and they may be left
+    partially written. Use consistency_report to check them.
+
+    Args:
+        calls [dict]: Functions without arguments indexed by gateway url.
+    Kwargs:
+        timeouts [dict]: Seconds each gateway call may take, indexed by
+            gateway url. Gateways without timeout are waited until done.
+        max_workers [int]: Maximum number of concurrent calls, if not set
+            all gateways are called at the same time.
+    Return [dict]:
+        TaskResult indexed by gateway url, in the order of calls.
+    """
+    timeouts = timeouts or {}
+    results = {}
+    if not calls:
+        return results
+
+    pool = ThreadPoolExecutor(max_workers=max_workers or len(calls))
+    start = time.monotonic()
+    futures = dict(
+        (pool.submit(_call, url, func), url) for url, func in calls.items())
+    pool.shutdown(wait=False)
+    while futures:
+        now = time.monotonic()
+        remaining = [
+            timeouts[url] - (now - start) for url in futures.values()
+            if timeouts.get(url) is not None]
+        done, _ = wait(
+            futures.keys(), return_when=FIRST_COMPLETED,
+            timeout=max(min(remaining), 0) if remaining else None)
+        for future in done:
+            results[futures.pop(future)] = future.result()
+
+        elapsed = time.monotonic() - start
+        for future, url in list(futures.items()):
+            timeout = timeouts.get(url)
+            if timeout is not None and elapsed >= timeout:
+                del futures[future]
+                future.cancel()
+                results[url] = TaskResult(
+                    url, TaskResult.FAILED, error=TimeoutError(
+                        "Gateway [{url}] did not answer in {timeout} "
+                        "seconds".format(url=url, timeout=timeout)))
+    return dict((url, results[url]) for url in calls.keys())
+
+
+def _call(url: str, func) -> TaskResult:
+    try:
+        result = func()
+    except Exception as e:
+        return TaskResult(url, TaskResult.FAILED, error=e)
+    return TaskResult(url, TaskResult.DONE, result=result)
+
+
+def _bind(func, args: tuple, kwargs: dict):
+    return lambda: func(*args, **kwargs)
+
+
+def _strip_url(url: str) -> str:
+    return url.rstrip("/")
+
+
+def _gateway_timeouts(urls: list, timeout: float = None,
+                      timeouts: dict = None) -> dict:
+    """
+    Return the timeout of each gateway.
+
+    Args:
+        urls [list(str)]: Gateway urls without trailing slash.
+    Kwargs:
+        timeout [float]: Default timeout.
+        timeouts [dict]: Timeout by gateway url, trailing slashes of the
+            keys are ignored.
+    Return [dict]:
+        Timeout indexed by gateway url.
+    Exceptions:
+        ValueError: If timeouts has urls that are not gateways.
+    """
+    timeouts = dict(
+        (_strip_url(url), value) for url, value in (timeouts or {}).items())
+    unknown = set(timeouts.keys()) - set(urls)
+    if unknown:
+        raise ValueError(
+            "timeouts urls {unknown} are not gateways".format(
+                unknown=sorted(unknown)))
+    return dict((url, timeouts.get(url, timeout)) for url in urls)
+
+
+def _check_quorum(results: dict, quorum: int, action: str):
+    """
+    Raise PumpWoodException if less than quorum gateways succeeded.
+
+    Args:
+        results [dict]: TaskResult indexed by gateway url.
+        quorum [int]: Minimum number of successful gateways.
+        action [str]: Name of the operation, used on error message.
+    Exceptions:
+        PumpWoodException: With the error of each failed gateway and the
+            gateways that timed out, whose calls are still running and may
+            leave them partially written.
+    """
+    succeeded = sum(1 for x in results.values() if x.status == TaskResult.DONE)
+    if succeeded >= quorum:
+        return
+    timed_out = [
+        url for url, x in results.items()
+        if isinstance(x.error, TimeoutError)]
+    message = (
+        "[{action}] succeeded on {succeeded} of {total} gateways, "
+        "quorum is {quorum}").format(
+            action=action, succeeded=succeeded, total=len(results),
+            quorum=quorum)
+    if timed_out:
+        message += (
+            ". Calls to timed out gateways keep running on background and "
+            "may leave them partially written")
+    raise _pumpwood_exception(
+        message=message,
+        payload={
+            "action": action, "quorum": quorum,
+            "errors": dict(
+                (url, str(x.error)) for url, x in results.items()
+                if x.status != TaskResult.DONE),
+            "timed_out": timed_out})
+
+
+def _normalize(obj: dict, refs: dict) -> dict:
+    """Remove ids and timestamps, foreign keys are replaced by names."""
+    normalized = {}
+    for key, value in obj.items():
+        if key in _ignored_fields:
+            continue
+        if isinstance(value, dict) and set(value.keys()) == set(["id"]):
+            value = refs.get(value["id"], value)
+        elif key == "tags" and isinstance(value, list):
+            value = sorted(value)
+        normalized[key] = value
+    return normalized
+
+
+def _ref_label(ref) -> str:
+    if ref is None:
+        return ""
+    return ref.get("name") or ref.get("id")
+
+
+def gateway_topology(kong_api: KongAPI, tags=None,
+                     page_size: int = 1000) -> dict:
+    """
+    Read services, routes, upstreams and plugins of a gateway.
+
+    Objects are indexed by name (plugins by name and the names of their
+    service and route) and normalized so they can be compared with the
+    ones of other gateways.
+
+    Args:
+        kong_api [KongAPI]: Client of the gateway.
+    Kwargs:
+        tags [str or list]: Read only objects with these tags.
+        page_size [int]: Page size of the listings.
+    Return [dict]:
+        Normalized objects by collection and key.
+    """
+    services = list(kong_api.iter_services(
+        size=page_size, prefetch=True, tags=tags))
+    routes = list(kong_api.iter_routes(
+        size=page_size, prefetch=True, tags=tags))
+    upstreams = list(kong_api.iter_upstreams(
+        size=page_size, prefetch=True, tags=tags))
+    plugins = list(kong_api.iter_plugins(
+        size=page_size, prefetch=True, tags=tags))
+
+    refs = {}
+    for obj in services + routes:
+        refs[obj["id"]] = {"name": obj.get("name") or obj["id"]}
+
+    topology = {"services": {}, "routes": {}, "upstreams": {},
+                "plugins": {}}
+    for collection, objects in [("services", services), ("routes", routes),
+                                ("upstreams", upstreams)]:
+        for obj in objects:
+            topology[collection][obj.get("name") or obj["id"]] = \
+                _normalize(obj, refs)
+    for obj in plugins:
+        plugin = _normalize(obj, refs)
+        key = "{name}:{service}:{route}".format(
+            name=obj["name"], service=_ref_label(plugin.get("service")),
+            route=_ref_label(plugin.get("route")))
+        topology["plugins"][key] = plugin
+    return topology
+
+
+def compare_topologies(topologies: dict) -> dict:
+    """
+    Compare topologies of many gateways.
+
+    Args:
+        topologies [dict]: gateway_topology results indexed by gateway url.
+    Return [dict]:
+        Differences by collection, a list of {'key', 'missing_on',
+        'fields'} where missing_on lists gateways without the object and
+        fields maps each field that differs to its value on each gateway.
+    """
+    urls = list(topologies.keys())
+    differences = {}
+    for collection in ["services", "routes", "upstreams", "plugins"]:
+        keys = set()
+        for topology in topologies.values():
+            keys.update(topology[collection].keys())
+
+        collection_differences = []
+        for key in sorted(keys):
+            objects = dict(
+                (url, topologies[url][collection][key]) for url in urls
+                if key in topologies[url][collection])
+            fields = {}
+            field_names = set()
+            for obj in objects.values():
+                field_names.update(obj.keys())
+            for field in sorted(field_names):
+                values = dict(
+                    (url, obj.get(field)) for url, obj in objects.items())
+                first = next(iter(values.values()))
+                if any(x != first for x in values.values()):
+                    fields[field] = values
+            missing_on = [url for url in urls if url not in objects]
+            if missing_on or fields:
+                collection_differences.append({
+                    "key": key, "missing_on": missing_on,
+                    "fields": fields})
+        differences[collection] = collection_differences
+    return differences
+
+
+class MultiKongAPI:
+    """
+    KongAPI calls made on many gateways concurrently.
+
+    Each method calls the KongAPI method with the same name on all gateways
+    and returns a dict of TaskResult indexed by gateway url. If less than
+    quorum gateways succeed a PumpWoodException is raised with the error of
+    each failed gateway.
+    """
+
+    def __init__(self, api_gateway_urls: list, quorum: int = None,
+                 timeout: float = None, timeouts: dict = None,
+                 **kwargs):
+        """
+        __init__.
+
+        Args:
+            api_gateway_urls [list(str)]: Admin API urls of the gateways.
+        Kwargs:
+            quorum [int]: Minimum number of gateways where a call must
+                succeed, if not set all gateways must succeed.
+            timeout [float]: Seconds a call may take on each gateway, after
+                it the gateway is considered failed.
+            timeouts [dict]: Timeout by gateway url, overrides timeout.
+                Trailing slashes of the urls are ignored.
+            Other kwargs are passed to KongAPI of each gateway. If
+            request_timeout is not set the gateway timeout is used.
+        """
+        if not api_gateway_urls:
+            raise ValueError("At least one api_gateway_url must be set")
+        urls = list(dict.fromkeys(_strip_url(x) for x in api_gateway_urls))
+        self.timeouts = _gateway_timeouts(urls, timeout, timeouts)
+        self.kong_apis = {}
+        for url in urls:
+            gateway_kwargs = dict(kwargs)
+            if gateway_kwargs.get("request_timeout") is None:
+                gateway_kwargs["request_timeout"] = self.timeouts[url]
+            self.kong_apis[url] = KongAPI(
+                api_gateway_url=url, **gateway_kwargs)
+
+        self.quorum = len(self.kong_apis) if quorum is None else quorum
+        if not 0 < self.quorum <= len(self.kong_apis):
+            raise ValueError(
+                "quorum must be between 1 and the number of gateways")
+
+    @property
+    def api_gateway_urls(self) -> list:
+        """Urls of the gateways."""
+        return list(self.kong_apis.keys())
+
+    def call(self, method: str, *args, quorum: int = None,
+             **kwargs) -> dict:
+        """
+        Call a KongAPI method on all gateways.
+
+        Args:
+            method [str]: Name of the KongAPI method.
+            Other args and kwargs are passed to the method.
+        Kwargs:
+            quorum [int]: Quorum of this call, self.quorum if not set.
+        Return [dict]:
+            TaskResult indexed by gateway url. Gateways that timed out are
+            failed but their calls keep running on background and may still
+            write to them, see fan_out.
+        Exceptions:
+            PumpWoodException: If less than quorum gateways succeeded.
+        """
+        results = fan_out(
+            dict((url, _bind(getattr(kong_api, method), args, kwargs))
+                 for url, kong_api in self.kong_apis.items()),
+            timeouts=self.timeouts)
+        _check_quorum(
+            results, self.quorum if quorum is None else quorum, method)
+        return results
+
+    def register_service(self, *args, **kwargs) -> dict:
+        """KongAPI.register_service on all gateways, see call."""
+        return self.call("register_service", *args, **kwargs)
+
+    def register_route(self, *args, **kwargs) -> dict:
+        """KongAPI.register_route on all gateways, see call."""
+        return self.call("register_route", *args, **kwargs)
+
+    def register_routes(self, *args, **kwargs) -> dict:
+        """KongAPI.register_routes on all gateways, see call."""
+        return self.call("register_routes", *args, **kwargs)
+
+    def put_service(self, *args, **kwargs) -> dict:
+        """KongAPI.put_service on all gateways, see call."""
+        return self.call("put_service", *args, **kwargs)
+
+    def put_route(self, *args, **kwargs) -> dict:
+        """KongAPI.put_route on all gateways, see call."""
+        return self.call("put_route", *args, **kwargs)
+
+    def sync_plugins(self, *args, **kwargs) -> dict:
+        """KongAPI.sync_plugins on all gateways, see call."""
+        return self.call("sync_plugins", *args, **kwargs)
+
+    def list_services(self, *args, **kwargs) -> dict:
+        """KongAPI.list_services on all gateways, see call."""
+        return self.call("list_services", *args, **kwargs)
+
+    def list_all_routes(self, *args, **kwargs) -> dict:
+        """KongAPI.list_all_routes on all gateways, see call."""
+        return self.call("list_all_routes", *args, **kwargs)
+
+    def delete_routes_and_service(self, *args, **kwargs) -> dict:
+        """KongAPI.delete_routes_and_service on all gateways, see call."""
+        return self.call("delete_routes_and_service", *args, **kwargs)
+
+    def teardown(self, *args, **kwargs) -> dict:
+        """
+        KongAPI.teardown on all gateways, see call.
+
+        A gateway is considered failed if any of its deletes failed.
+        """
+        def teardown(kong_api: KongAPI):
+            results = kong_api.teardown(*args, **kwargs)
+            for result in results:
+                if result.status == TaskResult.FAILED:
+                    raise result.error
+            return results
+
+        results = fan_out(
+            dict((url, _bind(teardown, (kong_api, ), {}))
+                 for url, kong_api in self.kong_apis.items()),
+            timeouts=self.timeouts)
+        _check_quorum(results, self.quorum, "teardown")
+        return results
+
+    def consistency_report(self, tags=None, page_size: int = 1000) -> dict:
+        """
+        Compare services, routes, upstreams and plugins of the gateways.
+
+        Objects are compared by name without ids and timestamps, so
+        gateways registered by the same code are consistent even if their
+        ids differ. Unreachable gateways are reported and not compared.
+
+        Kwargs:
+            tags [str or list]: Compare only objects with these tags.
+            page_size [int]: Page size of the listings.
+        Return [dict]:
+            'consistent' (bool), 'gateways' with status, error and objects
+            count of each gateway and 'differences' by collection, see
+            compare_topologies.
+        """
+        results = fan_out(
+            dict((url, _bind(gateway_topology, (kong_api, ), {
+                    "tags": tags, "page_size": page_size}))
+                 for url, kong_api in self.kong_apis.items()),
+            timeouts=self.timeouts)
+
+        gateways = {}
+        topologies = {}
+        for url, result in results.items():
+            gateways[url] = {
+                "status": result.status,
+                "error": None if result.error is None else str(result.error)}
+            if result.status == TaskResult.DONE:
+                topologies[url] = result.result
+                gateways[url]["counts"] = dict(
+                    (k, len(v)) for k, v in result.result.items())
+
+        differences = compare_topologies(topologies)
+        consistent = len(topologies) == len(results) and not any(
+            differences.values())
+        return {
+            "consistent": consistent, "gateways": gateways,
+            "differences": differences}
+
+
+class MultiKongManagement:
+    """
+    KongManagement registering the same service on many gateways.
+
+    One KongManagement is built for each gateway and registrations are
+    applied on all of them concurrently, so startup takes as long as the
+    slowest gateway instead of the sum of them.
+    """
+
+    def __init__(self, api_gateway_urls: list, quorum: int = None,
+                 timeout: float = None, timeouts: dict = None,
+                 defer: bool = False, **kwargs):
+        """
+        __init__.
+
+        Args:
+            api_gateway_urls (list[str]): Admin API urls of the gateways.
+        Kwargs:
+            quorum (int): Minimum number of gateways where registration
+                must succeed, if not set all gateways must succeed.
+            timeout (float): Seconds a registration may take on each
+                gateway, after it the gateway is considered failed.
+            timeouts (dict): Timeout by gateway url, overrides timeout.
+                Trailing slashes of the urls are ignored.
+            defer (bool): Only build the registration plans, they are
+                written by apply.
+            Other kwargs are passed to KongManagement of each gateway.
+        """
+        if not api_gateway_urls:
+            raise ValueError("At least one api_gateway_url must be set")
+        urls = list(dict.fromkeys(_strip_url(x) for x in api_gateway_urls))
+        self.timeouts = _gateway_timeouts(urls, timeout, timeouts)
+        self.managements = {}
+        for url in urls:
+            self.managements[url] = KongManagement(
+                api_gateway_url=url, defer=True, **kwargs)
+            self.managements[url].defer = defer
+
+        self.quorum = len(self.managements) if quorum is None else quorum
+        if not 0 < self.quorum <= len(self.managements):
+            raise ValueError(
+                "quorum must be between 1 and the number of gateways")
+        self.defer = defer
+        self.last_results = None
+        if not defer and kwargs.get("service_name") is not None:
+            self.apply()
+
+    def call(self, method: str, *args, **kwargs) -> dict:
+        """
+        Call a KongManagement method on all gateways.
+
+        Args:
+            method (str): Name of the KongManagement method.
+            Other args and kwargs are passed to the method.
+        Return (dict):
+            TaskResult indexed by gateway url, also kept on last_results.
+            Gateways that timed out are failed but their registration keeps
+            running on background and may still write to them, see fan_out.
+        Exceptions:
+            PumpWoodException: If less than quorum gateways succeeded.
+        """
+        results = fan_out(
+            dict((url, _bind(getattr(management, method), args, kwargs))
+                 for url, management in self.managements.items()),
+            timeouts=self.timeouts)
+        self.last_results = results
+        _check_quorum(results, self.quorum, method)
+        return results
+
+    def apply(self, background: bool = False):
+        """
+        Apply the registration plan of each gateway concurrently.
+
+        Kwargs:
+            background (bool): Apply on a background thread.
+        Return (dict or Future):
+            TaskResult indexed by gateway url, or a Future with it.
+        """
+        if background:
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self.apply)
+            executor.shutdown(wait=False)
+            return future
+        return self.call("apply")
+
+    def register_models(self, *args, **kwargs) -> dict:
+        """KongManagement.register_models on all gateways, see call."""
+        return self.call("register_models", *args, **kwargs)
+
+    def add_plugins(self, *args, **kwargs) -> dict:
+        """KongManagement.add_plugins on all gateways, see call."""
+        return self.call("add_plugins", *args, **kwargs)
+
+    def register_target(self) -> dict:
+        """KongManagement.register_target on all gateways, see call."""
+        return self.call("register_target")
+
+    def deregister_target(self) -> dict:
+        """KongManagement.deregister_target on all gateways, see call."""
+        return self.call("deregister_target")
+
+    def multi_kong_api(self) -> MultiKongAPI:
+        """
+        Return a MultiKongAPI for the same gateways.
+
+        It can be used for listings, teardown and consistency_report.
+        """
+        return MultiKongAPI(
+            api_gateway_urls=list(self.managements.keys()),
+            quorum=self.quorum, timeouts=self.timeouts)
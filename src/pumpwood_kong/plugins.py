@@ -0,0 +1,187 @@
+"""
+Build Kong plugin payloads with deterministic ids.
+
+Plugin ids are uuid5 of the plugin name and the names of the service and
+route it is attached to, so writing the same plugin again updates it
+instead of creating a duplicate, on any Kong.
+"""
+import uuid
+
+
+_plugin_namespace = uuid.uuid5(uuid.NAMESPACE_URL, "pumpwood-kong/plugins")
+
+
+def _ref_name(ref) -> str:
+    if ref is None:
+        return ""
+    if isinstance(ref, str):
+        return ref
+    return ref.get("name", ref.get("id"))
+
+
+def plugin_id(name: str, service=None, route=None) -> str:
+    """
+    Return deterministic id of a plugin.
+
+    Args:
+        name [str]: Plugin name, ex.: 'proxy-cache'.
+    Kwargs:
+        service [str or dict]: Service name or reference of the plugin.
+        route [str or dict]: Route name or reference of the plugin.
+    Return [str]:
+        Plugin uuid.
+    """
+    key = "{name}:{service}:{route}".format(
+        name=name, service=_ref_name(service), route=_ref_name(route))
+    return str(uuid.uuid5(_plugin_namespace, key))
+
+
+def plugin_payload(name: str, config: dict = None, service: str = None,
+                   route: str = None, enabled: bool = True,
+                   tags: list = None) -> dict:
+    """
+    Build payload of a plugin attached to a service, a route or global.
+
+    Args:
+        name [str]: Plugin name.
+    Kwargs:
+        config [dict]: Plugin configuration.
+        service [str]: Name of the service of the plugin.
+        route [str]: Name of the route of the plugin.
+        enabled [bool]: If plugin is enabled.
+        tags [list(str)]: Tags of the plugin.
+    Return [dict]:
+        Kong plugin payload with deterministic id.
+    """
+    payload = {
+        "id": plugin_id(name, service=service, route=route),
+        "name": name,
+        "config": dict(config or {}),
+        "enabled": enabled}
+    if service is not None:
+        payload["service"] = {"name": service}
+    if route is not None:
+        payload["route"] = {"name": route}
+    if tags is not None:
+        payload["tags"] = list(tags)
+    return payload
+
+
+def proxy_cache(ttl: int = 300, vary_query_params: list = None,
+                vary_headers: list = None,
+                request_method: tuple = ("GET", "HEAD"),
+                content_type: tuple = ("application/json",),
+                response_code: tuple = (200,), strategy: str = "memory",
+                **kwargs) -> dict:
+    """
+    Build proxy-cache plugin payload.
+
+    Args:
+        No Args.
+    Kwargs:
+        ttl [int]: Seconds responses are kept on cache.
+        vary_query_params [list(str)]: Query parameters used on cache key,
+            if not set all are used.
+        vary_headers [list(str)]: Headers used on cache key, ex.:
+            Authorization so users do not share cached responses.
+        request_method [tuple]: Methods that are cached.
+        content_type [tuple]: Response content types that are cached.
+        response_code [tuple]: Response status that are cached.
+        strategy [str]: Cache backend.
+        Other kwargs are passed to plugin_payload (service, route, ...).
+    Return [dict]:
+        Kong plugin payload.
+    """
+    config = {
+        "cache_ttl": ttl,
+        "request_method": list(request_method),
+        "content_type": list(content_type),
+        "response_code": list(response_code),
+        "strategy": strategy}
+    if vary_query_params is not None:
+        config["vary_query_params"] = list(vary_query_params)
+    if vary_headers is not None:
+        config["vary_headers"] = list(vary_headers)
+    return plugin_payload("proxy-cache", config=config, **kwargs)
+
+
+def rate_limiting(second: int = None, minute: int = None,
+                  hour: int = None, day: int = None,
+                  limit_by: str = "consumer", policy: str = "local",
+                  **kwargs) -> dict:
+    """
+    Build rate-limiting plugin payload.
+
+    Args:
+        No Args.
+    Kwargs:
+        second [int]: Calls allowed by second.
+        minute [int]: Calls allowed by minute.
+        hour [int]: Calls allowed by hour.
+        day [int]: Calls allowed by day.
+        limit_by [str]: Entity counted (consumer, ip, header, ...).
+        policy [str]: Where counters are kept (local, cluster, redis).
+        Other kwargs are passed to plugin_payload (service, route, ...).
+    Return [dict]:
+        Kong plugin payload.
+    Exceptions:
+        ValueError: If no limit is set.
+    """
+    limits = {"second": second, "minute": minute, "hour": hour, "day": day}
+    config = dict((k, v) for k, v in limits.items() if v is not None)
+    if not config:
+        raise ValueError("At least one rate limit must be set")
+    config["limit_by"] = limit_by
+    config["policy"] = policy
+    return plugin_payload("rate-limiting", config=config, **kwargs)
+
+
+def request_size_limiting(allowed_payload_size: int = 128,
+                          size_unit: str = "megabytes",
+                          **kwargs) -> dict:
+    """
+    Build request-size-limiting plugin payload.
+
+    Args:
+        No Args.
+    Kwargs:
+        allowed_payload_size [int]: Maximum request body size.
+        size_unit [str]: Unit of allowed_payload_size (bytes, kilobytes or
+            megabytes).
+        Other kwargs are passed to plugin_payload (service, route, ...).
+    Return [dict]:
+        Kong plugin payload.
+    """
+    return plugin_payload("request-size-limiting", config={
+        "allowed_payload_size": allowed_payload_size,
+        "size_unit": size_unit}, **kwargs)
+
+
+def is_plugin_changed(desired: dict, live: dict) -> bool:
+    """
+    Check if a live plugin differs from the desired payload.
+
+    Kong fills config defaults, so only desired config keys are compared.
+
+    Args:
+        desired [dict]: Desired plugin payload.
+        live [dict]: Plugin from Kong, None if it does not exist.
+    Return [bool]:
+        True if plugin must be written.
+    """
+    if live is None:
+        return True
+    if desired.get("enabled", True) != live.get("enabled", True):
+        return True
+    if "tags" in desired and \
+            sorted(desired["tags"] or []) != sorted(live.get("tags") or []):
+        return True
+    live_config = live.get("config") or {}
+    for key, value in (desired.get("config") or {}).items():
+        live_value = live_config.get(key)
+        if isinstance(value, list) and isinstance(live_value, list):
+            if sorted(map(str, value)) != sorted(map(str, live_value)):
+                return True
+        elif live_value != value:
+            return True
+    return False
@@ -0,0 +1,258 @@
+"""Resolve request paths to Kong routes and services."""
+import re
+import threading
+
+
+class _TrieNode:
+    """Node of the path segments trie."""
+
+    __slots__ = ["children", "terminals"]
+
+    def __init__(self):
+        self.children = {}
+        # Last, partial, segment of the paths ending at this node
+        self.terminals = {}
+
+
+class RouteMatch:
+    """Route and service matched by a request path."""
+
+    __slots__ = ["route", "service", "path"]
+
+    def __init__(self, route: dict, service: dict, path: str):
+        """
+        __init__.
+
+        Args:
+            route [dict]: Kong route.
+            service [dict]: Kong service of the route, None if not known.
+            path [str]: Route path that matched the request path.
+        """
+        self.route = route
+        self.service = service
+        self.path = path
+
+    @property
+    def service_name(self) -> str:
+        """Name of the matched service."""
+        if self.service is None:
+            return None
+        return self.service["name"]
+
+    def __repr__(self):
+        return "RouteMatch({route}, {service}, {path})".format(
+            route=self.route.get("name"), service=self.service_name,
+            path=self.path)
+
+
+class PathResolver:
+    """
+    Resolve request paths to the route and service Kong would proxy to.
+
+    Prefix paths are stored on a trie keyed by path segments, so resolving
+    a path costs its number of segments instead of the number of routes.
+    As on Kong, regex paths (starting with '~') are evaluated first by
+    regex_priority and then the longest matching prefix wins. Only paths
+    are considered, route hosts, methods and headers are not. Resolver can
+    be updated and read from many threads (ex.: KongAPI concurrent writes).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._root = _TrieNode()
+        self._regex_routes = []
+        self._route_paths = {}
+        self._routes = {}
+        self.services = {}
+
+    @classmethod
+    def from_routes(cls, routes: list, services: list = None
+                    ) -> "PathResolver":
+        """
+        Build a resolver from lists of Kong routes and services.
+
+        Args:
+            routes [list(dict)]: Kong routes.
+        Kwargs:
+            services [list(dict)]: Kong services, used to return the service
+                of the matched route.
+        Return [PathResolver]:
+            Resolver with the routes.
+        """
+        resolver = cls()
+        for service in services or []:
+            resolver.add_service(service)
+        for route in routes:
+            resolver.add_route(route)
+        return resolver
+
+    @classmethod
+    def from_kong(cls, kong_api, page_size: int = 1000) -> "PathResolver":
+        """
+        Build a resolver from Kong routes and services.
+
+        Args:
+            kong_api [KongAPI]: Client used to fetch the routes.
+        Kwargs:
+            page_size [int]: Page size used to fetch the collections.
+        Return [PathResolver]:
+            Resolver with all Kong routes.
+        """
+        resolver = cls()
+        for service in kong_api.iter_services(size=page_size, prefetch=True):
+            resolver.add_service(service)
+        for route in kong_api.iter_routes(size=page_size, prefetch=True):
+            resolver.add_route(route)
+        return resolver
+
+    @staticmethod
+    def _split(path: str) -> list:
+        return path.split("/")
+
+    def add_service(self, service: dict):
+        """
+        Add or update a service used to describe matches.
+
+        Args:
+            service [dict]: Kong service.
+        """
+        with self._lock:
+            self.services[service["id"]] = service
+
+    def remove_service(self, service_id: str):
+        """
+        Remove a service and the routes that reference it.
+
+        Args:
+            service_id [str]: Kong service id or name.
+        """
+        with self._lock:
+            if service_id not in self.services:
+                service_id = next((
+                    key for key, service in self.services.items()
+                    if service.get("name") == service_id), service_id)
+            self.services.pop(service_id, None)
+            route_ids = [
+                key for key, route in self._routes.items()
+                if (route.get("service") or {}).get("id") == service_id]
+            for route_id in route_ids:
+                self.remove_route(route_id)
+
+    def add_route(self, route: dict):
+        """
+        Add a route, if a route with same id exists it is replaced.
+
+        Args:
+            route [dict]: Kong route.
+        """
+        with self._lock:
+            if route["id"] in self._routes:
+                self.remove_route(route["id"])
+            self._routes[route["id"]] = route
+            paths = route.get("paths") or []
+            self._route_paths[route["id"]] = paths
+
+            for path in paths:
+                if path.startswith("~"):
+                    self._regex_routes.append(
+                        (re.compile(path[1:]), path, route))
+                    continue
+                segments = self._split(path)
+                node = self._root
+                for segment in segments[:-1]:
+                    node = node.children.setdefault(segment, _TrieNode())
+                node.terminals.setdefault(segments[-1], []).append(route)
+            self._regex_routes.sort(
+                key=lambda x: -(x[2].get("regex_priority") or 0))
+
+    def remove_route(self, route_id: str):
+        """
+        Remove a route.
+
+        Args:
+            route_id [str]: Kong route id or name.
+        """
+        with self._lock:
+            if route_id not in self._routes:
+                route_id = next((
+                    key for key, route in self._routes.items()
+                    if route.get("name") == route_id), None)
+            route = self._routes.pop(route_id, None)
+            if route is None:
+                return
+            self._regex_routes = [
+                x for x in self._regex_routes if x[2]["id"] != route_id]
+            for path in self._route_paths.pop(route_id):
+                if path.startswith("~"):
+                    continue
+                segments = self._split(path)
+                nodes = [self._root]
+                for segment in segments[:-1]:
+                    nodes.append(nodes[-1].children[segment])
+                terminal = nodes[-1].terminals[segments[-1]]
+                terminal[:] = [x for x in terminal if x["id"] != route_id]
+                if not terminal:
+                    del nodes[-1].terminals[segments[-1]]
+
+                # prune empty nodes
+                for depth in range(len(nodes) - 1, 0, -1):
+                    node = nodes[depth]
+                    if node.children or node.terminals:
+                        break
+                    del nodes[depth - 1].children[segments[depth - 1]]
+
+    def _match(self, route: dict, path: str) -> RouteMatch:
+        service_id = (route.get("service") or {}).get("id")
+        return RouteMatch(
+            route=route, service=self.services.get(service_id), path=path)
+
+    def resolve_all(self, request_path: str) -> list:
+        """
+        Return all routes matching a request path by priority.
+
+        Args:
+            request_path [str]: Path of the request, query string is
+                ignored.
+        Return [list(RouteMatch)]:
+            Matches sorted by Kong priority, regex matches first and then
+            prefixes from the longest to the shortest.
+        """
+        request_path = request_path.split("?", 1)[0]
+        with self._lock:
+            matches = [
+                self._match(route, path)
+                for regex, path, route in self._regex_routes
+                if regex.match(request_path)]
+
+            segments = self._split(request_path)
+            prefix_matches = []
+            node = self._root
+            for depth, segment in enumerate(segments):
+                if node.terminals:
+                    for size in range(len(segment), -1, -1):
+                        routes = node.terminals.get(segment[:size])
+                        if routes is None:
+                            continue
+                        path = "/".join(segments[:depth] + [segment[:size]])
+                        for route in routes:
+                            prefix_matches.append(self._match(route, path))
+                node = node.children.get(segment)
+                if node is None:
+                    break
+
+        prefix_matches.sort(key=lambda x: -len(x.path))
+        return matches + prefix_matches
+
+    def resolve(self, request_path: str) -> RouteMatch:
+        """
+        Return the route Kong would use for a request path.
+
+        Args:
+            request_path [str]: Path of the request.
+        Return [RouteMatch]:
+            Best match or None if no route matches.
+        """
+        matches = self.resolve_all(request_path)
+        if not matches:
+            return None
+        return matches[0]
@@ -0,0 +1,199 @@
+"""Retry policy and circuit breaker for Kong Admin API calls."""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from requests.exceptions import ConnectionError
+
+
+class CircuitBreakerOpenError(ConnectionError):
+    """Call was not made because the circuit of the host is open."""
+
+
+class RetryPolicy:
+    """
+    Retry idempotent calls on connection errors and 5xx/429 responses.
+
+    Wait between attempts uses exponential backoff with full jitter, so
+    many clients retrying at the same time are spread over the backoff
+    window. Retry-After header is respected if present.
+    """
+
+    def __init__(self, max_retries: int = 5, backoff_factor: float = 0.5,
+                 max_backoff: float = 30,
+                 retry_statuses: tuple = (429, 500, 502, 503, 504),
+                 retry_methods: tuple = ("GET", "HEAD", "PUT", "DELETE",
+                                         "OPTIONS"),
+                 respect_retry_after: bool = True, sleep=None):
+        """
+        __init__.
+
+        Kwargs:
+            max_retries [int]: Maximum number of retries of a call.
+            backoff_factor [float]: Base of the exponential backoff, wait
+                before retry n is at most backoff_factor * 2 ** n seconds.
+            max_backoff [float]: Maximum wait between attempts in seconds,
+                Retry-After is also limited by it.
+            retry_statuses [tuple]: Response status that are retried.
+            retry_methods [tuple]: Idempotent HTTP methods that can be
+                retried.
+            respect_retry_after [bool]: Use Retry-After response header as
+                wait time when present.
+            sleep [callable]: Function called with the seconds to wait
+                between attempts, time.sleep if not set.
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = tuple(retry_statuses)
+        self.retry_methods = tuple(x.upper() for x in retry_methods)
+        self.respect_retry_after = respect_retry_after
+        self.sleep = time.sleep if sleep is None else sleep
+
+    def can_retry(self, method: str, attempt: int) -> bool:
+        """
+        Check if a call can be retried.
+
+        Args:
+            method [str]: HTTP method of the call.
+            attempt [int]: Number of retries already made.
+        Return [bool]:
+            True if method is idempotent and retries are not exhausted.
+        """
+        return method.upper() in self.retry_methods and \
+            attempt < self.max_retries
+
+    def is_retry_status(self, status_code: int) -> bool:
+        """Check if a response status must be retried."""
+        return status_code in self.retry_statuses
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Return jittered wait before a retry.
+
+        Args:
+            attempt [int]: Number of retries already made.
+        Return [float]:
+            Seconds to wait.
+        """
+        limit = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, limit)
+
+    def _retry_after(self, response) -> float:
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_date.timestamp() - time.time())
+
+    def wait_time(self, attempt: int, response=None) -> float:
+        """
+        Return wait before a retry considering Retry-After header.
+
+        Args:
+            attempt [int]: Number of retries already made.
+        Kwargs:
+            response [requests.Response]: Response of the failed attempt.
+        Return [float]:
+            Seconds to wait.
+        """
+        if response is not None and self.respect_retry_after:
+            retry_after = self._retry_after(response)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        return self.backoff(attempt)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a host after consecutive failures.
+
+    After failure_threshold consecutive failures on a host the circuit
+    opens and calls fail fast with CircuitBreakerOpenError. After
+    recovery_timeout one trial call is allowed (half-open), the circuit
+    closes if it succeeds and opens again if it fails. State is kept by
+    host, so one breaker can be shared by clients of different gateways.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5,
+                 recovery_timeout: float = 30, clock=None):
+        """
+        __init__.
+
+        Kwargs:
+            failure_threshold [int]: Consecutive failures that open the
+                circuit.
+            recovery_timeout [float]: Seconds the circuit stays open before
+                a trial call.
+            clock [callable]: Function returning current time in seconds,
+                time.monotonic if not set.
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = time.monotonic if clock is None else clock
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._opened_at = {}
+        self._trial_running = set()
+
+    def state(self, key: str) -> str:
+        """Return circuit state of a host."""
+        with self._lock:
+            return self._state(key)
+
+    def _state(self, key: str) -> str:
+        opened_at = self._opened_at.get(key)
+        if opened_at is None:
+            return self.CLOSED
+        if self.clock() - opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self, key: str):
+        """
+        Check if a call to host can be made.
+
+        Args:
+            key [str]: Host of the call.
+        Exceptions:
+            CircuitBreakerOpenError: If circuit is open or a half-open
+                trial call is already running.
+        """
+        with self._lock:
+            state = self._state(key)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and key not in self._trial_running:
+                self._trial_running.add(key)
+                return
+        raise CircuitBreakerOpenError(
+            "Circuit for [{key}] is open after {failures} consecutive "
+            "failures".format(key=key, failures=self._failures.get(key)))
+
+    def record_success(self, key: str):
+        """Close the circuit of a host."""
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_at.pop(key, None)
+            self._trial_running.discard(key)
+
+    def record_failure(self, key: str):
+        """Count a failure and open circuit if threshold is reached."""
+        with self._lock:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            half_open = key in self._trial_running
+            self._trial_running.discard(key)
+            if half_open or failures >= self.failure_threshold:
+                self._opened_at[key] = self.clock()
@@ -0,0 +1,176 @@
+"""
+Export and import Kong services and routes as JSON Lines snapshots.
+
+Snapshots have a header line followed by one line per object, services
+before routes. Routes reference services by name, so a snapshot can be
+imported on other Kong. Files ending with '.gz' are gzip compressed.
+"""
+import gzip
+import json
+import time
+from .executor import ConcurrentExecutor, Task
+
+
+snapshot_format_version = 1
+_drop_fields = ["id", "created_at", "updated_at"]
+
+
+def _open(path: str, mode: str, compress: bool = None):
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _clean(obj: dict) -> dict:
+    """Remove None, id and timestamps from a Kong object."""
+    keep_id = obj.get("name") is None
+    return dict(
+        (key, value) for key, value in obj.items()
+        if value is not None and (key not in _drop_fields or (
+            key == "id" and keep_id)))
+
+
+def _dump_line(file, entity: str, data: dict):
+    file.write(json.dumps(
+        {"entity": entity, "data": data}, separators=(",", ":")))
+    file.write("\n")
+
+
+def export_snapshot(kong_api, path: str, page_size: int = 1000,
+                    compress: bool = None) -> dict:
+    """
+    Export Kong services and routes to a snapshot file.
+
+    Collections are read in one paginated pass each and objects are
+    written as they arrive, only service id to name map is kept in memory.
+
+    Args:
+        kong_api [KongAPI]: Client of the source Kong.
+        path [str]: Path of the snapshot file.
+    Kwargs:
+        page_size [int]: Page size used to read the collections.
+        compress [bool]: Gzip the file, if None it is compressed when path
+            ends with '.gz'.
+    Return [dict]:
+        Number of exported objects by entity.
+    """
+    counts = {"service": 0, "route": 0}
+    service_refs = {}
+    with _open(path, "w", compress) as file:
+        _dump_line(file, "snapshot", {
+            "format_version": snapshot_format_version,
+            "created_at": int(time.time()),
+            "api_gateway_url": kong_api.api_gateway_url})
+        for service in kong_api.iter_services(
+                size=page_size, prefetch=True):
+            if service.get("name") is None:
+                service_refs[service["id"]] = {"id": service["id"]}
+            else:
+                service_refs[service["id"]] = {"name": service["name"]}
+            _dump_line(file, "service", _clean(service))
+            counts["service"] += 1
+
+        for route in kong_api.iter_routes(size=page_size, prefetch=True):
+            route = _clean(route)
+            service_id = (route.get("service") or {}).get("id")
+            if service_id is not None:
+                route["service"] = service_refs.get(
+                    service_id, {"id": service_id})
+            _dump_line(file, "route", route)
+            counts["route"] += 1
+    return counts
+
+
+def iter_snapshot(path: str, compress: bool = None):
+    """
+    Iterate over the objects of a snapshot file.
+
+    Args:
+        path [str]: Path of the snapshot file.
+    Kwargs:
+        compress [bool]: File is gzipped, if None it is considered
+            compressed when path ends with '.gz'.
+    Return [generator(tuple)]:
+        (entity, data) tuples, entity is 'service' or 'route'.
+    Exceptions:
+        ValueError: If the file is not a snapshot or its format version is
+            not supported.
+    """
+    with _open(path, "r", compress) as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("entity") != "snapshot":
+            raise ValueError(
+                "[{path}] is not a Kong snapshot".format(path=path))
+        version = header["data"].get("format_version")
+        if version != snapshot_format_version:
+            raise ValueError(
+                "Snapshot format version [{version}] is not "
+                "supported".format(version=version))
+        for line in file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield item["entity"], item["data"]
+
+
+def import_snapshot(kong_api, path: str, batch_size: int = 500,
+                    max_workers: int = 10, compress: bool = None) -> dict:
+    """
+    Import a snapshot file on Kong.
+
+    Objects are upserted by name with concurrent PUTs in batches of
+    batch_size, so only one batch is kept in memory. Routes of a batch are
+    written after the services of the same batch they reference.
+
+    Args:
+        kong_api [KongAPI]: Client of the target Kong.
+        path [str]: Path of the snapshot file.
+    Kwargs:
+        batch_size [int]: Number of objects written on each batch.
+        max_workers [int]: Maximum number of concurrent writes.
+        compress [bool]: File is gzipped, if None it is considered
+            compressed when path ends with '.gz'.
+    Return [dict]:
+        Number of imported objects by entity.
+    Exceptions:
+        Raise the error of the first failed write, batches after it are not
+        written.
+    """
+    counts = {"service": 0, "route": 0}
+    executor = ConcurrentExecutor(max_workers=max_workers)
+
+    def write_batch(batch: list):
+        tasks = []
+        batch_services = set()
+        for entity, data in batch:
+            key = data.get("name") or data["id"]
+            if entity == "service":
+                batch_services.add(key)
+                tasks.append(Task(
+                    key=(entity, key), func=kong_api.put_service,
+                    args=(key, data)))
+            else:
+                service = data.get("service") or {}
+                service_key = service.get("name", service.get("id"))
+                depends_on = []
+                if service_key in batch_services:
+                    depends_on.append(("service", service_key))
+                tasks.append(Task(
+                    key=(entity, key), func=kong_api.put_route,
+                    args=(key, data), depends_on=depends_on))
+            counts[entity] += 1
+        executor.run(tasks)
+
+    batch = []
+    for entity, data in iter_snapshot(path, compress=compress):
+        if entity not in counts:
+            continue
+        batch.append((entity, data))
+        if len(batch) >= batch_size:
+            write_batch(batch)
+            batch = []
+    if batch:
+        write_batch(batch)
+    return counts
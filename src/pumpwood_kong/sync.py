@@ -0,0 +1,317 @@
+"""Reconcile a desired set of Kong services and routes with live Kong."""
+from urllib.parse import urlsplit
+from .kong_api import KongAPI
+from .executor import ConcurrentExecutor, Task, _raise_first_error
+
+
+_default_ports = {"http": 80, "https": 443, "grpc": 80, "grpcs": 443}
+
+# Fields compared as sets, Kong does not give meaning to their order and
+# return None for empty lists
+_set_fields = ["paths", "methods", "hosts", "protocols", "tags", "snis"]
+
+
+def expand_service_url(payload: dict) -> dict:
+    """
+    Split service 'url' into Kong protocol, host, port and path fields.
+
+    Kong does not store the url of the services, it is split in its
+    components. Desired payloads must be expanded to be compared with live
+    services.
+
+    Args:
+        payload [dict]: Kong service payload.
+    Return [dict]:
+        Copy of the payload with 'url' replaced by its components.
+    """
+    if "url" not in payload:
+        return dict(payload)
+    expanded = dict(payload)
+    url = urlsplit(expanded.pop("url"))
+    expanded["protocol"] = url.scheme
+    expanded["host"] = url.hostname
+    expanded["port"] = url.port or _default_ports.get(url.scheme, 80)
+    expanded["path"] = url.path or None
+    return expanded
+
+
+def _normalize(key: str, value):
+    if key in _set_fields:
+        return sorted(value or [])
+    return value
+
+
+class SyncAction:
+    """Create, update, delete or no-op action over a Kong object."""
+
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+    NOOP = "noop"
+
+    def __init__(self, action: str, entity: str, name: str,
+                 payload: dict = None, live: dict = None,
+                 changes: dict = None):
+        """
+        __init__.
+
+        Args:
+            action [str]: One of 'create', 'update', 'delete' or 'noop'.
+            entity [str]: 'service' or 'route'.
+            name [str]: Name of the Kong object.
+        Kwargs:
+            payload [dict]: Payload to be sent to Kong.
+            live [dict]: Object as it is on Kong.
+            changes [dict]: Fields changed as {field: [live, desired]}.
+        """
+        self.action = action
+        self.entity = entity
+        self.name = name
+        self.payload = payload
+        self.live = live
+        self.changes = changes or {}
+        self.result = None
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the action."""
+        return {
+            "action": self.action, "entity": self.entity,
+            "name": self.name, "changes": self.changes}
+
+    def __repr__(self):
+        return "SyncAction({action}, {entity}, {name})".format(
+            action=self.action, entity=self.entity, name=self.name)
+
+
+class SyncPlan:
+    """Actions needed to take live Kong to the desired state."""
+
+    def __init__(self, actions: list):
+        """
+        __init__.
+
+        Args:
+            actions [list(SyncAction)]: Actions of the plan.
+        """
+        self.actions = actions
+
+    def pending(self) -> list:
+        """Return actions that will write to Kong."""
+        return [x for x in self.actions if x.action != SyncAction.NOOP]
+
+    def summary(self) -> dict:
+        """Return the number of actions by type."""
+        summary = dict((key, 0) for key in [
+            SyncAction.CREATE, SyncAction.UPDATE, SyncAction.DELETE,
+            SyncAction.NOOP])
+        for action in self.actions:
+            summary[action.action] += 1
+        return summary
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the plan."""
+        return {
+            "summary": self.summary(),
+            "actions": [x.to_dict() for x in self.actions]}
+
+    def __repr__(self):
+        return "SyncPlan({summary})".format(summary=self.summary())
+
+
+class KongSync:
+    """
+    Diff-and-apply registration of services and routes.
+
+    Live state is fetched in one paginated pass over Kong services and
+    routes, desired objects are compared with it and only the ones that
+    differ are written.
+    """
+
+    def __init__(self, kong_api: KongAPI, prune: bool = False,
+                 page_size: int = 1000, max_workers: int = 10):
+        """
+        __init__.
+
+        Args:
+            kong_api [KongAPI]: Client used to read and write Kong.
+        Kwargs:
+            prune [bool]: Delete routes associated with desired services
+                that are not on the desired routes.
+            page_size [int]: Page size used to fetch live state.
+            max_workers [int]: Maximum number of concurrent writes.
+        """
+        self.kong_api = kong_api
+        self.prune = prune
+        self.page_size = page_size
+        self.max_workers = max_workers
+
+    def fetch_live(self) -> tuple:
+        """
+        Fetch services and routes avaiable on Kong.
+
+        Return [tuple(dict, dict)]:
+            Services and routes indexed by name. Routes without name are
+            indexed by id.
+        """
+        services = dict(
+            (x["name"], x) for x in self.kong_api.iter_services(
+                size=self.page_size, prefetch=True))
+        routes = dict(
+            (x["name"] or x["id"], x) for x in self.kong_api.iter_routes(
+                size=self.page_size, prefetch=True))
+        return services, routes
+
+    @staticmethod
+    def _diff(desired: dict, live: dict) -> dict:
+        changes = {}
+        for key, value in desired.items():
+            live_value = live.get(key)
+            if _normalize(key, value) != _normalize(key, live_value):
+                changes[key] = [live_value, value]
+        return changes
+
+    def plan(self, services: list = None, routes: list = None,
+             live: tuple = None) -> SyncPlan:
+        """
+        Compute actions to take live Kong to the desired state.
+
+        Kwargs:
+            services [list(dict)]: Desired Kong service payloads, 'name' is
+                required.
+            routes [list(dict)]: Desired Kong route payloads, 'name' is
+                required and 'service' may reference service by name or id.
+            live [tuple(dict, dict)]: Live state as returned by fetch_live,
+                it is fetched if not set.
+        Return [SyncPlan]:
+            Plan with one action for each desired object and the deletes.
+        """
+        services = services or []
+        routes = routes or []
+        live_services, live_routes = live or self.fetch_live()
+        services_id_name = dict(
+            (x["id"], x["name"]) for x in live_services.values())
+
+        actions = []
+        for service in services:
+            name = service["name"]
+            live_service = live_services.get(name)
+            if live_service is None:
+                actions.append(SyncAction(
+                    SyncAction.CREATE, "service", name, payload=service))
+                continue
+            changes = self._diff(expand_service_url(service), live_service)
+            action = SyncAction.UPDATE if changes else SyncAction.NOOP
+            actions.append(SyncAction(
+                action, "service", name, payload=service,
+                live=live_service, changes=changes))
+
+        for route in routes:
+            name = route["name"]
+            live_route = live_routes.get(name)
+            if live_route is None:
+                actions.append(SyncAction(
+                    SyncAction.CREATE, "route", name, payload=route))
+                continue
+
+            compare_route = dict(route)
+            compare_live = dict(live_route)
+            if "service" in route:
+                desired_service = route["service"] or {}
+                live_service_id = (live_route.get("service") or {}).get("id")
+                if "name" in desired_service:
+                    compare_route["service"] = desired_service["name"]
+                    compare_live["service"] = services_id_name.get(
+                        live_service_id)
+                else:
+                    compare_route["service"] = desired_service.get("id")
+                    compare_live["service"] = live_service_id
+            changes = self._diff(compare_route, compare_live)
+            action = SyncAction.UPDATE if changes else SyncAction.NOOP
+            actions.append(SyncAction(
+                action, "route", name, payload=route, live=live_route,
+                changes=changes))
+
+        if self.prune:
+            desired_service_ids = set(
+                live_services[x["name"]]["id"] for x in services
+                if x["name"] in live_services)
+            desired_route_names = set(x["name"] for x in routes)
+            for name, live_route in live_routes.items():
+                service_id = (live_route.get("service") or {}).get("id")
+                if service_id in desired_service_ids and \
+                        name not in desired_route_names:
+                    actions.append(SyncAction(
+                        SyncAction.DELETE, "route", name, live=live_route))
+        return SyncPlan(actions)
+
+    def _action_task(self, action: SyncAction, service_keys: dict) -> Task:
+        key = (action.entity, action.name)
+        if action.action == SyncAction.DELETE:
+            # Plan only deletes routes, services are never pruned
+            return Task(
+                key=key, func=self.kong_api.delete_route,
+                kwargs={"route_id": action.live["id"]})
+
+        if action.entity == "service":
+            return Task(
+                key=key, func=self.kong_api.put_service,
+                args=(action.name, action.payload))
+
+        # Route must be written after the service it references
+        service_ref = action.payload.get("service") or {}
+        depends_on = []
+        service_key = service_keys.get(
+            service_ref.get("name", service_ref.get("id")))
+        if service_key is not None:
+            depends_on.append(service_key)
+        return Task(
+            key=key, func=self.kong_api.put_route,
+            args=(action.name, action.payload), depends_on=depends_on)
+
+    def apply(self, plan: SyncPlan) -> SyncPlan:
+        """
+        Write plan actions to Kong.
+
+        Writes run concurrently, a route is written only after the service
+        it references.
+        Kong response of each write is set on the 'result' attribute of the
+        action.
+
+        Args:
+            plan [SyncPlan]: Plan returned by plan function.
+        Return [SyncPlan]:
+            Same plan with the results set.
+        Exceptions:
+            Raise the error of the first failed write after all writes
+            finish, results of the successful writes are set before.
+        """
+        pending = plan.pending()
+        service_keys = dict(
+            (action.name, (action.entity, action.name))
+            for action in pending if action.entity == "service")
+        tasks = [
+            self._action_task(action, service_keys) for action in pending]
+        executor = ConcurrentExecutor(
+            max_workers=self.max_workers, raise_errors=False)
+        results = executor.run(tasks)
+        for action in pending:
+            action.result = results[(action.entity, action.name)].result
+        _raise_first_error(results)
+        return plan
+
+    def sync(self, services: list = None, routes: list = None,
+             dry_run: bool = False) -> SyncPlan:
+        """
+        Plan and apply the desired state.
+
+        Kwargs:
+            services [list(dict)]: Desired Kong service payloads.
+            routes [list(dict)]: Desired Kong route payloads.
+            dry_run [bool]: Only return the plan without writing to Kong.
+        Return [SyncPlan]:
+            Plan of the sync, with results if it was applied.
+        """
+        plan = self.plan(services=services, routes=routes)
+        if dry_run:
+            return plan
+        return self.apply(plan)
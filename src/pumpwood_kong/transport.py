@@ -0,0 +1,234 @@
+"""Pooled HTTP transport shared by Kong Admin API clients."""
+import threading
+import time
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from .retry import RetryPolicy, CircuitBreaker
+from .instrumentation import Instrumentation, RequestEvent
+
+
+class KongTransport:
+    """
+    Keep-alive, connection pooled transport for Kong Admin API calls.
+
+    All Admin API calls made by KongAPI and KongManagement go through a
+    transport, so TCP (and TLS) connections are reused between calls instead
+    of a new handshake for each request. Optionally, idempotent calls are
+    retried on transient failures and a circuit breaker stops calls to a
+    failing gateway.
+    """
+
+    def __init__(self, session: requests.Session = None,
+                 pool_connections: int = 10, pool_maxsize: int = 10,
+                 keep_alive: bool = True, timeout=(5, 60),
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None,
+                 instrumentation: Instrumentation = None):
+        """
+        __init__.
+
+        Kwargs:
+            session [requests.Session]: Session to be used on the requests,
+                if not set a new one will be created. Adapters of an injected
+                session are not changed.
+            pool_connections [int]: Number of host pools to cache.
+            pool_maxsize [int]: Maximum number of connections kept open for
+                each host.
+            keep_alive [bool]: If False a 'Connection: close' header is
+                sent and connections are not reused.
+            timeout [float or tuple]: Default timeout for the calls, it can be
+                a (connect, read) tuple as accepted by requests.
+            retry_policy [RetryPolicy]: Policy to retry failed calls, if
+                not set calls are not retried.
+            circuit_breaker [CircuitBreaker]: Circuit breaker checked before
+                each call, if not set it is not used.
+            instrumentation [Instrumentation]: Hooks called on start and end
+                of each call (each retry attempt is a call), if not set an
+                empty one is created.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        self.session = session
+
+    def request(self, method: str, url: str, timeout=None,
+                **kwargs) -> requests.Response:
+        """
+        Make a request using the pooled session.
+
+        If a retry policy is set, idempotent calls that fail with connection
+        errors or retry status are retried, the response of the last
+        attempt is returned.
+
+        Args:
+            method [str]: HTTP method.
+            url [str]: Full url of the call.
+        Kwargs:
+            timeout [float or tuple]: Timeout for this call, if not set
+                transport default timeout is used.
+            **kwargs: Other arguments passed to requests.Session.request.
+        Return [requests.Response]:
+            Response of the call, status is not checked.
+        Exceptions:
+            CircuitBreakerOpenError: If circuit of the host is open.
+            requests.exceptions.RequestException: If connection fails and
+                retries are exhausted.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        policy = self.retry_policy
+        breaker = self.circuit_breaker
+        breaker_key = None
+        if breaker is not None:
+            url_parts = urlsplit(url)
+            breaker_key = url_parts.scheme + "://" + url_parts.netloc
+
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before_call(breaker_key)
+            try:
+                response = self._send(
+                    method=method, url=url, timeout=timeout,
+                    attempt=attempt, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if breaker is not None:
+                    breaker.record_failure(breaker_key)
+                if policy is None or not policy.can_retry(method, attempt):
+                    raise
+                policy.sleep(policy.wait_time(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                # Other errors (ex.: broken chunked body) are not retried,
+                # but must be recorded so a half-open trial is finished
+                if breaker is not None:
+                    breaker.record_failure(breaker_key)
+                raise
+
+            failed = response.status_code >= 500 or \
+                response.status_code == 429
+            if breaker is not None:
+                if failed:
+                    breaker.record_failure(breaker_key)
+                else:
+                    breaker.record_success(breaker_key)
+            retry = policy is not None and \
+                policy.is_retry_status(response.status_code) and \
+                policy.can_retry(method, attempt)
+            if not retry:
+                return response
+            policy.sleep(policy.wait_time(attempt, response))
+            response.close()
+            attempt += 1
+
+    def _send(self, method: str, url: str, timeout, attempt: int,
+              **kwargs) -> requests.Response:
+        """Make one HTTP call calling instrumentation hooks."""
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            return self.session.request(
+                method=method, url=url, timeout=timeout, **kwargs)
+
+        event = RequestEvent(
+            method=method, url=url, attempt=attempt,
+            start_time=time.perf_counter())
+        instrumentation.request_start(event)
+        try:
+            response = self.session.request(
+                method=method, url=url, timeout=timeout, **kwargs)
+        except Exception as e:
+            event.error = e
+            raise
+        else:
+            event.status = response.status_code
+            body = response.request.body
+            event.request_bytes = 0 if body is None else len(body)
+            event.response_bytes = len(response.content)
+        finally:
+            event.duration = time.perf_counter() - event.start_time
+            instrumentation.request_end(event)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Make a GET request."""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Make a POST request."""
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        """Make a PUT request."""
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        """Make a PATCH request."""
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        """Make a DELETE request."""
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> KongTransport:
+    """
+    Return the transport shared by all clients of the process.
+
+    It is created on first use. KongAPI and KongManagement objects created
+    without a transport or session use this one, so all of them share the
+    same connection pool. It does not retry calls nor use a circuit
+    breaker, they are enabled passing a transport created with them.
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = KongTransport()
+    return _default_transport
+
+
+def build_transport(transport: KongTransport = None,
+                    session: requests.Session = None) -> KongTransport:
+    """
+    Build the transport used by a client from its constructor arguments.
+
+    Kwargs:
+        transport [KongTransport]: Transport to be used, it has precedence
+            over session.
+        session [requests.Session]: Session to be wrapped on a new transport.
+    Return [KongTransport]:
+        Transport passed as argument, a new one wrapping session or the
+        default shared transport.
+    """
+    if transport is not None:
+        return transport
+    if session is not None:
+        return KongTransport(session=session)
+    return get_default_transport()
@@ -0,0 +1,295 @@
+"""
+Watch Kong configuration and emit only changed objects.
+
+Kong Admin API has no change feed and can not sort or filter by
+updated_at, so each poll lists the watched collections (optionally
+filtered by tags on Kong) and compares them with the previous poll. When
+Kong reports a configuration_hash on /status (DB-less and hybrid data
+planes) the listing is skipped if the hash did not change.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeEvent:
+    """Object added, changed or removed on Kong between two polls."""
+
+    ADDED = "added"
+    CHANGED = "changed"
+    REMOVED = "removed"
+
+    __slots__ = ["entity", "action", "id", "name", "old", "new"]
+
+    def __init__(self, entity: str, action: str, old: dict = None,
+                 new: dict = None):
+        """
+        __init__.
+
+        Args:
+            entity [str]: Kong collection, ex.: 'services', 'routes'.
+            action [str]: ADDED, CHANGED or REMOVED.
+        Kwargs:
+            old [dict]: Object on previous poll, None if added.
+            new [dict]: Object on current poll, None if removed.
+        """
+        obj = new if new is not None else old
+        self.entity = entity
+        self.action = action
+        self.id = obj["id"]
+        self.name = obj.get("name")
+        self.old = old
+        self.new = new
+
+    def to_dict(self) -> dict:
+        """Return a dict representation of the event."""
+        return {
+            "entity": self.entity, "action": self.action, "id": self.id,
+            "name": self.name, "old": self.old, "new": self.new}
+
+    def __repr__(self):
+        return "ChangeEvent({entity}, {action}, {name})".format(
+            entity=self.entity, action=self.action,
+            name=self.name or self.id)
+
+
+class KongWatcher:
+    """
+    Poll Kong and emit ChangeEvents to subscribers.
+
+    Events can be consumed with callbacks (start runs the polls on a
+    background thread), with iter_events or with the async iterator
+    aiter_events. Slow consumers delay the next poll (backpressure),
+    changes made meanwhile are merged on the next diff, so no event is
+    lost or queued without bound.
+
+    Only Kong nodes that report configuration_hash on /status (DB-less and
+    hybrid data planes) allow skipping unchanged polls. On Kong with a
+    database every poll lists all watched objects, use tags and a larger
+    interval to limit its cost on large gateways.
+    """
+
+    def __init__(self, kong_api, entities: tuple = ("services", "routes"),
+                 interval: float = 5, tags=None, page_size: int = 1000,
+                 emit_initial: bool = False):
+        """
+        __init__.
+
+        Args:
+            kong_api [KongAPI]: Client of the watched Kong.
+        Kwargs:
+            entities [tuple]: Watched collections, any of services, routes,
+                upstreams and plugins.
+            interval [float]: Seconds between polls.
+            tags [str or list]: Watch only objects with these tags, it is
+                filtered by Kong.
+            page_size [int]: Page size of the listings.
+            emit_initial [bool]: Emit objects of the first poll as added,
+                otherwise first poll only sets the baseline.
+        """
+        iterators = {
+            "services": kong_api.iter_services,
+            "routes": kong_api.iter_routes,
+            "upstreams": kong_api.iter_upstreams,
+            "plugins": kong_api.iter_plugins}
+        unknown = set(entities) - set(iterators.keys())
+        if unknown:
+            raise ValueError(
+                "Entities {unknown} can not be watched".format(
+                    unknown=sorted(unknown)))
+
+        self.kong_api = kong_api
+        self.entities = tuple(entities)
+        self.interval = interval
+        self.tags = tags
+        self.page_size = page_size
+        self.emit_initial = emit_initial
+        self._iterators = iterators
+        self._snapshot = None
+        self._configuration_hash = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.skipped_polls = 0
+
+    def subscribe(self, callback):
+        """
+        Register a function called with each ChangeEvent.
+
+        Args:
+            callback [callable]: Function receiving a ChangeEvent.
+        Return:
+            The callback.
+        """
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+        return callback
+
+    def unsubscribe(self, callback):
+        """Remove a callback."""
+        with self._lock:
+            self._callbacks = [x for x in self._callbacks if x != callback]
+
+    def _get_configuration_hash(self) -> str:
+        """Return Kong configuration_hash or None if not available."""
+        try:
+            return self.kong_api.get_status().get("configuration_hash")
+        except Exception:
+            return None
+
+    def _fetch(self) -> dict:
+        snapshot = {}
+        for entity in self.entities:
+            snapshot[entity] = dict(
+                (x["id"], x) for x in self._iterators[entity](
+                    size=self.page_size, prefetch=True, tags=self.tags))
+        return snapshot
+
+    def poll(self) -> list:
+        """
+        Poll Kong once and return changes since the previous poll.
+
+        Return [list(ChangeEvent)]:
+            Added, changed and removed objects, removed objects are
+            emitted last so references are not seen dangling.
+        Exceptions:
+            Errors fetching Kong objects are raised, the previous poll is
+            kept as baseline so the changes are reported on next poll.
+        """
+        self.polls += 1
+        configuration_hash = self._get_configuration_hash()
+        if configuration_hash is not None and \
+                configuration_hash == self._configuration_hash and \
+                self._snapshot is not None:
+            self.skipped_polls += 1
+            return []
+
+        current = self._fetch()
+        # Hash is kept only after a successful fetch, otherwise a failed
+        # poll would make the next one skip the changes
+        self._configuration_hash = configuration_hash
+        previous = self._snapshot
+        self._snapshot = current
+        if previous is None:
+            if not self.emit_initial:
+                return []
+            previous = dict((x, {}) for x in self.entities)
+
+        events = []
+        removed = []
+        for entity in self.entities:
+            old_objects = previous[entity]
+            new_objects = current[entity]
+            for obj_id, new in new_objects.items():
+                old = old_objects.get(obj_id)
+                if old is None:
+                    events.append(ChangeEvent(
+                        entity, ChangeEvent.ADDED, new=new))
+                elif old != new:
+                    events.append(ChangeEvent(
+                        entity, ChangeEvent.CHANGED, old=old, new=new))
+            for obj_id, old in old_objects.items():
+                if obj_id not in new_objects:
+                    removed.append(ChangeEvent(
+                        entity, ChangeEvent.REMOVED, old=old))
+        return events + removed[::-1]
+
+    def _dispatch(self, events: list):
+        for event in events:
+            for callback in self._callbacks:
+                callback(event)
+
+    def iter_events(self, max_polls: int = None):
+        """
+        Poll Kong every interval and yield the events.
+
+        Next poll is made only after the events of the previous one are
+        consumed. Iteration ends when stop is called, errors of the polls
+        are raised.
+
+        Kwargs:
+            max_polls [int]: Stop after this number of polls, if not set
+                iterate until stop is called.
+        Return [generator(ChangeEvent)]:
+            Events as they are found.
+        """
+        self._stop_event.clear()
+        polls = 0
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            yield from self.poll()
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                return
+            wait = self.interval - (time.monotonic() - start)
+            if wait > 0 and self._stop_event.wait(wait):
+                return
+
+    async def aiter_events(self, max_polls: int = None):
+        """
+        Async version of iter_events, polls run on the default executor.
+
+        Kwargs:
+            max_polls [int]: Stop after this number of polls.
+        Return [async_generator(ChangeEvent)]:
+            Events as they are found.
+        """
+        loop = asyncio.get_running_loop()
+        self._stop_event.clear()
+        polls = 0
+        while not self._stop_event.is_set():
+            start = loop.time()
+            events = await loop.run_in_executor(None, self.poll)
+            for event in events:
+                yield event
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                return
+            wait = self.interval - (loop.time() - start)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            try:
+                self._dispatch(self.poll())
+            except Exception:
+                logger.exception(
+                    "Error watching Kong, polling again in %s seconds",
+                    self.interval)
+            wait = self.interval - (time.monotonic() - start)
+            if wait > 0:
+                self._stop_event.wait(wait)
+
+    def start(self) -> "KongWatcher":
+        """
+        Poll on a background thread calling the subscribed callbacks.
+
+        Callbacks run on the polling thread, a slow callback delays the
+        next poll. Errors of the polls and callbacks are logged and polling
+        continues on the next interval.
+
+        Return [KongWatcher]:
+            The watcher.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="kong-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """Stop polling and wait the background thread to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,44 @@
+"""Fixtures running the tests against the fake Kong Admin API."""
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from pumpwood_kong.kong_api import KongAPI  # NOQA
+from pumpwood_kong.async_kong_api import AsyncKongAPI  # NOQA
+from tests.fake_kong import FakeKongServer  # NOQA
+
+
+@pytest.fixture
+def fake_kong():
+    """Fake Kong with a database."""
+    with FakeKongServer() as server:
+        yield server
+
+
+@pytest.fixture
+def dbless_fake_kong():
+    """Fake DB-less Kong."""
+    with FakeKongServer(database="off") as server:
+        yield server
+
+
+@pytest.fixture
+def kong_api(fake_kong):
+    """KongAPI of the fake Kong."""
+    return KongAPI(api_gateway_url=fake_kong.url)
+
+
+@pytest.fixture
+def run_async(fake_kong):
+    """Run a coroutine function with an AsyncKongAPI of the fake Kong."""
+    def run(func):
+        async def main():
+            async with AsyncKongAPI(
+                    api_gateway_url=fake_kong.url) as kong_api:
+                return await func(kong_api)
+        return asyncio.run(main())
+    return run
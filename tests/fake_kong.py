@@ -0,0 +1,629 @@
+"""
+In-process stand-in for Kong Admin API.
+
+It implements the subset of Kong Admin API used by this package (services,
+routes, upstreams, targets, plugins, consumers, tags filters and offset
+pagination) on a local HTTP server so clients can be tested and benchmarked
+without a real gateway. Latency and errors can be injected on the calls.
+It is a test double and is not shipped with the package.
+"""
+import copy
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+_uuid_re = re.compile(
+    r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+    r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+_default_ports = {"http": 80, "https": 443, "grpc": 80, "grpcs": 443}
+
+_entity_defaults = {
+    "services": {
+        "name": None, "protocol": "http", "host": None, "port": 80,
+        "path": None, "retries": 5, "connect_timeout": 60000,
+        "write_timeout": 60000, "read_timeout": 60000, "tags": None,
+        "client_certificate": None, "tls_verify": None,
+        "tls_verify_depth": None, "ca_certificates": None, "enabled": True},
+    "routes": {
+        "name": None, "paths": None, "methods": None, "hosts": None,
+        "headers": None, "sources": None, "destinations": None,
+        "snis": None, "tags": None, "protocols": ["http", "https"],
+        "strip_path": True, "preserve_host": False, "regex_priority": 0,
+        "path_handling": "v0", "https_redirect_status_code": 426,
+        "request_buffering": True, "response_buffering": True},
+    "upstreams": {
+        "algorithm": "round-robin", "hash_on": "none",
+        "hash_fallback": "none", "slots": 10000, "healthchecks": None,
+        "tags": None, "host_header": None, "client_certificate": None},
+    "targets": {"weight": 100, "tags": None},
+    "plugins": {
+        "config": {}, "enabled": True, "protocols": ["http", "https"],
+        "tags": None, "service": None, "route": None, "consumer": None},
+    "consumers": {"custom_id": None, "tags": None},
+}
+
+_unique_keys = {
+    "services": "name", "routes": "name", "upstreams": "name",
+    "targets": "target", "plugins": None, "consumers": "username"}
+
+
+class FakeKongError(Exception):
+    """Error mapped to a Kong Admin API error response."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FakeKongState:
+    """Entities stored by the fake Admin API."""
+
+    def __init__(self, database: str = "postgres"):
+        self.database = database
+        self.lock = threading.RLock()
+        # Incremented on each write, used as configuration hash
+        self.version = 0
+        self._reset()
+
+    def _reset(self):
+        # Health reported by /upstreams/{upstream}/health by target address
+        self.target_health = {}
+        self.entities = {key: {} for key in _entity_defaults.keys()}
+        # Index of unique names to ids, targets are unique by upstream and
+        # are not indexed
+        self.names = {key: {} for key in _entity_defaults.keys()}
+
+    def _find(self, collection: str, id_or_name: str) -> dict:
+        table = self.entities[collection]
+        if id_or_name in table:
+            return table[id_or_name]
+        unique_key = _unique_keys[collection]
+        if unique_key is None:
+            return None
+        if collection != "targets":
+            obj_id = self.names[collection].get(id_or_name)
+            return None if obj_id is None else table[obj_id]
+        for obj in table.values():
+            if obj.get(unique_key) == id_or_name:
+                return obj
+        return None
+
+    def get(self, collection: str, id_or_name: str) -> dict:
+        """Return entity or raise 404."""
+        obj = self._find(collection, id_or_name)
+        if obj is None:
+            raise FakeKongError(404, "Not found")
+        return obj
+
+    def _resolve_foreign(self, collection: str, ref) -> dict:
+        if ref is None:
+            return None
+        if isinstance(ref, str):
+            ref = {"name": ref}
+        key = ref.get("id", ref.get("name"))
+        obj = self._find(collection, key)
+        if obj is None:
+            raise FakeKongError(
+                400, "the foreign key '{}' does not reference an existing "
+                "'{}' entity.".format(ref, collection))
+        return {"id": obj["id"]}
+
+    def _prepare(self, collection: str, payload: dict,
+                 current: dict = None) -> dict:
+        payload = copy.deepcopy(payload)
+        if collection == "services" and "url" in payload:
+            url = urlsplit(payload.pop("url"))
+            payload["protocol"] = url.scheme
+            payload["host"] = url.hostname
+            payload["port"] = url.port or _default_ports.get(url.scheme, 80)
+            payload["path"] = url.path or None
+        if collection == "routes":
+            if "service" in payload:
+                payload["service"] = self._resolve_foreign(
+                    "services", payload["service"])
+            for key in ["paths", "methods", "hosts"]:
+                if key in payload and payload[key] == []:
+                    payload[key] = None
+        if collection == "plugins":
+            for key, ref_collection in [
+                    ("service", "services"), ("route", "routes"),
+                    ("consumer", "consumers")]:
+                if key in payload:
+                    payload[key] = self._resolve_foreign(
+                        ref_collection, payload[key])
+        if current is None:
+            obj = copy.deepcopy(_entity_defaults[collection])
+        else:
+            obj = copy.deepcopy(current)
+        obj.update(payload)
+        return obj
+
+    def _check_unique(self, collection: str, obj: dict):
+        unique_key = _unique_keys[collection]
+        if unique_key is None or obj.get(unique_key) is None:
+            return
+        if collection != "targets":
+            other_id = self.names[collection].get(obj[unique_key])
+            if other_id is not None and other_id != obj["id"]:
+                raise FakeKongError(
+                    409, "UNIQUE violation detected on '{%s=\"%s\"}'" % (
+                        unique_key, obj[unique_key]))
+            return
+        for other in self.entities[collection].values():
+            same_scope = other.get("upstream") == obj.get("upstream")
+            if other["id"] != obj["id"] and same_scope and \
+                    other.get(unique_key) == obj[unique_key]:
+                raise FakeKongError(
+                    409, "UNIQUE violation detected on '{%s=\"%s\"}'" % (
+                        unique_key, obj[unique_key]))
+
+    def save(self, collection: str, payload: dict, id_or_name: str = None,
+             upsert: bool = False, parent: dict = None) -> tuple:
+        """Create, update or upsert an entity."""
+        with self.lock:
+            self.version += 1
+            current = None
+            if id_or_name is not None:
+                current = self._find(collection, id_or_name)
+                if current is None and not upsert:
+                    raise FakeKongError(404, "Not found")
+            obj = self._prepare(collection, payload, current)
+            now = int(time.time())
+            created = current is None
+            if created:
+                if id_or_name is not None and _uuid_re.match(id_or_name):
+                    obj["id"] = id_or_name
+                elif id_or_name is not None:
+                    obj[_unique_keys[collection]] = id_or_name
+                obj.setdefault("id", str(uuid.uuid4()))
+                obj["created_at"] = now
+            obj["updated_at"] = now
+            if parent is not None:
+                obj.update(parent)
+            self._check_unique(collection, obj)
+            if collection == "routes" and obj.get("service") is None:
+                raise FakeKongError(400, "schema violation (service: "
+                                         "required field missing)")
+            unique_key = _unique_keys[collection]
+            if unique_key is not None and collection != "targets":
+                names = self.names[collection]
+                if current is not None and current.get(unique_key):
+                    names.pop(current[unique_key], None)
+                if obj.get(unique_key) is not None:
+                    names[obj[unique_key]] = obj["id"]
+            self.entities[collection][obj["id"]] = obj
+            return obj, created
+
+    def delete(self, collection: str, id_or_name: str):
+        """Delete an entity, it is not an error if it does not exist."""
+        with self.lock:
+            self.version += 1
+            obj = self._find(collection, id_or_name)
+            if obj is None:
+                return
+            if collection == "services":
+                for route in self.entities["routes"].values():
+                    if (route.get("service") or {}).get("id") == obj["id"]:
+                        raise FakeKongError(
+                            400, "an existing 'routes' entity references "
+                                 "this 'services' entity")
+            if collection == "upstreams":
+                for key, target in list(self.entities["targets"].items()):
+                    if target["upstream"]["id"] == obj["id"]:
+                        del self.entities["targets"][key]
+            for plugin_key, plugin in list(self.entities["plugins"].items()):
+                ref_key = collection[:-1]
+                if (plugin.get(ref_key) or {}).get("id") == obj["id"]:
+                    del self.entities["plugins"][plugin_key]
+            unique_key = _unique_keys[collection]
+            if unique_key is not None and collection != "targets":
+                self.names[collection].pop(obj.get(unique_key), None)
+            del self.entities[collection][obj["id"]]
+
+    def list(self, collection: str, filters: dict = None,
+             tags: str = None) -> list:
+        """List entities matching the filters and tags query."""
+        with self.lock:
+            results = []
+            for obj in self.entities[collection].values():
+                if filters is not None and any(
+                        obj.get(key) != value
+                        for key, value in filters.items()):
+                    continue
+                if tags is not None and not _match_tags(obj, tags):
+                    continue
+                results.append(obj)
+            # Saved objects are replaced and never changed in place, so
+            # references can be returned
+            return results
+
+    def dump_declarative(self) -> dict:
+        """Return entities as a flat declarative configuration."""
+        with self.lock:
+            config = {"_format_version": "3.0"}
+            for collection in ["services", "routes", "upstreams",
+                               "plugins", "consumers"]:
+                objs = []
+                for obj in self.entities[collection].values():
+                    obj = dict((k, v) for k, v in obj.items()
+                               if v is not None and k not in [
+                                   "created_at", "updated_at"])
+                    for key in ["service", "route", "consumer"]:
+                        if isinstance(obj.get(key), dict):
+                            obj[key] = obj[key]["id"]
+                    if collection == "upstreams":
+                        obj["targets"] = [
+                            {"target": t["target"], "weight": t["weight"]}
+                            for t in self.entities["targets"].values()
+                            if t["upstream"]["id"] == obj["id"]]
+                    objs.append(obj)
+                config[collection] = objs
+            return config
+
+    def load_declarative(self, config: dict):
+        """Replace all entities using a declarative configuration."""
+        with self.lock:
+            self.version += 1
+            self._reset()
+            for service in config.get("services", []):
+                service = copy.deepcopy(service)
+                routes = service.pop("routes", [])
+                plugins = service.pop("plugins", [])
+                obj, _ = self.save(
+                    "services", service,
+                    id_or_name=service.get("id", service.get("name")),
+                    upsert=True)
+                for route in routes:
+                    route = copy.deepcopy(route)
+                    route_plugins = route.pop("plugins", [])
+                    route["service"] = {"id": obj["id"]}
+                    route_obj, _ = self.save(
+                        "routes", route,
+                        id_or_name=route.get("id", route.get("name")),
+                        upsert=True)
+                    for plugin in route_plugins:
+                        plugin = dict(plugin, route={"id": route_obj["id"]})
+                        self.save("plugins", plugin, upsert=True,
+                                  id_or_name=plugin.get("id"))
+                for plugin in plugins:
+                    plugin = dict(plugin, service={"id": obj["id"]})
+                    self.save("plugins", plugin, upsert=True,
+                              id_or_name=plugin.get("id"))
+            for route in config.get("routes", []):
+                self.save("routes", route, upsert=True,
+                          id_or_name=route.get("id", route.get("name")))
+            for upstream in config.get("upstreams", []):
+                upstream = copy.deepcopy(upstream)
+                targets = upstream.pop("targets", [])
+                obj, _ = self.save(
+                    "upstreams", upstream, upsert=True,
+                    id_or_name=upstream.get("id", upstream.get("name")))
+                for target in targets:
+                    self.save("targets", target, parent={
+                        "upstream": {"id": obj["id"]}})
+            for plugin in config.get("plugins", []):
+                self.save("plugins", plugin, upsert=True,
+                          id_or_name=plugin.get("id"))
+            for consumer in config.get("consumers", []):
+                self.save("consumers", consumer, upsert=True,
+                          id_or_name=consumer.get(
+                              "id", consumer.get("username")))
+
+
+def _match_tags(obj: dict, tags: str) -> bool:
+    obj_tags = set(obj.get("tags") or [])
+    if "/" in tags:
+        return any(t in obj_tags for t in tags.split("/"))
+    return all(t in obj_tags for t in tags.split(","))
+
+
+def _paginate(items: list, query: dict, path: str) -> dict:
+    size = int(query.get("size", ["100"])[0])
+    if size < 1 or size > 1000:
+        raise FakeKongError(400, "size must be between 1 and 1000")
+    start = int(query.get("offset", ["0"])[0] or 0)
+    page = items[start:start + size]
+    result = {"data": page, "next": None}
+    if start + size < len(items):
+        offset = str(start + size)
+        next_query = [("offset", offset)]
+        if "tags" in query:
+            next_query.append(("tags", query["tags"][0]))
+        if "size" in query:
+            next_query.append(("size", str(size)))
+        result["next"] = path + "?" + "&".join(
+            "{}={}".format(k, v) for k, v in next_query)
+        result["offset"] = offset
+    return result
+
+
+class FakeKongHandler(BaseHTTPRequestHandler):
+    """Request handler of the fake Admin API."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without TCP_NODELAY each
+    # response waits the client delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Do not log requests to stderr."""
+        pass
+
+    def _send(self, status: int, body=None, headers: dict = None):
+        data = b""
+        if body is not None:
+            data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _handle(self):
+        server = self.server
+        with server.stats_lock:
+            server.request_count[self.command] = \
+                server.request_count.get(self.command, 0) + 1
+            server.connection_ids.add(id(self.connection))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self._body()
+            self._send(server.error_status, {"message": "injected error"},
+                       headers={"Retry-After": "0"})
+            return
+        try:
+            body = self._body()
+            status, result = server.router.dispatch(
+                self.command, self.path, body)
+            self._send(status, result)
+        except FakeKongError as e:
+            self._send(e.status, {"message": e.message})
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _handle
+
+
+class _Router:
+    """Map Admin API paths to state operations."""
+
+    _nested = {
+        ("services", "routes"): ("routes", "service"),
+        ("services", "plugins"): ("plugins", "service"),
+        ("routes", "plugins"): ("plugins", "route"),
+        ("upstreams", "targets"): ("targets", "upstream"),
+    }
+
+    def __init__(self, state: FakeKongState):
+        self.state = state
+
+    def dispatch(self, method: str, raw_path: str, body: dict) -> tuple:
+        url = urlsplit(raw_path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        state = self.state
+
+        if not parts:
+            return 200, {
+                "version": "3.4.0",
+                "configuration": {"database": state.database}}
+        if parts == ["status"]:
+            status = {
+                "database": {"reachable": True},
+                "server": {"connections_active": 1}}
+            # Kong reports configuration hash on DB-less mode only
+            if state.database == "off":
+                status["configuration_hash"] = hashlib.md5(
+                    str(state.version).encode()).hexdigest()
+            return 200, status
+        if parts == ["config"]:
+            if state.database != "off":
+                raise FakeKongError(
+                    400, "this endpoint is only available when Kong is "
+                         "configured to not use a database")
+            if method == "POST":
+                state.load_declarative(body)
+                return 201, {}
+            if method == "GET":
+                # Kong returns the configuration as YAML
+                config = state.dump_declarative()
+                if yaml is None:
+                    return 200, {"config": json.dumps(config)}
+                return 200, {"config": yaml.safe_dump(config)}
+            raise FakeKongError(405, "Method not allowed")
+
+        collection = parts[0]
+        if collection not in state.entities:
+            raise FakeKongError(404, "Not found")
+        if method != "GET" and state.database == "off":
+            raise FakeKongError(
+                405, "cannot create or update entities when not using a "
+                     "database")
+
+        tags = query.get("tags", [None])[0]
+        if len(parts) == 1:
+            if method == "GET":
+                return 200, _paginate(
+                    state.list(collection, tags=tags), query, url.path)
+            if method == "POST":
+                obj, _ = state.save(collection, body)
+                return 201, obj
+            raise FakeKongError(405, "Method not allowed")
+
+        if len(parts) == 2:
+            if method == "GET":
+                return 200, state.get(collection, parts[1])
+            if method == "PUT":
+                obj, created = state.save(
+                    collection, body, id_or_name=parts[1], upsert=True)
+                return 200, obj
+            if method == "PATCH":
+                obj, _ = state.save(collection, body, id_or_name=parts[1])
+                return 200, obj
+            if method == "DELETE":
+                state.delete(collection, parts[1])
+                return 204, None
+            raise FakeKongError(405, "Method not allowed")
+
+        if collection == "upstreams" and parts[2] == "health" and \
+                method == "GET":
+            upstream = state.get(collection, parts[1])
+            targets = state.list(
+                "targets", filters={"upstream": {"id": upstream["id"]}})
+            return 200, _paginate([
+                dict(target, health=state.target_health.get(
+                    target["target"], "HEALTHCHECKS_OFF"))
+                for target in targets], query, url.path)
+
+        nested = self._nested.get((collection, parts[2]))
+        if nested is None:
+            raise FakeKongError(404, "Not found")
+        child_collection, parent_key = nested
+        parent = state.get(collection, parts[1])
+        parent_ref = {parent_key: {"id": parent["id"]}}
+        if len(parts) == 3:
+            if method == "GET":
+                return 200, _paginate(
+                    state.list(child_collection, filters=parent_ref,
+                               tags=tags),
+                    query, url.path)
+            if method == "POST":
+                body = dict(body, **parent_ref)
+                if child_collection == "targets":
+                    obj, _ = state.save(
+                        child_collection, body, parent=parent_ref)
+                else:
+                    obj, _ = state.save(child_collection, body)
+                return 201, obj
+            raise FakeKongError(405, "Method not allowed")
+
+        child_id = parts[3]
+        if child_collection == "targets":
+            children = state.list("targets", filters=parent_ref)
+            match = [t for t in children
+                     if child_id in (t["id"], t["target"])]
+            if method == "DELETE":
+                for t in match:
+                    state.delete("targets", t["id"])
+                return 204, None
+            if not match:
+                if method == "PUT":
+                    obj, _ = state.save(
+                        "targets", dict(body, target=child_id),
+                        parent=parent_ref)
+                    return 200, obj
+                raise FakeKongError(404, "Not found")
+            if method == "GET":
+                return 200, match[0]
+            if method in ("PUT", "PATCH"):
+                obj, _ = state.save(
+                    "targets", body, id_or_name=match[0]["id"],
+                    parent=parent_ref)
+                return 200, obj
+            raise FakeKongError(405, "Method not allowed")
+
+        if method == "GET":
+            return 200, state.get(child_collection, child_id)
+        if method == "PUT":
+            body = dict(body, **parent_ref)
+            obj, _ = state.save(
+                child_collection, body, id_or_name=child_id, upsert=True)
+            return 200, obj
+        if method == "PATCH":
+            obj, _ = state.save(child_collection, body, id_or_name=child_id)
+            return 200, obj
+        if method == "DELETE":
+            state.delete(child_collection, child_id)
+            return 204, None
+        raise FakeKongError(405, "Method not allowed")
+
+
+class FakeKongServer(ThreadingHTTPServer):
+    """
+    Fake Kong Admin API running on a local thread.
+
+    Example:
+        with FakeKongServer() as fake_kong:
+            kong_api = KongAPI(api_gateway_url=fake_kong.url)
+            kong_api.register_service(...)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0, error_rate: float = 0,
+                 error_status: int = 503, database: str = "postgres"):
+        """
+        __init__.
+
+        Kwargs:
+            host [str]: Host to bind the server.
+            port [int]: Port to bind the server, 0 picks a free port.
+            latency [float]: Seconds to sleep before answering each call.
+            error_rate [float]: Fraction of calls answered with
+                error_status.
+            error_status [int]: Status of injected errors.
+            database [str]: Kong database mode, 'off' simulates a DB-less
+                Kong accepting only declarative configuration on /config.
+        """
+        super().__init__((host, port), FakeKongHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.state = FakeKongState(database=database)
+        self.router = _Router(self.state)
+        self.stats_lock = threading.Lock()
+        self.request_count = {}
+        self.connection_ids = set()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Url of the fake Admin API."""
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def reset_stats(self):
+        """Reset request counters."""
+        with self.stats_lock:
+            self.request_count = {}
+            self.connection_ids = set()
+
+    def start(self) -> "FakeKongServer":
+        """Serve requests on a daemon thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "FakeKongServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
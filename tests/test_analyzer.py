@@ -0,0 +1,74 @@
+"""Tests of RouteTableAnalyzer."""
+from pumpwood_kong.analyzer import RouteTableAnalyzer
+
+
+def _route(route_id: str, paths: list, service: str = "s1", **kwargs):
+    route = {
+        "id": route_id, "name": route_id, "paths": paths,
+        "service": {"id": service}, "strip_path": False,
+        "methods": None, "hosts": None}
+    route.update(kwargs)
+    return route
+
+
+services = [{"id": "s1", "name": "auth"}, {"id": "s2", "name": "models"}]
+
+
+def test_duplicates_and_shadowed():
+    analyzer = RouteTableAnalyzer([
+        _route("r1", ["/a/", "/b/"]),
+        _route("r2", ["/a/"]),
+        _route("r3", ["/a/"], methods=["GET"])], services)
+    assert analyzer.duplicates() == [{"path": "/a/", "routes": ["r1", "r2"]}]
+    assert analyzer.shadowed() == ["r2"]
+
+
+def test_overlaps():
+    analyzer = RouteTableAnalyzer([
+        _route("r1", ["/rest/"]),
+        _route("r2", ["/rest/model/"], service="s2")], services)
+    overlap, = analyzer.overlaps()
+    assert overlap["prefix_service"] == "auth"
+    assert overlap["service"] == "models"
+
+
+def test_plan_compaction():
+    analyzer = RouteTableAnalyzer([
+        _route("r1", ["/a/"]),
+        _route("r2", ["/b/", "/c/"]),
+        _route("r3", ["/d/"], strip_path=True),
+        _route("r4", ["/e/"]),
+        _route("r5", ["/f/"], service="s2")], services,
+        plugins=[{"route": {"id": "r4"}}])
+    plan = analyzer.plan_compaction()
+    merge, = plan.merges
+    assert merge["keep"] == "r2"
+    assert merge["remove"] == ["r1"]
+    assert merge["paths"] == ["/a/", "/b/", "/c/"]
+    assert plan.summary()["routes_after"] == 4
+
+
+def test_catch_all_and_regex_routes_are_not_merged():
+    analyzer = RouteTableAnalyzer([
+        _route("r1", ["/a/"]),
+        _route("r2", ["/b/"]),
+        _route("catchall", None),
+        _route("empty", []),
+        _route("regex", ["~/c/[0-9]+$"])], services)
+    merge, = analyzer.plan_compaction().merges
+    assert merge["keep"] == "r1"
+    assert merge["remove"] == ["r2"]
+
+
+def test_apply_keeps_catch_all(kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    for name, paths in [("r1", ["/a/"]), ("r2", ["/b/"]),
+                        ("catchall", None)]:
+        kong_api.put_route(name, {
+            "name": name, "paths": paths, "service": {"name": "auth"}})
+    analyzer = RouteTableAnalyzer.from_kong(kong_api)
+    results = analyzer.plan_compaction().apply(kong_api)
+    assert all(x.status == "done" for x in results)
+    routes = dict((x["name"], x) for x in kong_api.iter_routes())
+    assert sorted(routes.keys()) == ["catchall", "r1"]
+    assert routes["r1"]["paths"] == ["/a/", "/b/"]
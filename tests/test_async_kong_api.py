@@ -0,0 +1,107 @@
+"""Tests of AsyncKongAPI against the fake Kong."""
+import asyncio
+import pytest
+
+
+def _register(kong_api, service_name: str, n_routes: int = 2):
+    service = kong_api.register_service(
+        service_name, "http://{}:5000/".format(service_name))
+    for i in range(n_routes):
+        kong_api.register_route(
+            "/{}/{}/".format(service_name, i),
+            "{}--{}".format(service_name, i), service_name=service_name)
+    return service
+
+
+def test_delete_by_name_and_duplicated_id(fake_kong, kong_api, run_async):
+    service = _register(kong_api, "auth")
+    _register(kong_api, "other")
+    fake_kong.reset_stats()
+    assert run_async(lambda x: x.delete_routes_and_service(
+        ["auth", service["id"], "missing"]))
+    # services by name, one routes scan, 2 routes and 2 services deletes
+    assert fake_kong.request_count == {"GET": 3, "DELETE": 4}
+    assert [x["name"] for x in kong_api.iter_services()] == ["other"]
+    assert all(
+        x["name"].startswith("other--") for x in kong_api.iter_routes())
+
+
+def test_teardown_all_keeps_test_services(fake_kong, kong_api, run_async):
+    _register(kong_api, "auth")
+    _register(kong_api, "test-service")
+    # Kong services may not have a name
+    fake_kong.state.save("services", {"url": "http://unnamed:5000/"})
+
+    results = run_async(lambda x: x.teardown())
+    assert all(x.status == "done" for x in results)
+    assert [x["name"] for x in kong_api.iter_services()] == ["test-service"]
+
+
+def test_teardown_by_tags(fake_kong, kong_api, run_async):
+    kong_api.register_service(
+        "auth", "http://auth:5000/", healthcheck_route="/health/auth/",
+        tags=["owner-auth"])
+    _register(kong_api, "other")
+    results = run_async(lambda x: x.teardown(tags="owner-auth"))
+    assert [x.key[0] for x in results] == ["route", "service"]
+    assert [x["name"] for x in kong_api.iter_services()] == ["other"]
+
+
+def test_register_service_and_routes(kong_api, run_async):
+    async def register(async_api):
+        service = await async_api.register_service(
+            "auth", "http://auth:5000/", healthcheck_route="/health/auth/",
+            tags=["owner-auth"])
+        await asyncio.gather(*[
+            async_api.register_route(
+                "/rest/{}/".format(x), "auth--" + x, service_name="auth")
+            for x in ["user", "group"]])
+        return service
+
+    service = run_async(register)
+    assert kong_api.get_service("auth")["id"] == service["id"]
+    assert service["tags"] == ["owner-auth"]
+    assert kong_api.list_all_routes() == {"auth": [
+        "/health/auth/", "/rest/group/", "/rest/user/"]}
+    assert run_async(lambda x: x.list_all_routes()) == \
+        kong_api.list_all_routes()
+
+
+def test_register_route_needs_one_service_reference(run_async):
+    with pytest.raises(Exception):
+        run_async(lambda x: x.register_route("/x/", "x"))
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_iter_pages(fake_kong, kong_api, run_async, prefetch):
+    _register(kong_api, "auth", n_routes=5)
+    _register(kong_api, "other", n_routes=0)
+
+    async def collect(async_api):
+        services = [
+            x["name"] async for x in async_api.iter_services(
+                size=1, prefetch=prefetch)]
+        routes = [
+            x["name"] async for x in async_api.iter_routes(
+                service_id="auth", size=2, prefetch=prefetch)]
+        return services, routes
+
+    fake_kong.reset_stats()
+    services, routes = run_async(collect)
+    assert services == ["auth", "other"]
+    assert routes == ["auth--{}".format(i) for i in range(5)]
+    assert fake_kong.request_count == {"GET": 5}
+
+
+def test_iter_pages_closed_early(fake_kong, kong_api, run_async):
+    for i in range(5):
+        _register(kong_api, "service-{}".format(i), n_routes=0)
+
+    async def first(async_api):
+        async for service in async_api.iter_services(size=1, prefetch=True):
+            return service["name"]
+
+    fake_kong.reset_stats()
+    assert run_async(first) == "service-0"
+    # only the prefetched page is requested
+    assert fake_kong.request_count["GET"] <= 2
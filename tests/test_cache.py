@@ -0,0 +1,79 @@
+"""Tests of KongTopologyCache and cached KongAPI listings."""
+import time
+from pumpwood_kong.kong_api import KongAPI
+
+
+def _cached_api(fake_kong, ttl) -> KongAPI:
+    kong_api = KongAPI(api_gateway_url=fake_kong.url, cache_ttl=ttl)
+    kong_api.register_service(
+        "auth", "http://auth:5000/", healthcheck_route="/health/auth/")
+    kong_api.register_route(
+        ["/rest/user/", "/rest/group/"], "auth--endpoints",
+        service_name="auth")
+    return kong_api
+
+
+def _add_route_without_service(fake_kong, kong_api):
+    route = kong_api.register_route(
+        "/orphan/", "orphan", service_name="auth")
+    # Kong routes may not reference a service
+    fake_kong.state.entities["routes"][route["id"]]["service"] = None
+
+
+def test_reads_are_cached(fake_kong):
+    kong_api = _cached_api(fake_kong, ttl=3600)
+    fake_kong.reset_stats()
+    services = kong_api.list_services()
+    routes = kong_api.list_service_routes("auth")
+    kong_api.list_all_routes()
+    # services and routes are fetched once
+    assert fake_kong.request_count == {"GET": 2}
+    assert [x["name"] for x in services] == ["auth"]
+    assert sorted(x["name"] for x in routes) == [
+        "auth--endpoints", "auth--health-check"]
+
+
+def test_writes_invalidate(fake_kong):
+    kong_api = _cached_api(fake_kong, ttl=3600)
+    kong_api.list_services()
+    kong_api.register_service("models", "http://models:5000/")
+    assert sorted(x["name"] for x in kong_api.list_services()) == [
+        "auth", "models"]
+    kong_api.delete_route("auth--endpoints")
+    assert [x["name"] for x in kong_api.list_service_routes("auth")] == [
+        "auth--health-check"]
+
+
+def test_ttl(fake_kong, kong_api):
+    cached_api = _cached_api(fake_kong, ttl=0.3)
+    cached_api.list_services()
+    # changes made by other clients are seen after ttl
+    kong_api.register_service("models", "http://models:5000/")
+    assert len(cached_api.list_services()) == 1
+    time.sleep(0.4)
+    assert len(cached_api.list_services()) == 2
+
+
+def test_indexes(fake_kong):
+    kong_api = _cached_api(fake_kong, ttl=3600)
+    cache = kong_api.cache
+    service = cache.get_service("auth")
+    assert cache.get_service(service["id"]) is service
+    assert cache.get_service("missing") is None
+    assert cache.get_route("auth--endpoints")["paths"] == [
+        "/rest/user/", "/rest/group/"]
+    assert [x["name"] for x in cache.routes_by_path("/rest/group/")] == [
+        "auth--endpoints"]
+    assert len(cache.service_routes(service["id"])) == 2
+    assert cache.service_routes("missing") == []
+
+
+def test_list_all_routes_skips_routes_without_service(
+        fake_kong, kong_api, run_async):
+    cached_api = _cached_api(fake_kong, ttl=3600)
+    _add_route_without_service(fake_kong, kong_api)
+    cached_api.cache.invalidate()
+    expected = {"auth": ["/health/auth/", "/rest/group/", "/rest/user/"]}
+    assert cached_api.list_all_routes() == expected
+    assert kong_api.list_all_routes() == expected
+    assert run_async(lambda x: x.list_all_routes()) == expected
@@ -0,0 +1,76 @@
+"""Tests of ConcurrentExecutor and run_tasks_async."""
+import asyncio
+import threading
+import pytest
+from pumpwood_kong.executor import ConcurrentExecutor, Task, run_tasks_async
+
+
+def _fail():
+    raise RuntimeError("failed")
+
+
+def _ordered_tasks(order: list):
+    lock = threading.Lock()
+
+    def call(key):
+        with lock:
+            order.append(key)
+        return key
+
+    return [
+        Task("route", call, args=("route", ), depends_on=["service"]),
+        Task("service", call, args=("service", )),
+        Task("plugin", call, args=("plugin", ), depends_on=["route"])]
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_dependencies_order(max_workers):
+    order = []
+    results = ConcurrentExecutor(max_workers=max_workers).run(
+        _ordered_tasks(order))
+    assert order == ["service", "route", "plugin"]
+    assert list(results.keys()) == ["route", "service", "plugin"]
+    assert all(x.status == "done" for x in results.values())
+    assert results["route"].result == "route"
+
+
+def test_failed_dependency_skips_dependents():
+    tasks = [
+        Task("service", _fail),
+        Task("route", lambda: 1, depends_on=["service"]),
+        Task("plugin", lambda: 1, depends_on=["route"]),
+        Task("other", lambda: 1)]
+    results = ConcurrentExecutor(raise_errors=False).run(tasks)
+    assert [x.status for x in results.values()] == [
+        "failed", "skipped", "skipped", "done"]
+    with pytest.raises(RuntimeError):
+        ConcurrentExecutor().run(tasks)
+
+
+def test_unknown_dependency_is_ignored():
+    results = ConcurrentExecutor().run(
+        [Task("route", lambda: 1, depends_on=["missing"])])
+    assert results["route"].status == "done"
+
+
+def test_invalid_tasks():
+    with pytest.raises(ValueError):
+        ConcurrentExecutor().run([Task("a", int), Task("a", int)])
+    with pytest.raises(ValueError):
+        ConcurrentExecutor().run([
+            Task("a", int, depends_on=["b"]),
+            Task("b", int, depends_on=["a"])])
+
+
+def test_run_tasks_async():
+    order = []
+
+    async def coroutine():
+        order.append("coroutine")
+        return "coroutine"
+
+    tasks = _ordered_tasks(order) + [
+        Task("coroutine", coroutine, depends_on=["plugin"])]
+    results = asyncio.run(run_tasks_async(tasks, max_in_flight=2))
+    assert order == ["service", "route", "plugin", "coroutine"]
+    assert results["coroutine"].result == "coroutine"
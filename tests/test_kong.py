@@ -0,0 +1,240 @@
+"""Tests of KongManagement registration."""
+import json
+import threading
+import time
+import pytest
+from pumpwood_kong.kong import KongManagement, RegistrationPlan
+from pumpwood_kong import plugins as kong_plugins
+from pumpwood_kong.instrumentation import Instrumentation, MetricsCollector
+from pumpwood_kong.transport import KongTransport
+from pumpwood_kong.retry import RetryPolicy, CircuitBreaker
+from tests.fake_kong import FakeKongServer
+
+
+def _management(fake_kong, **kwargs) -> KongManagement:
+    return KongManagement(
+        api_gateway_url=fake_kong.url, service_name="auth",
+        service_url="http://auth:5000/",
+        healthcheck_endpoint="/health/auth/", **kwargs)
+
+
+def test_default_repairs_routes_edited_by_hand(fake_kong, kong_api):
+    _management(fake_kong)
+    kong_api.delete_route("auth--health-check")
+    _management(fake_kong)
+    assert "auth--health-check" in [x["name"] for x in kong_api.iter_routes()]
+
+
+def test_skip_unchanged(fake_kong, kong_api):
+    _management(fake_kong, skip_unchanged=True)
+    fake_kong.reset_stats()
+    management = _management(fake_kong, skip_unchanged=True)
+    assert fake_kong.request_count == {"GET": 1}
+    assert management.fingerprint_tag in management.kong_service["tags"]
+
+
+def test_skip_unchanged_models(fake_kong, kong_api):
+    management = _management(fake_kong, skip_unchanged=True)
+    management.register_models(["User", "Group"], route_per_model=True)
+
+    fake_kong.reset_stats()
+    management = _management(fake_kong, skip_unchanged=True)
+    management.register_models(["User", "Group"], route_per_model=True)
+    assert fake_kong.request_count == {"GET": 1}
+
+    management = _management(fake_kong, skip_unchanged=True)
+    management.register_models(["User"], route_per_model=True)
+    route_names = [x["name"] for x in kong_api.iter_routes()]
+    assert "auth--model--user" in route_names
+    fake_kong.reset_stats()
+    management = _management(fake_kong, skip_unchanged=True)
+    management.register_models(["User"], route_per_model=True)
+    assert fake_kong.request_count == {"GET": 1}
+
+
+def test_wait_healthy_uses_transport(fake_kong):
+    metrics = MetricsCollector()
+    transport = KongTransport(
+        instrumentation=Instrumentation(hooks=[metrics]))
+    management = _management(
+        fake_kong, transport=transport, staged_activation=True,
+        health_url=fake_kong.url + "/status", health_timeout=5)
+    assert management.wait_healthy()
+    assert "/status" in metrics.to_prometheus()
+
+
+def _failing_server(**kwargs) -> FakeKongServer:
+    return FakeKongServer(error_rate=1, error_status=503, **kwargs).start()
+
+
+def _retrying_transport(**kwargs) -> KongTransport:
+    return KongTransport(
+        retry_policy=RetryPolicy(
+            backoff_factor=1, respect_retry_after=False),
+        **kwargs)
+
+
+def test_wait_healthy_503_is_not_retried(fake_kong):
+    health = _failing_server()
+    try:
+        management = _management(
+            fake_kong, transport=_retrying_transport(),
+            health_url=health.url + "/status", health_timeout=1,
+            health_poll_interval=0.2)
+        start = time.monotonic()
+        with pytest.raises(Exception, match="is not healthy"):
+            management.wait_healthy()
+        assert time.monotonic() - start < 2
+    finally:
+        health.stop()
+
+
+def test_wait_healthy_is_not_blocked_by_circuit_breaker(fake_kong):
+    health = _failing_server()
+    try:
+        management = _management(
+            fake_kong, transport=_retrying_transport(
+                circuit_breaker=CircuitBreaker(failure_threshold=2)),
+            health_url=health.url + "/status", health_timeout=10,
+            health_poll_interval=0.1)
+        timer = threading.Timer(1, setattr, (health, "error_rate", 0))
+        timer.start()
+        start = time.monotonic()
+        assert management.wait_healthy()
+        assert time.monotonic() - start < 2
+    finally:
+        health.stop()
+
+
+def test_wait_healthy_call_timeout_is_capped(fake_kong):
+    health = FakeKongServer(latency=5).start()
+    try:
+        management = _management(
+            fake_kong, health_url=health.url + "/status", health_timeout=0.5,
+            health_poll_interval=1)
+        start = time.monotonic()
+        with pytest.raises(Exception, match="is not healthy"):
+            management.wait_healthy()
+        assert time.monotonic() - start < 1.5
+    finally:
+        health.stop()
+
+
+def test_sync_removes_routes_declaratively_on_dbless(dbless_fake_kong):
+    dbless_fake_kong.state.load_declarative({
+        "_format_version": "3.0", "services": [{
+            "name": "auth", "url": "http://auth:5000/", "routes": [
+                {"name": "auth--endpoints", "paths": ["/rest/user/"]}]}]})
+    management = KongManagement(
+        api_gateway_url=dbless_fake_kong.url, service_name="auth",
+        service_url="http://auth:5000/", sync=True, defer=True)
+    management.register_models(["User"], route_per_model=True)
+    management.apply(plan=RegistrationPlan(
+        model_routes=list(management.plan.model_routes.values()),
+        delete_routes=management.plan.delete_routes))
+    routes = [x["name"] for x in management.kong_api.iter_routes()]
+    assert routes == ["auth--model--user"]
+
+
+def test_register_models_makes_a_single_put(fake_kong):
+    management = _management(fake_kong)
+    fake_kong.reset_stats()
+    management.register_models(["User", "Group"])
+    assert fake_kong.request_count == {"PUT": 1}
+
+
+def test_defer_writes_only_on_apply(fake_kong, kong_api):
+    management = _management(fake_kong, defer=True)
+    management.register_models(["User"], route_per_model=True)
+    management.add_plugins([kong_plugins.rate_limiting(
+        minute=10, service="auth")])
+    assert fake_kong.request_count == {}
+    assert management.plan.summary() == {
+        "upstreams": 0, "services": 1, "routes": 1, "model_routes": 1,
+        "plugins": 1, "delete_routes": 1}
+
+    future = management.apply(background=True)
+    service = future.result(timeout=10)
+    assert service["name"] == "auth"
+    assert management.plan.is_empty
+    assert kong_api.list_all_routes() == {
+        "auth": ["/health/auth/", "/rest/user/"]}
+    assert [x["name"] for x in kong_api.list_plugins()] == ["rate-limiting"]
+
+
+def test_merge_plans_of_workers(fake_kong, kong_api):
+    workers = []
+    for models in [["User", "Group"], ["Group", "Role"]]:
+        worker = _management(fake_kong, defer=True)
+        worker.register_models(models, route_per_model=True)
+        workers.append(worker)
+    # plans may be sent between processes as JSON
+    plans = [
+        RegistrationPlan.from_dict(json.loads(json.dumps(x.plan.to_dict())))
+        for x in workers]
+    plans[1].model_routes["auth--model--group"]["strip_path"] = True
+    merged = plans[0].merge(plans[1])
+    assert sorted(merged.model_routes) == [
+        "auth--model--group", "auth--model--role", "auth--model--user"]
+    # objects of the other plan win
+    assert merged.model_routes["auth--model--group"]["strip_path"]
+    assert merged.delete_routes == ["auth--endpoints"]
+    assert not plans[0].model_routes["auth--model--group"]["strip_path"]
+
+    merged.add_model_routes([{"name": "auth--endpoints", "paths": ["/x/"]}])
+    assert merged.delete_routes == []
+
+    workers[0].apply(plan=plans[0].merge(plans[1]))
+    routes = dict(
+        (x["name"], x["strip_path"]) for x in kong_api.iter_routes())
+    assert routes == {
+        "auth--health-check": False, "auth--model--user": False,
+        "auth--model--group": True, "auth--model--role": False}
+
+
+def test_replicas_register_upstream_targets(fake_kong, kong_api):
+    replicas = [
+        _management(
+            fake_kong, upstream_target="10.0.0.{}:5000".format(i),
+            target_weight=10 * i, upstream_payload={"algorithm": "least"})
+        for i in [1, 2]]
+    # re-registering a replica does not duplicate its target
+    _management(fake_kong, upstream_target="10.0.0.1:5000", target_weight=10)
+
+    assert kong_api.get_service("auth")["host"] == "auth--upstream"
+    assert kong_api.get_upstream("auth--upstream")["algorithm"] == "least"
+    targets = dict(
+        (x["target"], x["weight"])
+        for x in kong_api.list_targets("auth--upstream"))
+    assert targets == {"10.0.0.1:5000": 10, "10.0.0.2:5000": 20}
+
+    assert replicas[0].deregister_target()
+    assert not replicas[0].deregister_target()
+    assert [x["target"] for x in kong_api.list_targets("auth--upstream")] == [
+        "10.0.0.2:5000"]
+
+
+def test_deregister_on_exit(fake_kong, kong_api, monkeypatch):
+    exit_functions = []
+    monkeypatch.setattr(
+        "pumpwood_kong.kong.atexit.register", exit_functions.append)
+    _management(fake_kong, upstream_target="10.0.0.1:5000")
+    management = _management(
+        fake_kong, upstream_target="10.0.0.2:5000", deregister_on_exit=True)
+    assert exit_functions == [management.deregister_target]
+
+    for func in exit_functions:
+        func()
+    assert [x["target"] for x in kong_api.list_targets("auth--upstream")] == [
+        "10.0.0.1:5000"]
+
+
+def test_wait_healthy_uses_upstream_health(fake_kong):
+    management = _management(
+        fake_kong, upstream_target="10.0.0.1:5000",
+        health_upstream="auth--upstream", health_timeout=0.3,
+        health_poll_interval=0.05)
+    with pytest.raises(Exception, match="not healthy"):
+        management.wait_healthy()
+    fake_kong.state.target_health["10.0.0.1:5000"] = "HEALTHY"
+    assert management.wait_healthy()
@@ -0,0 +1,215 @@
+"""Tests of KongAPI against the fake Kong."""
+import json
+import pytest
+from pumpwood_kong.kong_api import KongAPI, tags_query, match_tags
+
+
+def _register(kong_api, service_name: str, n_routes: int = 2):
+    service = kong_api.register_service(
+        service_name, "http://{}:5000/".format(service_name))
+    for i in range(n_routes):
+        kong_api.register_route(
+            "/{}/{}/".format(service_name, i),
+            "{}--{}".format(service_name, i), service_name=service_name)
+    return service
+
+
+def test_teardown_by_id(kong_api):
+    service = _register(kong_api, "auth")
+    _register(kong_api, "other")
+    results = kong_api.teardown([service["id"]])
+    assert [x.status for x in results] == ["done"] * 3
+    assert [x["name"] for x in kong_api.iter_services()] == ["other"]
+    assert len(list(kong_api.iter_routes())) == 2
+
+
+def test_teardown_by_name_and_duplicates(kong_api):
+    service = _register(kong_api, "auth")
+    _register(kong_api, "other")
+    results = kong_api.teardown(["auth", service["id"], "auth", "missing"])
+    assert all(x.status == "done" for x in results)
+    assert ("service", service["id"]) in [x.key for x in results]
+    assert [x["name"] for x in kong_api.iter_services()] == ["other"]
+    assert all(
+        x["name"].startswith("other--") for x in kong_api.iter_routes())
+
+
+def test_teardown_all_keeps_test_services(kong_api):
+    _register(kong_api, "auth")
+    _register(kong_api, "test-service")
+    kong_api.delete_routes_and_service()
+    assert [x["name"] for x in kong_api.iter_services()] == ["test-service"]
+
+
+def test_teardown_by_tags_scans_routes_once(fake_kong, kong_api):
+    for name in ["auth", "models"]:
+        kong_api.register_service(
+            name, "http://{}:5000/".format(name),
+            healthcheck_route="/health/{}/".format(name), tags=["owner"])
+    _register(kong_api, "other")
+    fake_kong.reset_stats()
+    results = kong_api.teardown(tags="owner")
+    assert all(x.status == "done" for x in results)
+    assert fake_kong.request_count == {"GET": 2, "DELETE": 4}
+    assert [x["name"] for x in kong_api.iter_services()] == ["other"]
+
+
+def test_register_routes(fake_kong, kong_api):
+    _register(kong_api, "auth", n_routes=0)
+    kong_api.register_route("/rest/old/", "old", service_name="auth")
+    fake_kong.reset_stats()
+    results = kong_api.register_routes([
+        ("user", "/rest/user/", "auth"),
+        ("group", ["/rest/group/"], {"name": "auth"})],
+        delete_routes=["old"], tags=["owner"])
+    assert [x.key for x in results] == ["user", "group", ("delete", "old")]
+    assert all(x.status == "done" for x in results)
+    # Kong mode is not probed before the writes
+    assert fake_kong.request_count == {"PUT": 2, "DELETE": 1}
+    routes = dict((x["name"], x) for x in kong_api.iter_routes())
+    assert sorted(routes.keys()) == ["group", "user"]
+    assert routes["user"]["tags"] == ["owner"]
+
+
+def test_register_routes_failed_write_skips_deletes(kong_api):
+    _register(kong_api, "auth", n_routes=1)
+    results = kong_api.register_routes(
+        [("user", "/rest/user/", "missing")], delete_routes=["auth--0"])
+    assert [x.status for x in results] == ["failed", "skipped"]
+    assert [x["name"] for x in kong_api.iter_routes()] == ["auth--0"]
+
+
+def _dbless_config() -> dict:
+    return {"_format_version": "3.0", "services": [{
+        "name": "auth", "url": "http://auth:5000/", "routes": [
+            {"name": "auth--endpoints", "paths": ["/rest/user/"]},
+            {"name": "auth--health", "paths": ["/health/auth/"]}]}]}
+
+
+def test_declarative_config_is_read_from_yaml(dbless_fake_kong):
+    dbless_fake_kong.state.load_declarative(_dbless_config())
+    kong_api = KongAPI(api_gateway_url=dbless_fake_kong.url)
+    response = kong_api._transport.get(dbless_fake_kong.url + "/config")
+    with pytest.raises(ValueError):
+        json.loads(response.json()["config"])
+    config = kong_api._get_declarative_config()
+    assert config == dbless_fake_kong.state.dump_declarative()
+
+
+def test_register_routes_declarative(dbless_fake_kong):
+    dbless_fake_kong.state.load_declarative(_dbless_config())
+    kong_api = KongAPI(api_gateway_url=dbless_fake_kong.url)
+    results = kong_api.register_routes(
+        [("auth--model--user", "/rest/user/", "auth")],
+        delete_routes=["auth--endpoints"])
+    assert [x.status for x in results] == ["done", "done"]
+    assert kong_api.is_dbless()
+    routes = dict((x["name"], x) for x in kong_api.iter_routes())
+    assert sorted(routes.keys()) == ["auth--health", "auth--model--user"]
+    assert routes["auth--model--user"]["paths"] == ["/rest/user/"]
+
+    # DB-less mode is kept, next calls go straight to /config
+    dbless_fake_kong.reset_stats()
+    kong_api.register_routes([("auth--model--group", "/rest/group/", "auth")])
+    assert dbless_fake_kong.request_count == {"GET": 1, "POST": 1}
+
+
+def test_register_routes_declarative_failure(dbless_fake_kong):
+    dbless_fake_kong.state.load_declarative(_dbless_config())
+    kong_api = KongAPI(api_gateway_url=dbless_fake_kong.url)
+    results = kong_api.register_routes(
+        [("user", "/rest/user/", "missing")], declarative=True,
+        delete_routes=["auth--endpoints"])
+    assert [x.key for x in results] == ["user", ("delete", "auth--endpoints")]
+    assert [x.status for x in results] == ["failed", "failed"]
+
+
+def test_iter_all_routes_yields_as_pages_arrive(fake_kong, kong_api):
+    for i in range(20):
+        _register(kong_api, "service-{:02d}".format(i), n_routes=3)
+    expected = dict(kong_api.iter_all_routes(per_service=False, size=5))
+    assert expected["service-07"] == [
+        "/service-07/0/", "/service-07/1/", "/service-07/2/"]
+
+    fake_kong.reset_stats()
+    iterator = kong_api.iter_all_routes(size=2, max_workers=2)
+    first = next(iterator)
+    # two services pages (prefetch) and two routes pages of at most two
+    # services, instead of the 50 calls of the full iteration
+    assert fake_kong.request_count["GET"] <= 6
+    assert first == ("service-00", expected["service-00"])
+    assert dict([first] + list(iterator)) == expected
+    iterator.close()
+
+
+def test_iter_all_routes_filtered_reads_only_selected(fake_kong, kong_api):
+    for name in ["auth", "models"]:
+        kong_api.register_service(
+            name, "http://{}:5000/".format(name),
+            healthcheck_route="/health/{}/".format(name), tags=["tenant-a"])
+    for i in range(5):
+        _register(kong_api, "other-{}".format(i))
+
+    fake_kong.reset_stats()
+    result = list(kong_api.iter_all_routes(tags="tenant-a"))
+    assert result == [
+        ("auth", ["/health/auth/"]), ("models", ["/health/models/"])]
+    # one services page and one routes page per selected service
+    assert fake_kong.request_count == {"GET": 3}
+
+    result = dict(kong_api.iter_all_routes(name_prefix="other-"))
+    assert sorted(result) == ["other-{}".format(i) for i in range(5)]
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_iter_pages_follows_offset(fake_kong, kong_api, prefetch):
+    names = ["service-{}".format(i) for i in range(7)]
+    for name in names:
+        kong_api.register_service(name, "http://{}:5000/".format(name))
+
+    page = kong_api._transport.get(
+        kong_api._url_services, params={"size": 2}).json()
+    assert page["offset"] == "2"
+    assert page["next"] == "/services?offset=2&size=2"
+
+    fake_kong.reset_stats()
+    services = list(kong_api.iter_services(size=2, prefetch=prefetch))
+    assert [x["name"] for x in services] == names
+    # last page has no offset
+    assert fake_kong.request_count == {"GET": 4}
+
+
+def test_iter_pages_keeps_params_between_pages(fake_kong, kong_api):
+    for i in range(5):
+        kong_api.register_service(
+            "service-{}".format(i), "http://service:5000/",
+            tags=["even" if i % 2 == 0 else "odd"])
+    services = kong_api.iter_services(size=1, tags="even")
+    assert [x["name"] for x in services] == [
+        "service-0", "service-2", "service-4"]
+
+
+def test_tags_query():
+    assert tags_query(None) is None
+    assert tags_query(["a", "b"]) == {"tags": "a,b"}
+    assert tags_query("a/b") == {"tags": "a/b"}
+
+
+@pytest.mark.parametrize("tags, expected", [
+    (["a", "b"], ["both"]),
+    ("a,b", ["both"]),
+    ("a/b", ["both", "only-a", "only-b"]),
+    ("a", ["both", "only-a"]),
+    (None, ["both", "none", "only-a", "only-b"])])
+def test_tags_and_or(kong_api, tags, expected):
+    for name, service_tags in [
+            ("both", ["a", "b"]), ("only-a", ["a"]), ("only-b", ["b"]),
+            ("none", None)]:
+        kong_api.register_service(
+            name, "http://{}:5000/".format(name), tags=service_tags)
+    services = kong_api.list_services(tags=tags)
+    assert sorted(x["name"] for x in services) == expected
+    # client side filter agrees with Kong
+    assert sorted(
+        x["name"] for x in kong_api.iter_services()
+        if match_tags(x, tags)) == expected
@@ -0,0 +1,141 @@
+"""Tests of registration leases."""
+import time
+import threading
+import pytest
+from pumpwood_kong.kong import KongManagement
+from pumpwood_kong.kong_api import KongAPI
+from pumpwood_kong.lease import (
+    LeaseBackend, KongLease, FileLease, LeaseLostError)
+from tests.fake_kong import FakeKongServer
+
+
+def test_lease_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LeaseBackend()
+
+
+def test_kong_lease_is_exclusive(kong_api):
+    first = KongLease(kong_api, owner="first", ttl=60)
+    second = KongLease(kong_api, owner="second", ttl=60)
+    assert first.acquire("auth")
+    assert not second.acquire("auth")
+    first.release("auth")
+    assert second.acquire("auth")
+
+
+def test_kong_lease_expired_is_taken(kong_api):
+    first = KongLease(kong_api, owner="first", ttl=-10)
+    second = KongLease(kong_api, owner="second", ttl=60)
+    assert first.acquire("auth")
+    assert second.acquire("auth")
+    assert not first.renew("auth")
+
+
+def test_kong_lease_renewed_while_running(kong_api):
+    holder = KongLease(kong_api, owner="holder", ttl=1.5)
+    other = KongLease(kong_api, owner="other", ttl=60)
+    taken = []
+
+    def func():
+        # lease would expire without renewal
+        time.sleep(2.5)
+        taken.append(other.acquire("auth"))
+        return "done"
+
+    assert holder.run_exclusive("auth", func, lambda: None) == "done"
+    assert taken == [False]
+    assert kong_api.get_consumer("pumpwood-lease--auth") is None
+
+
+def _steal(kong_api, holder, name):
+    """Expire holder's lease and give it to other owner."""
+    kong_api.delete_consumer(holder._held[name])
+    assert KongLease(kong_api, owner="other", ttl=60).acquire(name)
+    # wait for a renewal of the holder to fail
+    time.sleep(holder.ttl)
+
+
+def test_ensure_held_raises_when_lost(kong_api):
+    holder = KongLease(kong_api, owner="holder", ttl=0.3)
+    writes = []
+
+    def func():
+        holder.ensure_held("auth")
+        writes.append(1)
+        _steal(kong_api, holder, "auth")
+        holder.ensure_held("auth")
+        writes.append(2)
+
+    with pytest.raises(LeaseLostError):
+        holder.run_exclusive("auth", func, lambda: None)
+    assert writes == [1]
+    consumer = kong_api.get_consumer("pumpwood-lease--auth")
+    assert "pumpwood-lease-owner-other" in consumer["tags"]
+
+
+def test_run_exclusive_raises_when_lost(kong_api):
+    holder = KongLease(kong_api, owner="holder", ttl=0.3)
+
+    def func():
+        _steal(kong_api, holder, "auth")
+        return "registered"
+
+    with pytest.raises(LeaseLostError):
+        holder.run_exclusive("auth", func, lambda: None)
+    # not checked outside run_exclusive
+    holder.ensure_held("auth")
+
+
+class _LostLease(KongLease):
+    def renew(self, name):
+        return False
+
+
+def test_registration_stops_when_lease_lost():
+    with FakeKongServer(latency=0.1) as fake_kong:
+        kong_api = KongAPI(fake_kong.url)
+        with pytest.raises(LeaseLostError):
+            KongManagement(
+                api_gateway_url=fake_kong.url, service_name="auth",
+                service_url="http://auth:5000/",
+                healthcheck_endpoint="/health/auth/", skip_unchanged=True,
+                lease=_LostLease(kong_api, owner="holder", ttl=0.15))
+        assert kong_api.get_service("auth") is None
+
+
+def test_run_exclusive_writes_once(kong_api):
+    calls = []
+    results = []
+    done = []
+
+    def func():
+        time.sleep(0.2)
+        calls.append(1)
+        done.append("registered")
+        return "registered"
+
+    def run(owner):
+        lease = KongLease(
+            kong_api, owner=owner, ttl=60, poll_interval=0.05)
+        results.append(lease.run_exclusive(
+            "auth", func, lambda: done[0] if done else None))
+
+    threads = [
+        threading.Thread(target=run, args=("owner-%d" % i, ))
+        for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["registered"] * 5
+
+
+def test_file_lease(tmp_path):
+    first = FileLease(directory=str(tmp_path), owner="first")
+    second = FileLease(directory=str(tmp_path), owner="second")
+    assert first.acquire("auth")
+    assert not second.acquire("auth")
+    first.release("auth")
+    assert second.acquire("auth")
+    second.release("auth")
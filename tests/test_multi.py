@@ -0,0 +1,64 @@
+"""Tests of multi-gateway fan-out."""
+import time
+import pytest
+from pumpwood_communication.exceptions import PumpWoodException
+from pumpwood_kong.multi import MultiKongAPI, MultiKongManagement, fan_out
+from tests.fake_kong import FakeKongServer
+
+
+@pytest.fixture
+def gateways():
+    with FakeKongServer() as first, FakeKongServer() as second, \
+            FakeKongServer(latency=0.5) as slow:
+        yield first, second, slow
+
+
+def test_fan_out_timeout():
+    results = fan_out(
+        {"fast": lambda: 1, "slow": lambda: time.sleep(1)},
+        timeouts={"slow": 0.1})
+    assert results["fast"].result == 1
+    assert isinstance(results["slow"].error, TimeoutError)
+
+
+def test_timeouts_keys_with_trailing_slash(gateways):
+    first, second, slow = gateways
+    multi = MultiKongAPI(
+        [first.url + "/", slow.url], timeouts={slow.url + "/": 0.2})
+    assert multi.timeouts == {first.url: None, slow.url: 0.2}
+    with pytest.raises(ValueError):
+        MultiKongAPI([first.url], timeouts={"http://other:8001/": 1})
+
+
+def test_quorum(gateways):
+    first, second, slow = gateways
+    multi = MultiKongAPI(
+        [first.url, second.url, slow.url], quorum=2,
+        timeouts={slow.url: 0.2})
+    results = multi.list_services()
+    assert [x.status for x in results.values()] == [
+        "done", "done", "failed"]
+
+    with pytest.raises(PumpWoodException) as error:
+        MultiKongAPI(
+            [first.url, slow.url], timeouts={slow.url: 0.2}).list_services()
+    assert error.value.payload["timed_out"] == [slow.url]
+
+
+def test_registration_and_consistency_report(gateways):
+    first, second, _ = gateways
+    management = MultiKongManagement(
+        [first.url, second.url], service_name="auth",
+        service_url="http://auth:5000/",
+        healthcheck_endpoint="/health/auth/")
+    management.register_models(["DescriptionModel"])
+    multi = management.multi_kong_api()
+    assert multi.consistency_report()["consistent"]
+
+    multi.kong_apis[second.url].register_route(
+        "/other/", "auth--endpoints", service_name="auth")
+    report = multi.consistency_report()
+    assert not report["consistent"]
+    difference, = report["differences"]["routes"]
+    assert difference["key"] == "auth--endpoints"
+    assert set(difference["fields"].keys()) == {"paths"}
@@ -0,0 +1,78 @@
+"""Tests of plugin payloads and their idempotent sync."""
+import pytest
+from pumpwood_kong import plugins as kong_plugins
+from pumpwood_kong.executor import TaskResult
+from pumpwood_kong.kong import KongManagement
+
+
+def test_plugin_id_is_deterministic():
+    first = kong_plugins.plugin_id("proxy-cache", route="auth--model--user")
+    assert first == kong_plugins.plugin_id(
+        "proxy-cache", route={"name": "auth--model--user"})
+    assert first != kong_plugins.plugin_id(
+        "proxy-cache", service="auth--model--user")
+
+
+_live_config = {"minute": 10, "policy": "local", "limit_by": "consumer"}
+
+
+@pytest.mark.parametrize("live, changed", [
+    (None, True),
+    # Kong fills config defaults
+    ({"config": dict(_live_config, hour=None), "enabled": True,
+      "tags": ["owner"]}, False),
+    ({"config": dict(_live_config, minute=20), "tags": ["owner"]}, True),
+    ({"config": _live_config, "enabled": False, "tags": ["owner"]}, True),
+    ({"config": _live_config, "tags": ["other"]}, True)])
+def test_is_plugin_changed(live, changed):
+    desired = kong_plugins.rate_limiting(
+        minute=10, service="auth", tags=["owner"])
+    assert kong_plugins.is_plugin_changed(desired, live) == changed
+
+
+def test_is_plugin_changed_ignores_list_order():
+    desired = kong_plugins.proxy_cache(
+        vary_query_params=["a", "b"], service="auth")
+    live = {"config": dict(
+        desired["config"], vary_query_params=["b", "a"])}
+    assert not kong_plugins.is_plugin_changed(desired, live)
+
+
+def test_sync_plugins_is_idempotent(fake_kong, kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    plugins = [
+        kong_plugins.rate_limiting(minute=10, service="auth"),
+        kong_plugins.request_size_limiting(allowed_payload_size=8)]
+
+    results = kong_api.sync_plugins(plugins)
+    assert [x.status for x in results] == [TaskResult.DONE] * 2
+    assert [x.key for x in results] == [x["id"] for x in plugins]
+
+    fake_kong.reset_stats()
+    results = kong_api.sync_plugins(plugins)
+    assert fake_kong.request_count == {"GET": 1}
+    assert [x.result["id"] for x in results] == [x["id"] for x in plugins]
+
+    fake_kong.reset_stats()
+    plugins[0] = kong_plugins.rate_limiting(minute=20, service="auth")
+    kong_api.sync_plugins(plugins)
+    assert fake_kong.request_count == {"GET": 1, "PUT": 1}
+    assert len(kong_api.list_plugins()) == 2
+    assert kong_api.list_plugins(service_id="auth")[0]["config"][
+        "minute"] == 20
+
+
+def test_enable_plugins_twice_writes_once(fake_kong, kong_api):
+    management = KongManagement(
+        api_gateway_url=fake_kong.url, service_name="auth",
+        service_url="http://auth:5000/")
+    management.register_models(["User"], route_per_model=True)
+    management.enable_proxy_cache(["User"], ttl=60)
+    management.enable_rate_limiting(minute=10)
+
+    fake_kong.reset_stats()
+    management.enable_proxy_cache(["User"], ttl=60)
+    management.enable_rate_limiting(minute=10)
+    assert fake_kong.request_count == {"GET": 2}
+    assert sorted(x["name"] for x in kong_api.list_plugins()) == [
+        "proxy-cache", "rate-limiting"]
@@ -0,0 +1,110 @@
+"""Tests of PathResolver."""
+import threading
+from pumpwood_kong.resolver import PathResolver
+
+
+services = [
+    {"id": "s1", "name": "auth"},
+    {"id": "s2", "name": "models"}]
+routes = [
+    {"id": "r1", "name": "auth", "paths": ["/rest/"],
+     "service": {"id": "s1"}},
+    {"id": "r2", "name": "models", "paths": ["/rest/model/", "/rest/mod"],
+     "service": {"id": "s2"}},
+    {"id": "r3", "name": "regex", "paths": ["~/rest/model/[0-9]+/$"],
+     "regex_priority": 10, "service": {"id": "s1"}}]
+
+
+def test_longest_prefix_wins():
+    resolver = PathResolver.from_routes(routes, services)
+    match = resolver.resolve("/rest/model/list/?limit=10")
+    assert match.route["name"] == "models"
+    assert match.path == "/rest/model/"
+    assert match.service_name == "models"
+    assert resolver.resolve("/rest/user/").route["name"] == "auth"
+
+
+def test_partial_segment_prefix():
+    resolver = PathResolver.from_routes(routes, services)
+    assert resolver.resolve("/rest/modelx/").path == "/rest/mod"
+
+
+def test_regex_paths_first():
+    resolver = PathResolver.from_routes(routes, services)
+    assert resolver.resolve("/rest/model/12/").route["name"] == "regex"
+    names = [x.route["name"] for x in resolver.resolve_all("/rest/model/1/")]
+    assert names == ["regex", "models", "models", "auth"]
+
+
+def test_no_match():
+    resolver = PathResolver.from_routes(routes, services)
+    assert resolver.resolve("/other/") is None
+
+
+def test_remove_route():
+    resolver = PathResolver.from_routes(routes, services)
+    resolver.remove_route("models")
+    assert resolver.resolve("/rest/model/list/").route["name"] == "auth"
+    resolver.remove_route("r1")
+    assert resolver.resolve("/rest/user/") is None
+
+
+def test_replace_route():
+    resolver = PathResolver.from_routes(routes, services)
+    resolver.add_route(dict(routes[1], paths=["/api/"]))
+    assert resolver.resolve("/rest/model/list/").route["name"] == "auth"
+    assert resolver.resolve("/api/x/").route["name"] == "models"
+
+
+def test_from_kong(kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    kong_api.register_route("/rest/", "auth", service_name="auth")
+    resolver = PathResolver.from_kong(kong_api)
+    assert resolver.resolve("/rest/user/").service_name == "auth"
+
+
+def test_remove_service():
+    resolver = PathResolver.from_routes(routes, services)
+    resolver.remove_service("models")
+    assert resolver.resolve("/rest/model/list/").route["name"] == "auth"
+    assert "s2" not in resolver.services
+    resolver.remove_service("s1")
+    assert resolver.resolve("/rest/user/") is None
+
+
+def test_delete_service_updates_resolver(kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    kong_api.register_route("/rest/", "auth", service_name="auth")
+    resolver = kong_api.build_resolver()
+    kong_api.delete_route("auth")
+    kong_api.delete_service("auth")
+    assert resolver.resolve("/rest/user/") is None
+    assert resolver.services == {}
+
+
+def test_concurrent_writes(kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    resolver = kong_api.build_resolver()
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                resolver.resolve_all("/rest/model-1/x/")
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        results = kong_api.register_routes([
+            ("model-%d" % i, ["/rest/model-%d/" % i, "~/rest/m%d/$" % i],
+             "auth") for i in range(100)], max_workers=10)
+    finally:
+        stop.set()
+        reader.join()
+    assert all(x.status == "done" for x in results)
+    assert errors == []
+    assert resolver.resolve("/rest/model-42/x/").route["name"] == "model-42"
+    assert len(resolver.resolve_all("/rest/m7/")) == 1
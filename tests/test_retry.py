@@ -0,0 +1,167 @@
+"""Tests of RetryPolicy, CircuitBreaker and transport retries."""
+import pytest
+import requests
+from email.utils import formatdate
+from pumpwood_kong import retry
+from pumpwood_kong.retry import (
+    RetryPolicy, CircuitBreaker, CircuitBreakerOpenError)
+from pumpwood_kong.transport import KongTransport
+from tests.fake_kong import FakeKongServer
+
+
+class Clock:
+    """Clock advanced by the tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RaisingSession:
+    """Session which calls fail with an error that is not retried."""
+
+    def request(self, **kwargs):
+        raise RuntimeError("broken chunked body")
+
+
+def _response(headers: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 503
+    response.headers.update(headers)
+    return response
+
+
+def test_backoff_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda a, b: b)
+    policy = RetryPolicy(backoff_factor=0.5, max_backoff=10)
+    assert [policy.backoff(x) for x in range(6)] == [
+        0.5, 1, 2, 4, 8, 10]
+
+
+def test_backoff_has_full_jitter():
+    policy = RetryPolicy(backoff_factor=1, max_backoff=30)
+    waits = [policy.backoff(3) for _ in range(200)]
+    assert all(0 <= x <= 8 for x in waits)
+    assert len(set(waits)) > 1
+    assert min(waits) < 2 and max(waits) > 6
+
+
+def test_retry_after(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda a, b: b)
+    policy = RetryPolicy(backoff_factor=1, max_backoff=20)
+    assert policy.wait_time(0, _response({"Retry-After": "3"})) == 3
+    assert policy.wait_time(0, _response({"Retry-After": "120"})) == 20
+    assert policy.wait_time(2, _response({"Retry-After": "soon"})) == 4
+    assert policy.wait_time(2, _response({})) == 4
+    date_wait = policy.wait_time(0, _response({
+        "Retry-After": formatdate(retry.time.time() + 10, usegmt=True)}))
+    assert 8 <= date_wait <= 10
+
+    policy = RetryPolicy(
+        backoff_factor=1, max_backoff=20, respect_retry_after=False)
+    assert policy.wait_time(1, _response({"Retry-After": "3"})) == 2
+
+
+def test_can_retry():
+    policy = RetryPolicy(max_retries=2)
+    assert policy.can_retry("get", 1)
+    assert not policy.can_retry("GET", 2)
+    assert not policy.can_retry("POST", 0)
+    assert policy.is_retry_status(503)
+    assert not policy.is_retry_status(404)
+
+
+def test_transport_retries_idempotent_calls():
+    waits = []
+    transport = KongTransport(
+        retry_policy=RetryPolicy(max_retries=3, sleep=waits.append))
+    with FakeKongServer(error_rate=1) as fake_kong:
+        response = transport.get(fake_kong.url + "/services")
+        assert response.status_code == 503
+        # fake Kong answers errors with Retry-After: 0
+        assert waits == [0, 0, 0]
+        assert fake_kong.request_count == {"GET": 4}
+
+        fake_kong.reset_stats()
+        transport.post(fake_kong.url + "/services", json={})
+        assert fake_kong.request_count == {"POST": 1}
+
+
+def test_transport_retries_connection_errors():
+    with FakeKongServer() as fake_kong:
+        url = fake_kong.url
+    waits = []
+    transport = KongTransport(
+        retry_policy=RetryPolicy(max_retries=2, sleep=waits.append))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.get(url + "/services")
+    assert len(waits) == 2
+
+
+def test_circuit_breaker_transitions():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        failure_threshold=2, recovery_timeout=30, clock=clock)
+    breaker.before_call("kong")
+    breaker.record_failure("kong")
+    assert breaker.state("kong") == CircuitBreaker.CLOSED
+    breaker.record_failure("kong")
+    assert breaker.state("kong") == CircuitBreaker.OPEN
+    with pytest.raises(CircuitBreakerOpenError):
+        breaker.before_call("kong")
+    # other hosts are not affected
+    breaker.before_call("other-kong")
+
+    clock.now += 30
+    assert breaker.state("kong") == CircuitBreaker.HALF_OPEN
+    breaker.before_call("kong")
+    # only one trial call runs while half-open
+    with pytest.raises(CircuitBreakerOpenError):
+        breaker.before_call("kong")
+    breaker.record_failure("kong")
+    assert breaker.state("kong") == CircuitBreaker.OPEN
+
+    clock.now += 30
+    breaker.before_call("kong")
+    breaker.record_success("kong")
+    assert breaker.state("kong") == CircuitBreaker.CLOSED
+    breaker.record_failure("kong")
+    assert breaker.state("kong") == CircuitBreaker.CLOSED
+
+
+def test_transport_opens_circuit_on_errors():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        failure_threshold=2, recovery_timeout=30, clock=clock)
+    transport = KongTransport(circuit_breaker=breaker)
+    with FakeKongServer(error_rate=1) as fake_kong:
+        transport.get(fake_kong.url + "/services")
+        transport.get(fake_kong.url + "/services")
+        with pytest.raises(CircuitBreakerOpenError):
+            transport.get(fake_kong.url + "/services")
+        assert fake_kong.request_count == {"GET": 2}
+
+        clock.now += 30
+        fake_kong.error_rate = 0
+        assert transport.get(fake_kong.url + "/services").ok
+        assert breaker.state(fake_kong.url) == CircuitBreaker.CLOSED
+
+
+def test_transport_error_finishes_half_open_trial():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        failure_threshold=1, recovery_timeout=30, clock=clock)
+    transport = KongTransport(
+        session=RaisingSession(), circuit_breaker=breaker)
+    breaker.record_failure("http://kong:8001")
+    clock.now += 30
+    with pytest.raises(RuntimeError):
+        transport.get("http://kong:8001/services")
+    assert breaker.state("http://kong:8001") == CircuitBreaker.OPEN
+
+    # a new trial is allowed after recovery_timeout
+    clock.now += 30
+    with pytest.raises(RuntimeError):
+        transport.get("http://kong:8001/services")
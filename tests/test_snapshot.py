@@ -0,0 +1,75 @@
+"""Tests of snapshot export and import between fake Kongs."""
+import gzip
+import json
+import pytest
+from pumpwood_kong.kong_api import KongAPI
+from pumpwood_kong.snapshot import iter_snapshot
+from tests.fake_kong import FakeKongServer
+
+
+def _fill(kong_api):
+    for name in ["auth", "models"]:
+        kong_api.register_service(
+            name, "http://{}:5000/".format(name),
+            healthcheck_route="/health/{}/".format(name), tags=["owner"])
+        for i in range(3):
+            kong_api.register_route(
+                "/rest/{}-{}/".format(name, i), "{}--{}".format(name, i),
+                service_name=name)
+
+
+def _topology(kong_api) -> dict:
+    services = dict(
+        (x["id"], x["name"]) for x in kong_api.iter_services())
+    return {
+        "services": sorted(
+            (x["name"], x["host"], x["port"], tuple(x["tags"] or []))
+            for x in kong_api.iter_services()),
+        "routes": sorted(
+            (x["name"], tuple(x["paths"]), services[x["service"]["id"]])
+            for x in kong_api.iter_routes())}
+
+
+@pytest.mark.parametrize("file_name", ["snapshot.jsonl", "snapshot.jsonl.gz"])
+def test_round_trip(kong_api, tmp_path, file_name):
+    _fill(kong_api)
+    path = str(tmp_path / file_name)
+    assert kong_api.export_snapshot(path, page_size=2) == {
+        "service": 2, "route": 8}
+
+    with open(path, "rb") as file:
+        is_gzip = file.read(2) == b"\x1f\x8b"
+    assert is_gzip == file_name.endswith(".gz")
+
+    with FakeKongServer() as target_kong:
+        target_api = KongAPI(api_gateway_url=target_kong.url)
+        # small batches, routes reference services of previous batches
+        counts = target_api.import_snapshot(path, batch_size=3)
+        assert counts == {"service": 2, "route": 8}
+        assert _topology(target_api) == _topology(kong_api)
+
+        # import is an upsert by name
+        target_api.import_snapshot(path)
+        assert _topology(target_api) == _topology(kong_api)
+
+
+def test_compress_overrides_extension(kong_api, tmp_path):
+    _fill(kong_api)
+    path = str(tmp_path / "snapshot.bin")
+    kong_api.export_snapshot(path, compress=True)
+    with gzip.open(path, "rt") as file:
+        header = json.loads(file.readline())
+    assert header["entity"] == "snapshot"
+    entities = [x[0] for x in iter_snapshot(path, compress=True)]
+    assert entities == ["service"] * 2 + ["route"] * 8
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / "snapshot.jsonl"
+    path.write_text(json.dumps(
+        {"entity": "snapshot", "data": {"format_version": 99}}) + "\n")
+    with pytest.raises(ValueError):
+        list(iter_snapshot(str(path)))
+    path.write_text("{}\n")
+    with pytest.raises(ValueError):
+        list(iter_snapshot(str(path)))
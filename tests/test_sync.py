@@ -0,0 +1,69 @@
+"""Tests of KongSync diff and apply."""
+import pytest
+from pumpwood_kong.sync import KongSync, SyncAction, expand_service_url
+
+
+services = [{"name": "auth", "url": "http://auth:5000/"}]
+routes = [
+    {"name": "auth--health", "paths": ["/health/auth/"],
+     "service": {"name": "auth"}},
+    {"name": "auth--endpoints", "paths": ["/rest/b/", "/rest/a/"],
+     "service": {"name": "auth"}}]
+
+
+def _actions(plan) -> dict:
+    return dict(((x.entity, x.name), x.action) for x in plan.actions)
+
+
+def test_expand_service_url():
+    assert expand_service_url({"name": "a", "url": "https://a/x"}) == {
+        "name": "a", "protocol": "https", "host": "a", "port": 443,
+        "path": "/x"}
+
+
+def test_sync_writes_only_changes(kong_api, fake_kong):
+    sync = KongSync(kong_api)
+    plan = sync.sync(services=services, routes=routes)
+    assert plan.summary()["create"] == 3
+
+    fake_kong.reset_stats()
+    plan = sync.sync(services=services, routes=[
+        routes[0], dict(routes[1], paths=["/rest/a/", "/rest/b/"])])
+    assert plan.summary()["noop"] == 3
+    assert "PUT" not in fake_kong.request_count
+
+    plan = sync.sync(
+        services=[{"name": "auth", "url": "http://auth:6000/"}],
+        routes=routes, dry_run=True)
+    assert _actions(plan)[("service", "auth")] == SyncAction.UPDATE
+    assert plan.pending()[0].changes["port"] == [5000, 6000]
+    assert kong_api.get_service("auth")["port"] == 5000
+
+
+def test_sync_prune(kong_api):
+    KongSync(kong_api).sync(services=services, routes=routes)
+    plan = KongSync(kong_api, prune=True).sync(
+        services=services, routes=routes[:1])
+    assert _actions(plan)[("route", "auth--endpoints")] == SyncAction.DELETE
+    assert [x["name"] for x in kong_api.iter_routes()] == ["auth--health"]
+
+
+def test_sync_prune_keeps_services(kong_api):
+    KongSync(kong_api).sync(services=services, routes=routes)
+    plan = KongSync(kong_api, prune=True).sync(services=services, routes=[])
+    assert [x.entity for x in plan.actions if x.action == "delete"] == [
+        "route", "route"]
+    assert [x["name"] for x in kong_api.iter_services()] == ["auth"]
+    assert list(kong_api.iter_routes()) == []
+
+
+def test_apply_sets_results_before_raising(kong_api):
+    sync = KongSync(kong_api)
+    plan = sync.plan(services=services, routes=[
+        {"name": "broken", "paths": ["/x/"],
+         "service": {"name": "missing"}}])
+    with pytest.raises(Exception):
+        sync.apply(plan)
+    results = dict((x.name, x.result) for x in plan.actions)
+    assert results["auth"]["name"] == "auth"
+    assert results["broken"] is None
@@ -0,0 +1,101 @@
+"""Tests of KongWatcher."""
+import asyncio
+import time
+from pumpwood_kong.kong_api import KongAPI
+from pumpwood_kong.watch import KongWatcher
+
+
+def _load(fake_kong, services: list):
+    fake_kong.state.load_declarative({
+        "_format_version": "3.0",
+        "services": [
+            {"name": x, "url": "http://{}:5000/".format(x)}
+            for x in services]})
+
+
+def _fail_once(watcher: KongWatcher, entity: str = "services"):
+    iterator = watcher._iterators[entity]
+    failures = [RuntimeError("Kong is down")]
+
+    def failing(**kwargs):
+        if failures:
+            raise failures.pop()
+        return iterator(**kwargs)
+
+    watcher._iterators[entity] = failing
+
+
+def test_poll_events(kong_api):
+    watcher = KongWatcher(kong_api)
+    assert watcher.poll() == []
+    kong_api.register_service("auth", "http://auth:5000/")
+    kong_api.register_route("/rest/", "auth--rest", service_name="auth")
+    events = watcher.poll()
+    assert [(x.entity, x.action, x.name) for x in events] == [
+        ("services", "added", "auth"), ("routes", "added", "auth--rest")]
+    assert watcher.poll() == []
+
+    kong_api.register_service("auth", "http://auth:6000/")
+    event, = watcher.poll()
+    assert (event.action, event.old["port"], event.new["port"]) == (
+        "changed", 5000, 6000)
+
+    kong_api.delete_route("auth--rest")
+    event, = watcher.poll()
+    assert (event.entity, event.action) == ("routes", "removed")
+
+
+def test_emit_initial(kong_api):
+    kong_api.register_service("auth", "http://auth:5000/")
+    watcher = KongWatcher(kong_api, emit_initial=True)
+    assert [x.name for x in watcher.poll()] == ["auth"]
+
+
+def test_dbless_skips_unchanged(dbless_fake_kong):
+    watcher = KongWatcher(KongAPI(dbless_fake_kong.url))
+    watcher.poll()
+    assert watcher.poll() == []
+    assert watcher.skipped_polls == 1
+    _load(dbless_fake_kong, ["auth"])
+    assert [x.name for x in watcher.poll()] == ["auth"]
+
+
+def test_dbless_failed_poll_is_not_skipped(dbless_fake_kong):
+    watcher = KongWatcher(KongAPI(dbless_fake_kong.url))
+    watcher.poll()
+    _load(dbless_fake_kong, ["auth"])
+    _fail_once(watcher)
+    try:
+        watcher.poll()
+    except RuntimeError:
+        pass
+    assert [x.name for x in watcher.poll()] == ["auth"]
+    assert watcher.skipped_polls == 0
+
+
+def test_background_thread_survives_errors(kong_api):
+    watcher = KongWatcher(kong_api, interval=0.05)
+    events = []
+    watcher.subscribe(events.append)
+    watcher.poll()
+    _fail_once(watcher)
+    watcher.start()
+    try:
+        kong_api.register_service("auth", "http://auth:5000/")
+        deadline = time.monotonic() + 5
+        while not events and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        watcher.stop()
+    assert [x.name for x in events] == ["auth"]
+
+
+def test_aiter_events(kong_api):
+    watcher = KongWatcher(kong_api, interval=0)
+    watcher.poll()
+    kong_api.register_service("auth", "http://auth:5000/")
+
+    async def consume():
+        return [x async for x in watcher.aiter_events(max_polls=2)]
+
+    assert [x.name for x in asyncio.run(consume())] == ["auth"]